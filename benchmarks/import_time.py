@@ -0,0 +1,130 @@
+"""Import time benchmark of the bp CLI.
+
+Imports the CLI and runs the cheap commands in fresh interpreters, and
+fails if any of them takes longer than the limit, or if importing the CLI
+loads any of the heavy libraries. The help pages are only reported: most
+of their time goes to rich rendering them, which doesn't depend on us.
+Run it from the root of the repository after installing the package:
+
+    python benchmarks/import_time.py
+    python benchmarks/import_time.py --limit 150 --runs 10
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+DEFAULT_LIMIT_MS = 200
+DEFAULT_RUNS = 5
+
+# Libraries the light commands must not load
+HEAVY_MODULES = [
+    "dask",
+    "dask_jobqueue",
+    "gcsfs",
+    "google.cloud.storage",
+    "matplotlib",
+    "netCDF4",
+    "numpy",
+    "pandas",
+    "xarray",
+]
+
+COMMANDS = {
+    "bp tem": ["tem"],
+}
+
+HELP_COMMANDS = {
+    "bp --help": ["--help"],
+    "bp batch --help": ["batch", "--help"],
+    "bp monitor --help": ["monitor", "--help"],
+}
+
+RUN_CLI = (
+    "import sys; from batch_processing.main import main; "
+    "sys.argv = ['bp'] + sys.argv[1:]; main()"
+)
+
+
+def time_command(args, runs):
+    """Returns the wall times of the given CLI arguments in milliseconds."""
+    env = dict(os.environ, USER=os.getenv("USER", "benchmark"))
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable, "-c", RUN_CLI, *args],
+            env=env,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def time_import(runs):
+    """Returns the times of importing the CLI in milliseconds."""
+    code = (
+        "import time; start = time.perf_counter(); import batch_processing.main; "
+        "print((time.perf_counter() - start) * 1000)"
+    )
+    env = dict(os.environ, USER=os.getenv("USER", "benchmark"))
+    return [
+        float(subprocess.check_output([sys.executable, "-c", code], env=env, text=True))
+        for _ in range(runs)
+    ]
+
+
+def report(name, timings, limit=None):
+    """Prints the timings and returns whether they are above the limit."""
+    # the median is less sensitive to a cold file system cache
+    median = statistics.median(timings)
+    failed = limit is not None and median > limit
+    status = "    " if limit is None else ("FAIL" if failed else "ok  ")
+    print(f"{status} {name:<20} median {median:6.1f} ms, min {min(timings):6.1f} ms")
+    return failed
+
+
+def find_heavy_modules():
+    """Returns the heavy modules loaded by importing the CLI."""
+    code = (
+        "import sys, batch_processing.main; "
+        f"print('\\n'.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    )
+    env = dict(os.environ, USER=os.getenv("USER", "benchmark"))
+    output = subprocess.check_output([sys.executable, "-c", code], env=env, text=True)
+    return output.split()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--limit", type=float, default=DEFAULT_LIMIT_MS, help="Limit in ms"
+    )
+    parser.add_argument(
+        "--runs", type=int, default=DEFAULT_RUNS, help="Runs per command"
+    )
+    args = parser.parse_args()
+
+    failed = False
+    heavy = find_heavy_modules()
+    if heavy:
+        print(f"FAIL importing the CLI loads {', '.join(heavy)}")
+        failed = True
+
+    failed = report("import", time_import(args.runs), args.limit) or failed
+    for name, command_args in COMMANDS.items():
+        failed = (
+            report(name, time_command(command_args, args.runs), args.limit) or failed
+        )
+    for name, command_args in HELP_COMMANDS.items():
+        report(name, time_command(command_args, args.runs))
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -8,16 +8,25 @@ DEFAULT_BASEDIR = "/opt/apps"
 DVMDOSTEM_FOLDER = "dvm-dos-tem"
 
 
-def get_basedir_from_config() -> str:
-    """Read basedir from config file if it exists."""
+def read_config() -> dict:
+    """Read the config file, an empty config if it doesn't exist or is broken."""
     if CONFIG_FILE_PATH.exists():
         try:
             with open(CONFIG_FILE_PATH, "r") as f:
-                config = json.load(f)
-                return config.get("basedir", DEFAULT_BASEDIR)
+                return json.load(f)
         except (json.JSONDecodeError, IOError):
             pass
-    return DEFAULT_BASEDIR
+    return {}
+
+
+def write_config(config: dict) -> None:
+    with open(CONFIG_FILE_PATH, "w") as f:
+        json.dump(config, f, indent=2)
+
+
+def get_basedir_from_config() -> str:
+    """Read basedir from config file if it exists."""
+    return read_config().get("basedir", DEFAULT_BASEDIR)
 
 
 class BaseCommand(ABC):
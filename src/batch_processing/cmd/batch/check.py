@@ -1,10 +1,81 @@
+import csv
 import os
+import re
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from collections import defaultdict
-from typing import Tuple, Dict
+from typing import Tuple, Dict, List, Optional, Set
 
 from batch_processing.cmd.base import BaseCommand
-from batch_processing.utils.utils import get_batch_number, get_batch_folders
+from batch_processing.utils.manifest import get_batch_dirs
+from batch_processing.utils.utils import (
+    get_batch_number,
+    read_json_file,
+    read_text_file,
+)
+
+# Run stages of dvmdostem by their year flags in slurm_runner.sh. The pre-run
+# doesn't write any output files.
+STAGE_FLAGS = {"e": "eq", "s": "sp", "t": "tr", "n": "sc"}
+# Columns of output_spec.csv, from the finest to the coarsest resolution
+RESOLUTIONS = [("Daily", "daily"), ("Monthly", "monthly"), ("Yearly", "yearly")]
+
+
+def get_run_stages(batch_dir: Path) -> List[str]:
+    """Returns the stages that the job script of the batch runs for at least a year."""
+    script = read_text_file(batch_dir / "slurm_runner.sh")
+    years = dict(re.findall(r"(?<!\S)-([pestn]) (\d+)(?!\S)", script))
+    return [stage for flag, stage in STAGE_FLAGS.items() if int(years.get(flag, 0)) > 0]
+
+
+def get_expected_output_files(batch_dir: Path) -> Set[str]:
+    """
+    Returns the names of the output files that every batch should have, e.g.
+    GPP_monthly_tr.nc, from the output_spec.csv and the run stages of the
+    given batch.
+
+    Only the finest resolution of a variable is expected, so the set doesn't
+    include files dvmdostem may not write. It is empty if the batch isn't
+    configured.
+    """
+    config_path = batch_dir / "config" / "config.js"
+    if not config_path.exists() or not (batch_dir / "slurm_runner.sh").exists():
+        return set()
+
+    io_config = read_json_file(config_path).get("IO", {})
+    default_spec_path = batch_dir / "config" / "output_spec.csv"
+    spec_path = Path(io_config.get("output_spec_file", default_spec_path))
+    if not spec_path.exists():
+        return set()
+
+    # stages can be turned off in config.js, e.g. "output_nc_eq": 0
+    stages = [
+        stage
+        for stage in get_run_stages(batch_dir)
+        if io_config.get(f"output_nc_{stage}", 1)
+    ]
+
+    expected = set()
+    with open(spec_path, newline="") as file:
+        for row in csv.DictReader(file):
+            for column, resolution in RESOLUTIONS:
+                value = (row.get(column) or "").strip()
+                if value and value.lower() != "invalid":
+                    expected.update(
+                        f"{row['Name']}_{resolution}_{stage}.nc" for stage in stages
+                    )
+                    break
+
+    return expected
+
+
+def scan_output_files(batch_dir: Path) -> Set[str]:
+    """Returns the names of the files in the output folder of the batch."""
+    try:
+        with os.scandir(batch_dir / "output") as entries:
+            return {entry.name for entry in entries if entry.is_file()}
+    except (FileNotFoundError, NotADirectoryError):
+        return set()
 
 
 class BatchCheckCommand(BaseCommand):
@@ -12,38 +83,68 @@ class BatchCheckCommand(BaseCommand):
         super().__init__()
         self._args = args
         self.base_batch_dir = Path(self.exacloud_user_dir, args.batches)
+        # Output file names of every batch, keyed by batch number. The output
+        # folders are listed once and the later checks reuse the listing.
+        self.output_files: Optional[Dict[int, Set[str]]] = None
+
+    def _scan_output_files(self, path: Path) -> Dict[int, Set[str]]:
+        """Lists the output folders of the batches in parallel, once."""
+        if self.output_files is None:
+            batch_folders = get_batch_dirs(path)
+            with ThreadPoolExecutor(max_workers=os.cpu_count() * 2) as executor:
+                listings = executor.map(scan_output_files, batch_folders)
+                self.output_files = {
+                    get_batch_number(folder): files
+                    for folder, files in zip(batch_folders, listings)
+                }
+
+        return self.output_files
 
     def _check_equal_output_files(self, path: Path) -> Tuple[bool, Dict[int, int]]:
         """
         Check if all batch folders have the same number of output files in their output/ subfolder.
-        
+
         Args:
             path (Path): Path to the directory containing batch folders
-            
+
         Returns:
-            Tuple[bool, Dict[int, int]]: 
+            Tuple[bool, Dict[int, int]]:
                 - Boolean indicating if all batch folders have the same number of output files
                 - Dictionary mapping batch numbers to their file counts
         """
-        batch_folders = get_batch_folders(path)
+        batch_file_counts = {
+            batch_num: len(files)
+            for batch_num, files in self._scan_output_files(path).items()
+        }
 
-        batch_file_counts = {}
+        file_count_values = list(batch_file_counts.values())
+        all_equal = all(count == file_count_values[0] for count in file_count_values)
 
-        for folder in batch_folders:
-            batch_num = get_batch_number(folder)
-            output_dir = folder / "output"
+        return all_equal, batch_file_counts
 
-            if not output_dir.exists() or not output_dir.is_dir():
-                batch_file_counts[batch_num] = 0
-                continue
+    def _check_expected_output_files(self, path: Path) -> Dict[int, Set[str]]:
+        """
+        Returns the batches that miss some of the output files expected from
+        output_spec.csv, with the names of the missing files.
+        """
+        output_files = self._scan_output_files(path)
+        if not output_files:
+            return {}
 
-            file_count = sum(1 for entry in os.scandir(output_dir) if entry.is_file())
-            batch_file_counts[batch_num] = file_count
+        first_batch_dir = path / f"batch_{min(output_files)}"
+        try:
+            expected = get_expected_output_files(first_batch_dir)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Couldn't read the expected output files of {first_batch_dir}: {e}")
+            return {}
 
-        file_count_values = list(batch_file_counts.values())
-        all_equal = all(count == file_count_values[0] for count in file_count_values)
+        missing = {}
+        for batch_num, files in output_files.items():
+            missing_files = expected - files
+            if missing_files:
+                missing[batch_num] = missing_files
 
-        return all_equal, batch_file_counts
+        return missing
 
     def _diagnose_output_files(self, counts: Dict[int, int]) -> None:
         # Group batches by file count for more concise reporting
@@ -66,6 +167,16 @@ class BatchCheckCommand(BaseCommand):
                 batch_nums_str = ", ".join(f"batch_{b}" for b in sorted(batch_nums))
                 print(f"- {len(batch_nums)} batches with {file_count} files ({max_files - file_count} missing): {batch_nums_str}")
 
+    def _diagnose_missing_files(self, missing: Dict[int, Set[str]]) -> None:
+        print(
+            f"{len(missing)} batches don't have all of the output files "
+            "in output_spec.csv:"
+        )
+        for batch_num, files in sorted(missing.items()):
+            names = sorted(files)
+            more = f" and {len(names) - 5} more" if len(names) > 5 else ""
+            print(f"- batch_{batch_num} is missing {', '.join(names[:5])}{more}")
+
     def execute(self):
         print("Checking to see if every batch folder has equal number of output files...")
         equal, counts = self._check_equal_output_files(self.base_batch_dir)
@@ -73,10 +184,15 @@ class BatchCheckCommand(BaseCommand):
             print("No batch folders found. Aborting.")
             return
 
+        missing = self._check_expected_output_files(self.base_batch_dir)
+        if missing:
+            self._diagnose_missing_files(missing)
+
         if equal:
             file_count = next(iter(counts.values()), 0)
             print(f"All {len(counts)} batch folders have {file_count} output files.")
-            print("The check is passed!")
+            if not missing:
+                print("The check is passed!")
             return
 
         self._diagnose_output_files(counts)
@@ -1,13 +1,27 @@
 import gcsfs
 import xarray as xr
-import glob
 from pathlib import Path
 import numpy as np
-from dask.distributed import Client
 
 from batch_processing.cmd.base import BaseCommand
 from batch_processing.cmd.batch.check import BatchCheckCommand
-from batch_processing.utils.utils import get_batch_number, get_dimensions, get_gcsfs, get_cluster
+from batch_processing.cmd.batch.rebalance import stitch_sub_batches
+from batch_processing.cmd.batch.retry import (
+    find_failed_batches,
+    record_batch_statuses,
+    update_retry_state,
+)
+from batch_processing.utils.manifest import get_batch_dirs
+from batch_processing.utils.utils import (
+    get_batch_number,
+    get_dimensions,
+    get_gcsfs,
+    plan_cluster,
+    read_runtimes,
+    start_cluster,
+)
+
+DASK_CHUNK_BYTES = 128 * 1024**2
 
 
 class BatchMergeCommand(BaseCommand):
@@ -19,14 +33,27 @@ class BatchMergeCommand(BaseCommand):
         self.base_batch_dir = Path(self.exacloud_user_dir, args.batches)
         self.result_dir = self.base_batch_dir / "all_merged"
         self.result_dir.mkdir(parents=True, exist_ok=True)
+        # Output file names of every batch, listed once by the check
+        self._output_files = None
 
     def _get_available_batches(self):
         """Get list of available batch directories, sorted by batch number."""
-        batch_dirs = []
-        for p in self.base_batch_dir.iterdir():
-            if "batch_" in p.as_posix() and p.is_dir():
-                batch_dirs.append(p)
-        return sorted(batch_dirs, key=lambda x: get_batch_number(x.name))
+        return [p for p in get_batch_dirs(self.base_batch_dir) if p.is_dir()]
+
+    def _has_output_file(self, batch_dir, output_file):
+        """Check if the batch has the given output file, from the listing if any."""
+        if self._output_files is None:
+            return (batch_dir / "output" / output_file).exists()
+        batch_files = self._output_files.get(get_batch_number(batch_dir.name), ())
+        return output_file in batch_files
+
+    def _get_batch_files(self, output_file):
+        """Get the given output file of every batch that has it, in batch order."""
+        return [
+            (batch_dir / "output" / output_file).as_posix()
+            for batch_dir in get_batch_dirs(self.base_batch_dir)
+            if self._has_output_file(batch_dir, output_file)
+        ]
 
     def _get_available_output_files(self):
         """Get list of output files from the first available batch."""
@@ -34,6 +61,10 @@ class BatchMergeCommand(BaseCommand):
         if not batch_dirs:
             return []
         
+        if self._output_files is not None:
+            batch_number = get_batch_number(batch_dirs[0].name)
+            return sorted(self._output_files.get(batch_number, ()))
+
         first_batch_output_dir = batch_dirs[0] / "output"
         if not first_batch_output_dir.exists():
             return []
@@ -55,7 +86,7 @@ class BatchMergeCommand(BaseCommand):
         
         for batch_dir in available_batches:
             file_path = batch_dir / "output" / output_file
-            if file_path.exists():
+            if self._has_output_file(batch_dir, output_file):
                 available_files.append(file_path.as_posix())
                 batch_coords.append(get_batch_number(batch_dir.name))
             else:
@@ -210,8 +241,7 @@ class BatchMergeCommand(BaseCommand):
 
     def _merge_small_dataset(self, output_file, output_path):
         """Original merge method for small datasets - kept for compatibility."""
-        path = self.base_batch_dir / "batch_*" / "output" / output_file
-        files = sorted(glob.glob(path.as_posix()), key=get_batch_number)
+        files = self._get_batch_files(output_file)
         concat_dim = "y"
         if output_file.startswith("restart") or output_file == "run_status.nc":
             concat_dim = "Y"
@@ -223,8 +253,7 @@ class BatchMergeCommand(BaseCommand):
     def _merge(self, output_file, bucket_path):
         """Original merge method for large datasets - kept for compatibility."""
         fs = get_gcsfs()
-        path = self.base_batch_dir / "batch_*" / "output" / output_file
-        files = sorted(glob.glob(path.as_posix()), key=get_batch_number)
+        files = self._get_batch_files(output_file)
         print(f"Reading {output_file}")
 
         concat_dim = "y"
@@ -241,13 +270,22 @@ class BatchMergeCommand(BaseCommand):
 
     def _merge_with_dask(self, bucket_path):
         """Original dask merge method - kept for compatibility."""
-        cluster = get_cluster(n_workers=10)
-        client = Client(cluster)
-        client.wait_for_workers(5)
-        print(f"Dashboard link: {client.dashboard_link}")
-
         path = self.base_batch_dir / "batch_0" / "output"
-        output_files = [f.name for f in path.iterdir()]
+        # the listing of the check is reused instead of listing the folder
+        output_files = self._get_available_output_files()
+
+        # the files are merged one after another, each one in dask's
+        # default ~128MB chunks. The batches are about the same size, so the
+        # data is sized from the first one without listing the others.
+        batch_bytes = sum((path / f).stat().st_size for f in output_files)
+        data_bytes = batch_bytes * len(get_batch_dirs(self.base_batch_dir))
+        plan = plan_cluster(
+            data_bytes=data_bytes,
+            task_count=max(1, data_bytes // DASK_CHUNK_BYTES),
+            chunk_bytes=DASK_CHUNK_BYTES,
+        )
+        cluster, client = start_cluster(plan)
+        print(f"Dashboard link: {client.dashboard_link}")
 
         for f in output_files:
             obj = self._merge(f, bucket_path)
@@ -258,10 +296,8 @@ class BatchMergeCommand(BaseCommand):
 
     def _check_status(self):
         """Check run status - modified to be more lenient with missing batches."""
-        run_status_file_pattern = f"{self.base_batch_dir.as_posix()}/batch_*/output/run_status.nc"
-        
         # Find all available run_status files
-        available_status_files = glob.glob(run_status_file_pattern)
+        available_status_files = self._get_batch_files("run_status.nc")
         
         if not available_status_files:
             print("No run_status.nc files found. Cannot check status.")
@@ -302,11 +338,24 @@ class BatchMergeCommand(BaseCommand):
 
     def execute(self):
         """Main execution method with hybrid approach."""
+        # batches split by `bp batch rebalance` are put back together first
+        stitch_sub_batches(self.base_batch_dir)
+
         internal_check_command = BatchCheckCommand(self._args)
         
         # Get the check result to determine if files are missing/incomplete
         equal_files_check, file_counts = internal_check_command._check_equal_output_files(self.base_batch_dir)
+        # the check reuses the listing of the output folders, and so does the merge
         internal_check_command.execute()
+        self._output_files = internal_check_command.output_files
+
+        # the manifest and the batches resubmitted by `bp batch retry` record
+        # which batches are done and which failed
+        failed = find_failed_batches(self.base_batch_dir, file_counts)
+        record_batch_statuses(self.base_batch_dir, failed)
+        still_failing = update_retry_state(self.base_batch_dir, failed)
+        for batch, reason in still_failing.items():
+            print(f"{batch} is still failing after retrying: {reason}")
 
         if not self._check_status():
             print("Cancelled.")
@@ -331,7 +380,7 @@ class BatchMergeCommand(BaseCommand):
         print(f"Found {len(output_files)} output files to merge")
 
         # Check if we should use canvas approach
-        total_expected_batches = len([p for p in self.base_batch_dir.iterdir() if "batch_" in p.as_posix()])
+        total_expected_batches = len(get_batch_dirs(self.base_batch_dir))
         has_missing_batch_dirs = len(available_batches) < total_expected_batches
         has_unequal_files = not equal_files_check
         
@@ -377,38 +426,16 @@ class BatchMergeCommand(BaseCommand):
         run_status_file = self.result_dir / "run_status.nc"
         if run_status_file.exists():
             try:
-                ds = xr.open_dataset(run_status_file.as_posix(), engine="h5netcdf")
-                # Filter out fill values and get valid runtime values
-                total_runtime_values = ds.total_runtime.values.flatten()
-                
-                # Check if data is stored as timedelta64 or numeric
-                if np.issubdtype(total_runtime_values.dtype, np.timedelta64):
-                    # Handle timedelta64 data - filter out NaT and negative values
-                    valid_mask = ~np.isnat(total_runtime_values)
-                    valid_runtimes = total_runtime_values[valid_mask]
-                    
-                    if len(valid_runtimes) > 0:
-                        # Convert to seconds 
-                        runtimes_in_seconds = valid_runtimes / np.timedelta64(1, 's')
-                        # Filter out negative and zero values (invalid runtimes)
-                        positive_mask = runtimes_in_seconds > 0
-                        runtimes_in_seconds = runtimes_in_seconds[positive_mask]
-                    else:
-                        runtimes_in_seconds = []
-                else:
-                    # Handle numeric data (int or float)
-                    # Filter out NaN, negative values, and specific fill values
-                    valid_mask = (~np.isnan(total_runtime_values)) & (total_runtime_values > 0) & (total_runtime_values != -9999)
-                    valid_runtimes = total_runtime_values[valid_mask]
-                    runtimes_in_seconds = valid_runtimes.astype(float)
-                
+                runtimes_in_seconds = read_runtimes(run_status_file)
                 if len(runtimes_in_seconds) > 0:
                     average_cell_runtime = np.mean(runtimes_in_seconds)
                     print(f"The average cell run time is {average_cell_runtime} seconds ({round(average_cell_runtime / 60, 2)} min)")
-                    print(f"Calculated from {len(runtimes_in_seconds)} valid runtime values out of {len(total_runtime_values)} total cells")
+                    print(
+                        f"Calculated from {len(runtimes_in_seconds)} "
+                        "valid runtime values"
+                    )
                 else:
                     print("No valid runtime data found. All values are fill values.")
-                ds.close()
             except Exception as e:
                 print(f"Could not calculate average runtime: {e}")
         else:
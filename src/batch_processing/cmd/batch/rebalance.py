@@ -0,0 +1,308 @@
+import re
+import shutil
+import subprocess
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+import xarray as xr
+from netCDF4 import Dataset
+
+from batch_processing.cmd.base import BaseCommand
+from batch_processing.cmd.elapsed import JOBS_FILE_NAME
+from batch_processing.cmd.slice_input import SliceTask, create_tiles, slice_file
+from batch_processing.utils.manifest import REBALANCED_STATUS, update_batch_jobs
+from batch_processing.utils.utils import (
+    INPUT_FILES,
+    INPUT_FILES_TO_COPY,
+    get_job_id,
+    read_json_file,
+    read_text_file,
+    run_sacct,
+    submit_job,
+    update_config,
+    write_json_file,
+    write_text_file,
+)
+
+# Keeps the layout of the rebalanced batches: the X range and the job of
+# every sub-batch. `bp batch merge` stitches the sub-batches back into their
+# parent batch with it.
+REBALANCE_FILE_NAME = "rebalance.json"
+
+DEFAULT_SUB_BATCH_COUNT = 4
+DEFAULT_STRAGGLER_FACTOR = 2.0
+# Number of finished batches needed to know what a typical run time is
+DEFAULT_MIN_FINISHED = 5
+
+
+def read_layout(base_batch_dir: Path) -> dict:
+    path = base_batch_dir / REBALANCE_FILE_NAME
+    return read_json_file(path) if path.exists() else {"batches": {}}
+
+
+def find_stragglers(
+    job_ids: Dict[str, str], factor: float, min_finished: int
+) -> Dict[str, str]:
+    """
+    Returns the running batches that have been running for more than
+    `factor` times the median run time of the finished batches.
+
+    Args:
+        job_ids: Dictionary mapping batch names to their job IDs
+        factor: How many times the median run time a straggler runs for
+        min_finished: Minimum number of finished batches to compare with
+
+    Returns:
+        Dictionary mapping the batch names of the stragglers to their job IDs
+    """
+    records = run_sacct(list(job_ids.values()), ["JobID", "State", "ElapsedRaw"])
+    batch_by_job = {job_id: batch for batch, job_id in job_ids.items()}
+
+    finished = []
+    running = {}
+    for record in records:
+        batch = batch_by_job.get(record["JobID"])
+        if batch is None or not record["ElapsedRaw"]:
+            continue
+
+        elapsed = int(record["ElapsedRaw"])
+        if record["State"] == "COMPLETED":
+            finished.append(elapsed)
+        elif record["State"] == "RUNNING":
+            running[batch] = elapsed
+
+    if len(finished) < min_finished:
+        print(
+            f"Only {len(finished)} batches are finished, at least {min_finished} "
+            "are needed to detect stragglers."
+        )
+        return {}
+
+    threshold = factor * np.median(finished)
+    print(
+        f"Median run time of {len(finished)} finished batches: "
+        f"{np.median(finished):.0f}s"
+    )
+    return {
+        batch: job_ids[batch]
+        for batch, elapsed in running.items()
+        if elapsed > threshold
+    }
+
+
+def _write_sub_batch_script(batch_dir: Path, sub_dir: Path, sub_index: int) -> None:
+    """Writes the parent's slurm_runner.sh with the paths of the sub-batch."""
+    script = read_text_file(batch_dir / "slurm_runner.sh")
+    script = script.replace(f"{batch_dir}/", f"{sub_dir}/")
+    script = re.sub(
+        r'^(#SBATCH --job-name=)"?([^"\n]+)"?',
+        rf'\1"\2-sub-{sub_index}"',
+        script,
+        flags=re.MULTILINE,
+    )
+    script = re.sub(
+        r"^(#SBATCH -o \S+)", rf"\1-sub-{sub_index}", script, flags=re.MULTILINE
+    )
+    write_text_file(sub_dir / "slurm_runner.sh", script)
+
+
+def split_batch(batch_dir: Path, sub_batch_count: int) -> List[dict]:
+    """
+    Splits the X range of a batch into sub-batches with about the same
+    number of active cells, each in batch_dir/sub_<index>.
+
+    The input files are sliced with the tile slicer of `bp slice_input`, and
+    the configuration, parameters and job script of the parent batch are
+    reused with the paths of the sub-batch. Raises if any input can't be
+    sliced or copied, so incomplete sub-batches aren't submitted.
+
+    Returns:
+        The layout of the sub-batches: their names and X ranges
+    """
+    with Dataset(batch_dir / "input" / "run-mask.nc") as dataset:
+        run_mask = np.asarray(dataset.variables["run"][:]).astype(int)
+
+    tiles = create_tiles(run_mask, 1, sub_batch_count)
+    sub_dirs = []
+    for tile in tiles:
+        sub_dir = batch_dir / f"sub_{tile.id}"
+        if sub_dir.exists():
+            shutil.rmtree(sub_dir)
+
+        (sub_dir / "input").mkdir(parents=True)
+        (sub_dir / "output").mkdir()
+        for folder in ("config", "parameters", "calibration"):
+            if (batch_dir / folder).exists():
+                shutil.copytree(batch_dir / folder, sub_dir / folder)
+
+        update_config(
+            path=(sub_dir / "config" / "config.js").as_posix(), prefix_value=sub_dir
+        )
+        _write_sub_batch_script(batch_dir, sub_dir, tile.id)
+        sub_dirs.append(sub_dir)
+
+    for input_file in INPUT_FILES:
+        src_path = batch_dir / "input" / input_file
+        dest_paths = [sub_dir / "input" / input_file for sub_dir in sub_dirs]
+        if input_file in INPUT_FILES_TO_COPY:
+            for dest_path in dest_paths:
+                shutil.copy(src_path, dest_path)
+        else:
+            slice_file(SliceTask(src_path, tiles, dest_paths, 256 * 1024 * 1024))
+
+    return [
+        {"name": sub_dir.name, "x_start": tile.x.start, "x_end": tile.x.end}
+        for tile, sub_dir in zip(tiles, sub_dirs)
+    ]
+
+
+def stitch_sub_batches(base_batch_dir: Path) -> None:
+    """
+    Writes the outputs of the sub-batches of every rebalanced batch into the
+    output folder of the batch, so merging can treat it as a regular batch.
+
+    Batches whose sub-batches haven't all produced their outputs are left
+    as they are.
+    """
+    layout = read_layout(base_batch_dir)
+    changed = False
+    for batch_name, batch_layout in layout["batches"].items():
+        if batch_layout.get("stitched"):
+            continue
+
+        batch_dir = base_batch_dir / batch_name
+        sub_dirs = [batch_dir / sub["name"] for sub in batch_layout["sub_batches"]]
+        output_files = sorted(
+            path.name for path in (sub_dirs[0] / "output").glob("*.nc")
+        )
+        complete = output_files and all(
+            (sub_dir / "output" / output_file).exists()
+            for sub_dir in sub_dirs
+            for output_file in output_files
+        )
+        if not complete:
+            print(f"Sub-batches of {batch_name} aren't finished yet. Skipping it.")
+            continue
+
+        print(f"Stitching the {len(sub_dirs)} sub-batches of {batch_name}")
+        output_dir = batch_dir / "output"
+        # outputs of the cancelled job are replaced by the stitched ones
+        for path in output_dir.glob("*.nc"):
+            path.unlink()
+
+        for output_file in output_files:
+            concat_dim = "x"
+            if output_file.startswith("restart") or output_file == "run_status.nc":
+                concat_dim = "X"
+
+            datasets = [
+                xr.open_dataset(
+                    sub_dir / "output" / output_file,
+                    engine="h5netcdf",
+                    decode_times=False,
+                )
+                for sub_dir in sub_dirs
+            ]
+            stitched = xr.concat(datasets, dim=concat_dim, data_vars="minimal")
+            stitched.to_netcdf(output_dir / output_file, engine="h5netcdf")
+            for dataset in datasets:
+                dataset.close()
+
+        batch_layout["stitched"] = True
+        changed = True
+
+    if changed:
+        write_json_file(base_batch_dir / REBALANCE_FILE_NAME, layout)
+
+
+class BatchRebalanceCommand(BaseCommand):
+    def __init__(self, args):
+        super().__init__()
+        self._args = args
+        self.base_batch_dir = Path(self.exacloud_user_dir, args.batches)
+        self.sub_batch_count = getattr(args, "sub_batches", DEFAULT_SUB_BATCH_COUNT)
+        self.straggler_factor = getattr(
+            args, "straggler_factor", DEFAULT_STRAGGLER_FACTOR
+        )
+        self.min_finished = getattr(args, "min_finished", DEFAULT_MIN_FINISHED)
+        self.dry_run = getattr(args, "dry_run", False)
+
+    def execute(self):
+        jobs_path = self.base_batch_dir / JOBS_FILE_NAME
+        if not jobs_path.exists():
+            print(
+                f"{jobs_path} doesn't exist. "
+                "Submit the batches with 'bp batch run' first."
+            )
+            exit(1)
+
+        jobs = read_json_file(jobs_path)
+        layout = read_layout(self.base_batch_dir)
+
+        # sub-batches and already rebalanced batches aren't split again
+        candidates = {
+            batch: job_id
+            for batch, job_id in jobs["jobs"].items()
+            if "/" not in batch and batch not in layout["batches"]
+        }
+        stragglers = find_stragglers(
+            candidates, self.straggler_factor, self.min_finished
+        )
+        if not stragglers:
+            print("No stragglers are found.")
+            return
+
+        print(f"Found {len(stragglers)} stragglers: {', '.join(sorted(stragglers))}")
+        if self.dry_run:
+            return
+
+        # the stragglers are split before any of them is cancelled, so a
+        # batch whose inputs can't be sliced keeps running
+        split = {}
+        for batch in stragglers:
+            print(f"Splitting {batch} into {self.sub_batch_count} sub-batches")
+            try:
+                split[batch] = split_batch(
+                    self.base_batch_dir / batch, self.sub_batch_count
+                )
+            except Exception as e:
+                print(f"Couldn't split {batch}, its job keeps running: {e}")
+
+        if not split:
+            print("None of the stragglers could be split.")
+            exit(1)
+
+        subprocess.run(["scancel", *(stragglers[batch] for batch in split)], check=True)
+
+        for batch, sub_batches in split.items():
+            job_id = stragglers[batch]
+            batch_dir = self.base_batch_dir / batch
+            for sub_batch in sub_batches:
+                name = f"{batch}/{sub_batch['name']}"
+                script_path = batch_dir / sub_batch["name"] / "slurm_runner.sh"
+                result = submit_job(script_path.as_posix())
+                sub_batch["job_id"] = get_job_id(result)
+                if sub_batch["job_id"]:
+                    jobs["jobs"][name] = sub_batch["job_id"]
+                else:
+                    print(f"Couldn't submit {name}: {result.stderr.strip()}")
+
+            layout["batches"][batch] = {
+                "cancelled_job_id": job_id,
+                "sub_batches": sub_batches,
+                "stitched": False,
+            }
+            # the tracker of `bp batch run` reads jobs.json on every poll, so
+            # it follows the sub-batches instead of the cancelled job
+            del jobs["jobs"][batch]
+
+            # written after every batch, so an interrupted rebalance isn't lost
+            write_json_file(self.base_batch_dir / REBALANCE_FILE_NAME, layout)
+            write_json_file(jobs_path, jobs)
+            update_batch_jobs(self.base_batch_dir, {batch: job_id}, REBALANCED_STATUS)
+
+        print(
+            f"{len(split)} batches are split into {self.sub_batch_count} "
+            "sub-batches each and resubmitted."
+        )
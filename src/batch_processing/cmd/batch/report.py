@@ -0,0 +1,252 @@
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict
+
+import numpy as np
+import pandas as pd
+from rich.console import Console
+from rich.table import Table
+
+from batch_processing.cmd.base import BaseCommand
+from batch_processing.cmd.elapsed import JOBS_FILE_NAME
+from batch_processing.utils.manifest import get_batch_dirs
+from batch_processing.utils.utils import (
+    read_json_file,
+    read_runtimes,
+    run_sacct,
+)
+
+REPORT_FILE_NAME = "report.csv"
+DEFAULT_STRAGGLER_FACTOR = 1.5
+SACCT_FIELDS = [
+    "JobID",
+    "State",
+    "Partition",
+    "NodeList",
+    "ElapsedRaw",
+    "TotalCPU",
+    "MaxRSS",
+]
+
+SIZE_UNITS = {"K": 1024, "M": 1024**2, "G": 1024**3, "T": 1024**4}
+
+
+def parse_slurm_duration(value: str) -> float:
+    """Converts a Slurm duration, [DD-[HH:]]MM:SS[.mmm], into seconds."""
+    if not value:
+        return np.nan
+
+    days = 0
+    if "-" in value:
+        day_part, value = value.split("-", 1)
+        days = int(day_part)
+
+    seconds = 0.0
+    for part in value.split(":"):
+        seconds = seconds * 60 + float(part)
+
+    return days * 86400 + seconds
+
+
+def parse_slurm_size(value: str) -> float:
+    """Converts a Slurm memory size, e.g. 1.5G or 2048K, into bytes."""
+    match = re.fullmatch(r"([\d.]+)([KMGT]?)", value or "")
+    if match is None:
+        return np.nan
+
+    number, unit = match.groups()
+    return float(number) * SIZE_UNITS.get(unit, 1)
+
+
+def get_accounting(job_ids: Dict[str, str]) -> Dict[str, dict]:
+    """
+    Returns the Slurm accounting of the given jobs, keyed by batch name.
+
+    Elapsed time, CPU time, partition and node come from the job allocation,
+    MaxRSS is the largest one of its steps.
+    """
+    batch_by_job = {job_id: batch for batch, job_id in job_ids.items()}
+    accounting = {}
+    for record in run_sacct(list(batch_by_job), SACCT_FIELDS, allocations_only=False):
+        job_id, _, step = record["JobID"].partition(".")
+        batch = batch_by_job.get(job_id)
+        if batch is None:
+            continue
+
+        row = accounting.setdefault(batch, {"job_id": job_id, "max_rss_mb": np.nan})
+        if not step:
+            row["state"] = record["State"].split()[0] if record["State"] else ""
+            row["partition"] = record["Partition"]
+            row["node"] = record["NodeList"]
+            row["elapsed_s"] = float(record["ElapsedRaw"] or np.nan)
+            row["total_cpu_s"] = parse_slurm_duration(record["TotalCPU"])
+        else:
+            max_rss = parse_slurm_size(record["MaxRSS"]) / 1024**2
+            row["max_rss_mb"] = np.nanmax([row["max_rss_mb"], max_rss])
+
+    return accounting
+
+
+def get_cell_runtimes(batch_dir: Path) -> dict:
+    """Returns the number of finished cells and their runtimes of a batch."""
+    run_status_path = batch_dir / "output" / "run_status.nc"
+    row = {"cells": 0, "cell_runtime_s": np.nan, "mean_cell_runtime_s": np.nan}
+    if not run_status_path.exists():
+        return row
+
+    try:
+        runtimes = read_runtimes(run_status_path)
+    except Exception as e:
+        print(f"Could not read the runtimes in {run_status_path}: {e}")
+        return row
+
+    if len(runtimes) > 0:
+        row["cells"] = len(runtimes)
+        row["cell_runtime_s"] = float(runtimes.sum())
+        row["mean_cell_runtime_s"] = float(runtimes.mean())
+
+    return row
+
+
+def summarize_by(report: pd.DataFrame, column: str) -> pd.DataFrame:
+    """Returns the throughput of the batches grouped by the given column."""
+    grouped = report.dropna(subset=[column, "elapsed_s"]).groupby(column)
+    summary = grouped.agg(
+        batches=("batch", "count"),
+        cells=("cells", "sum"),
+        elapsed_s=("elapsed_s", "sum"),
+        stragglers=("straggler", "sum"),
+    )
+    summary["cells_per_sec"] = summary["cells"] / summary["elapsed_s"]
+    return summary.sort_values("cells_per_sec").reset_index()
+
+
+class BatchReportCommand(BaseCommand):
+    def __init__(self, args):
+        super().__init__()
+        self._args = args
+        self.base_batch_dir = Path(self.exacloud_user_dir, args.batches)
+        self.straggler_factor = getattr(
+            args, "straggler_factor", DEFAULT_STRAGGLER_FACTOR
+        )
+        output_path = getattr(args, "output_path", None)
+        self.output_path = (
+            Path(output_path) if output_path else self.base_batch_dir / REPORT_FILE_NAME
+        )
+
+    def _get_job_ids(self) -> Dict[str, str]:
+        jobs_path = self.base_batch_dir / JOBS_FILE_NAME
+        if not jobs_path.exists():
+            print(
+                f"{jobs_path} doesn't exist. The report will only have the cell "
+                "runtimes. Submit the batches with 'bp batch run' to record the jobs."
+            )
+            return {}
+
+        return read_json_file(jobs_path)["jobs"]
+
+    def _build_report(self) -> pd.DataFrame:
+        batch_dirs = get_batch_dirs(self.base_batch_dir)
+        job_ids = self._get_job_ids()
+        accounting = get_accounting(job_ids) if job_ids else {}
+
+        with ThreadPoolExecutor(max_workers=os.cpu_count() * 2) as executor:
+            cell_runtimes = list(executor.map(get_cell_runtimes, batch_dirs))
+
+        rows = []
+        for batch_dir, runtimes in zip(batch_dirs, cell_runtimes):
+            row = {"batch": batch_dir.name}
+            row.update(accounting.get(batch_dir.name, {}))
+            row.update(runtimes)
+            rows.append(row)
+
+        columns = [
+            "batch",
+            "job_id",
+            "state",
+            "partition",
+            "node",
+            "elapsed_s",
+            "total_cpu_s",
+            "max_rss_mb",
+            "cells",
+            "cell_runtime_s",
+            "mean_cell_runtime_s",
+        ]
+        report = pd.DataFrame(rows).reindex(columns=columns)
+        report["cells_per_sec"] = report["cells"] / report["elapsed_s"]
+
+        # a straggler takes much longer than a typical batch of the run
+        median_elapsed = report["elapsed_s"].median()
+        report["straggler"] = (
+            report["elapsed_s"] > self.straggler_factor * median_elapsed
+        )
+        return report
+
+    def _write_report(self, report: pd.DataFrame) -> None:
+        if self.output_path.suffix == ".parquet":
+            try:
+                report.to_parquet(self.output_path, index=False)
+            except ImportError:
+                print(
+                    "Writing Parquet files requires pyarrow. "
+                    "Install it with 'pip install pyarrow'."
+                )
+                exit(1)
+        else:
+            report.to_csv(self.output_path, index=False)
+
+    def _print_table(self, title: str, frame: pd.DataFrame) -> None:
+        table = Table(title=title)
+        for column in frame.columns:
+            table.add_column(str(column))
+        for row in frame.itertuples(index=False):
+            table.add_row(
+                *[
+                    f"{value:.3f}" if isinstance(value, float) else str(value)
+                    for value in row
+                ]
+            )
+        Console().print(table)
+
+    def execute(self):
+        if not self.base_batch_dir.exists():
+            print(
+                f"{self.base_batch_dir} doesn't exist. "
+                f"Is {self._args.batches} the correct path?"
+            )
+            exit(1)
+
+        report = self._build_report()
+        if report.empty:
+            print(f"Couldn't find any batch folders in {self.base_batch_dir}.")
+            exit(1)
+
+        self._write_report(report)
+
+        for column in ("partition", "node"):
+            if report[column].notna().any():
+                self._print_table(
+                    f"Throughput per {column}", summarize_by(report, column)
+                )
+
+        stragglers = report[report["straggler"]].sort_values(
+            "elapsed_s", ascending=False
+        )
+        if not stragglers.empty:
+            self._print_table(
+                f"Stragglers (more than {self.straggler_factor}x "
+                "the median elapsed time)",
+                stragglers[
+                    ["batch", "job_id", "node", "elapsed_s", "cells", "cells_per_sec"]
+                ],
+            )
+
+        total_cells = report["cells"].sum()
+        print(
+            f"{len(report)} batches, {total_cells} finished cells, "
+            f"{len(stragglers)} stragglers"
+        )
+        print(f"The report is written to {self.output_path}")
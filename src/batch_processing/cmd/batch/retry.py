@@ -0,0 +1,311 @@
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Optional, Set
+
+import numpy as np
+from netCDF4 import Dataset
+
+from batch_processing.cmd.base import BaseCommand
+from batch_processing.cmd.batch.check import BatchCheckCommand
+from batch_processing.cmd.batch.rebalance import read_layout
+from batch_processing.cmd.elapsed import JOBS_FILE_NAME, TERMINAL_STATES
+from batch_processing.utils.manifest import (
+    DONE_STATUS,
+    FAILED_STATUS,
+    REBALANCED_STATUS,
+    get_batch_dirs,
+    read_manifest,
+    update_batch_jobs,
+    update_batch_statuses,
+)
+from batch_processing.utils.utils import (
+    get_batch_number,
+    get_job_id,
+    read_json_file,
+    read_text_file,
+    run_sacct,
+    submit_job,
+    write_json_file,
+    write_text_file,
+)
+
+# Keeps the retries of every batch. `bp batch merge` reads it to report
+# the batches that are still failing.
+RETRY_FILE_NAME = "retry.json"
+
+SUCCESS_STATUS = 100
+DEFAULT_MAX_ATTEMPTS = 3
+NO_OUTPUT_CLEANUP_FLAG = "--no-output-cleanup"
+
+
+def read_retry_state(base_batch_dir: Path) -> dict:
+    path = base_batch_dir / RETRY_FILE_NAME
+    return read_json_file(path) if path.exists() else {"batches": {}}
+
+
+def get_failure_reason(
+    batch_dir: Path, file_count: int, expected_file_count: int
+) -> Optional[str]:
+    """
+    Returns why the given batch failed, None if it succeeded.
+
+    A batch fails if it has fewer output files than the others, if it has
+    no run_status.nc, or if any of the cells enabled in its run mask
+    doesn't have the success status code.
+    """
+    if file_count < expected_file_count:
+        return f"{expected_file_count - file_count} output files are missing"
+
+    run_status_path = batch_dir / "output" / "run_status.nc"
+    if not run_status_path.exists():
+        return "run_status.nc is missing"
+
+    with Dataset(batch_dir / "input" / "run-mask.nc") as dataset:
+        run_mask = np.asarray(dataset.variables["run"][:]) > 0
+
+    with Dataset(run_status_path) as dataset:
+        run_status = np.ma.filled(dataset.variables["run_status"][:], 0)
+
+    failed_cells = int(np.count_nonzero(run_mask & (run_status != SUCCESS_STATUS)))
+    if failed_cells:
+        return f"{failed_cells} cells failed"
+
+    return None
+
+
+def get_rebalanced_batches(base_batch_dir: Path) -> Set[str]:
+    """
+    Returns the batches that `bp batch rebalance` cancelled and split into
+    sub-batches, from rebalance.json and the manifest.
+    """
+    rebalanced = set(read_layout(base_batch_dir)["batches"])
+    manifest = read_manifest(base_batch_dir)
+    if manifest is not None:
+        rebalanced.update(
+            batch["name"]
+            for batch in manifest["batches"]
+            if batch["status"] == REBALANCED_STATUS
+        )
+    return rebalanced
+
+
+def find_failed_batches(
+    base_batch_dir: Path, file_counts: Dict[int, int]
+) -> Dict[str, str]:
+    """
+    Returns the failed batches of the given folder with their reasons.
+
+    Rebalanced batches are skipped: their sub-batches run in their place and
+    the outputs of the cancelled job are incomplete by design.
+
+    Args:
+        base_batch_dir: Folder of the batches
+        file_counts: Output file counts of the batches, as returned by
+            BatchCheckCommand._check_equal_output_files
+    """
+    expected_file_count = max(file_counts.values(), default=0)
+
+    rebalanced = get_rebalanced_batches(base_batch_dir)
+    failed = {}
+    for batch_dir in get_batch_dirs(base_batch_dir):
+        if batch_dir.name in rebalanced:
+            continue
+
+        file_count = file_counts.get(get_batch_number(batch_dir), 0)
+        try:
+            reason = get_failure_reason(batch_dir, file_count, expected_file_count)
+        except Exception as e:
+            reason = f"couldn't read the run status: {e}"
+
+        if reason:
+            failed[batch_dir.name] = reason
+
+    return failed
+
+
+def record_batch_statuses(
+    base_batch_dir: Path, failed: Dict[str, str], skipped: Set[str] = frozenset()
+) -> None:
+    """
+    Records the batches of the manifest as done, or as failed if they are
+    in `failed`.
+
+    Rebalanced batches are done once their sub-batches are stitched, and
+    the batches in `skipped`, e.g. the ones still running, are left as they
+    are.
+    """
+    layout = read_layout(base_batch_dir)["batches"]
+    rebalanced = get_rebalanced_batches(base_batch_dir)
+    statuses = {}
+    for batch_dir in get_batch_dirs(base_batch_dir):
+        batch = batch_dir.name
+        if batch in skipped:
+            continue
+
+        if batch in rebalanced:
+            if layout.get(batch, {}).get("stitched"):
+                statuses[batch] = DONE_STATUS
+        else:
+            statuses[batch] = FAILED_STATUS if batch in failed else DONE_STATUS
+
+    update_batch_statuses(base_batch_dir, statuses)
+
+
+def update_retry_state(base_batch_dir: Path, failed: Dict[str, str]) -> Dict[str, str]:
+    """
+    Marks the retried batches that don't fail anymore as done.
+
+    Args:
+        base_batch_dir: Folder of the batches
+        failed: Failed batches with their reasons, as returned by
+            find_failed_batches
+
+    Returns:
+        The retried batches that are still failing, with their reasons
+    """
+    state = read_retry_state(base_batch_dir)
+    if not state["batches"]:
+        return {}
+
+    for batch, batch_state in state["batches"].items():
+        if batch in failed:
+            batch_state["status"] = "failed"
+            batch_state["reason"] = failed[batch]
+        else:
+            batch_state["status"] = "done"
+
+    write_json_file(base_batch_dir / RETRY_FILE_NAME, state)
+    return {
+        batch: batch_state["reason"]
+        for batch, batch_state in state["batches"].items()
+        if batch_state["status"] == "failed"
+    }
+
+
+def enable_output_reuse(script_path: Path) -> None:
+    """
+    Adds --no-output-cleanup to the dvmdostem call of the job script, so the
+    outputs and restart files of the previous run are kept.
+    """
+    script = read_text_file(script_path)
+    if NO_OUTPUT_CLEANUP_FLAG in script:
+        return
+
+    script = script.replace(
+        "--max-output-volume=-1", f"--max-output-volume=-1 {NO_OUTPUT_CLEANUP_FLAG}"
+    )
+    write_text_file(script_path, script)
+
+
+class BatchRetryCommand(BaseCommand):
+    def __init__(self, args):
+        super().__init__()
+        self._args = args
+        self.base_batch_dir = Path(self.exacloud_user_dir, args.batches)
+        self.max_attempts = getattr(args, "max_attempts", DEFAULT_MAX_ATTEMPTS)
+        self.dry_run = getattr(args, "dry_run", False)
+
+    def _get_unfinished_batches(self, jobs: Dict[str, str]) -> set:
+        """Returns the batches whose jobs are still pending or running."""
+        if not jobs:
+            return set()
+
+        batch_by_job = {job_id: batch for batch, job_id in jobs.items()}
+        return {
+            batch_by_job[record["JobID"]]
+            for record in run_sacct(list(batch_by_job), ["JobID", "State"])
+            if record["JobID"] in batch_by_job
+            and record["State"].split()[0] not in TERMINAL_STATES
+        }
+
+    def execute(self):
+        if not self.base_batch_dir.exists():
+            print(
+                f"{self.base_batch_dir} doesn't exist. "
+                f"Is {self._args.batches} the correct path?"
+            )
+            exit(1)
+
+        jobs_path = self.base_batch_dir / JOBS_FILE_NAME
+        jobs = read_json_file(jobs_path) if jobs_path.exists() else {"jobs": {}}
+        state = read_retry_state(self.base_batch_dir)
+
+        _, file_counts = BatchCheckCommand(self._args)._check_equal_output_files(
+            self.base_batch_dir
+        )
+        failed = find_failed_batches(self.base_batch_dir, file_counts)
+        unfinished = self._get_unfinished_batches(jobs["jobs"])
+        for batch, batch_state in state["batches"].items():
+            if batch not in failed:
+                batch_state["status"] = "done"
+
+        to_retry = {}
+        for batch, reason in sorted(
+            failed.items(), key=lambda item: get_batch_number(item[0])
+        ):
+            attempts = state["batches"].get(batch, {}).get("attempts", 0)
+            if batch in unfinished:
+                print(
+                    f"{batch}: {reason}, but its job is still in the queue. "
+                    "Skipping it."
+                )
+            elif attempts >= self.max_attempts:
+                print(
+                    f"{batch}: {reason}, already retried {attempts} times. Skipping it."
+                )
+                batch_state = state["batches"].setdefault(batch, {"attempts": 0})
+                batch_state.update({"status": "failed", "reason": reason})
+            else:
+                print(f"{batch}: {reason}")
+                to_retry[batch] = reason
+
+        if not to_retry:
+            print("No batches to retry.")
+            write_json_file(self.base_batch_dir / RETRY_FILE_NAME, state)
+            record_batch_statuses(self.base_batch_dir, failed, unfinished)
+            return
+
+        if self.dry_run:
+            print(f"{len(to_retry)} batches would be retried.")
+            return
+
+        # the resubmitted batches are marked as submitted below
+        record_batch_statuses(self.base_batch_dir, failed, unfinished)
+
+        for batch, reason in to_retry.items():
+            script_path = self.base_batch_dir / batch / "slurm_runner.sh"
+            enable_output_reuse(script_path)
+            result = submit_job(script_path.as_posix())
+            job_id = get_job_id(result)
+            if job_id is None:
+                print(f"Couldn't submit {batch}: {result.stderr.strip()}")
+                continue
+
+            jobs["jobs"][batch] = job_id
+            batch_state = state["batches"].setdefault(batch, {"attempts": 0})
+            batch_state.update(
+                {
+                    "attempts": batch_state["attempts"] + 1,
+                    "job_id": job_id,
+                    "reason": reason,
+                    "status": "submitted",
+                    "submitted_at": datetime.now().isoformat(),
+                }
+            )
+
+        write_json_file(self.base_batch_dir / RETRY_FILE_NAME, state)
+        write_json_file(jobs_path, jobs)
+        update_batch_jobs(
+            self.base_batch_dir,
+            {
+                batch: jobs["jobs"][batch]
+                for batch in to_retry
+                if state["batches"].get(batch, {}).get("status") == "submitted"
+            },
+        )
+        submitted = sum(
+            1
+            for batch in to_retry
+            if state["batches"].get(batch, {}).get("status") == "submitted"
+        )
+        print(f"{submitted} of {len(failed)} failed batches are resubmitted.")
@@ -1,10 +1,18 @@
+from datetime import datetime
 from pathlib import Path
 
 from rich.progress import track
 
 from batch_processing.cmd.base import BaseCommand
-from batch_processing.cmd.elapsed import ElapsedCommand
-from batch_processing.utils.utils import submit_job
+from batch_processing.cmd.elapsed import JOBS_FILE_NAME, ElapsedCommand
+from batch_processing.utils.manifest import get_batch_dirs, update_batch_jobs
+from batch_processing.utils.placement import (
+    COMPUTE_PARTITION,
+    DEFAULT_MAX_PREEMPTION_RISK,
+    plan_placement,
+    write_placement,
+)
+from batch_processing.utils.utils import get_job_id, submit_job, write_json_file
 
 
 class BatchRunCommand(BaseCommand):
@@ -13,9 +21,40 @@ class BatchRunCommand(BaseCommand):
         self._args = args
         self.base_batch_dir = Path(self.exacloud_user_dir, args.batches)
         self._args.base_batch_dir = self.base_batch_dir
+        self.placement = getattr(args, "placement", False)
+        self.max_preemption_risk = getattr(
+            args, "max_preemption_risk", DEFAULT_MAX_PREEMPTION_RISK
+        )
+
+    def _get_partitions(self, full_paths):
+        """Returns the partition to submit every batch to, None keeps the script's."""
+        if not self.placement:
+            return {path: None for path in full_paths}
+
+        placements = plan_placement(full_paths, self.max_preemption_risk)
+        write_placement(self.base_batch_dir, placements)
+
+        moved = [p for p in placements if p.partition != p.default_partition]
+        for placement in moved:
+            print(
+                f"{placement.batch_dir.name}: {placement.work_hours:.1f} cell-hours, "
+                f"{placement.risk:.0%} preemption risk, "
+                f"submitting to {COMPUTE_PARTITION}"
+            )
+        print(
+            f"{len(moved)} of {len(placements)} batches are placed on "
+            f"{COMPUTE_PARTITION}"
+        )
+
+        return {
+            path: placement.partition for path, placement in zip(full_paths, placements)
+        }
 
     def execute(self):
-        full_paths = list(self.base_batch_dir.glob("*/slurm_runner.sh"))
+        full_paths = [
+            batch_dir / "slurm_runner.sh"
+            for batch_dir in get_batch_dirs(self.base_batch_dir)
+        ]
         if len(full_paths) == 0:
             print(
                 "Couldn't find any slurm_runner scripts. ",
@@ -23,9 +62,22 @@ class BatchRunCommand(BaseCommand):
             )
             exit(1)
 
+        partitions = self._get_partitions(full_paths)
+        job_ids = {}
         for path in track(
             full_paths, description="Submitting batches", total=len(full_paths)
         ):
-            submit_job(path.as_posix())
+            result = submit_job(path.as_posix(), partitions[path])
+            job_id = get_job_id(result)
+            if job_id:
+                job_ids[path.parent.name] = job_id
+            else:
+                print(f"Couldn't submit {path}: {result.stderr.strip()}")
+
+        write_json_file(
+            self.base_batch_dir / JOBS_FILE_NAME,
+            {"submitted_at": datetime.now().isoformat(), "jobs": job_ids},
+        )
+        update_batch_jobs(self.base_batch_dir, job_ids)
 
         ElapsedCommand(self._args).execute()
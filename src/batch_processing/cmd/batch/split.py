@@ -1,22 +1,36 @@
-import dask
 import os
 import re
 import shutil
 import subprocess
-import dask.distributed
+import time
 import xarray as xr
-from concurrent.futures import ThreadPoolExecutor
-from multiprocessing import Pool
+from dask.distributed import as_completed
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from multiprocessing import Pool, get_context
 from pathlib import Path
 from typing import List
 
 from batch_processing.cmd.base import BaseCommand
+from batch_processing.cmd.batch.rebalance import REBALANCE_FILE_NAME
+from batch_processing.cmd.batch.retry import RETRY_FILE_NAME
+from batch_processing.cmd.elapsed import JOBS_FILE_NAME
+from batch_processing.utils.manifest import (
+    MANIFEST_FILE_NAME,
+    create_batch_entry,
+    write_manifest,
+)
+from batch_processing.utils.placement import PLACEMENT_FILE_NAME
 from batch_processing.utils.utils import (
     create_slurm_script,
+    delete_in_background,
     interpret_path,
+    make_dirs,
+    move_to_trash,
     update_config,
     get_gcsfs,
-    get_cluster,
+    plan_cluster,
+    start_cluster,
 )
 
 # todo: this list doesn't include co2.nc and projected-co2.c files
@@ -48,6 +62,96 @@ INPUT_FILES_TO_SPLIT = [
 BATCH_DIRS: List[Path] = []
 BATCH_INPUT_DIRS: List[Path] = []
 
+# Remote inputs up to this many GB (uncompressed) are split on this node by
+# streaming their chunks, bigger ones are split by a dask cluster
+DEFAULT_MAX_STREAMING_SIZE = 64
+DEFAULT_STREAMING_WORKERS = 8
+# Memory a streaming worker may use for the rows it reads at once
+STREAMING_BAND_MEMORY = 1024**3
+
+# Old batches are moved into a folder with this prefix in the batch folder,
+# which is then deleted without blocking the split
+TRASH_FOLDER_PREFIX = ".deleting-"
+DEFAULT_CLEANUP_MODE = "background"
+# State of the previous run, keyed by batch name. It's moved to the trash
+# with the old batches before the new ones are created, so it isn't applied
+# to them, even if the split fails halfway.
+RUN_STATE_FILES = (
+    MANIFEST_FILE_NAME,
+    JOBS_FILE_NAME,
+    REBALANCE_FILE_NAME,
+    RETRY_FILE_NAME,
+    PLACEMENT_FILE_NAME,
+)
+
+
+def get_previous_run_paths(base_batch_dir: Path) -> List[Path]:
+    """Returns the batch folders and run state files of the previous split."""
+    if not base_batch_dir.exists():
+        return []
+
+    pattern = re.compile(r"^batch_\d+$")
+    # scandir knows the type of the entries, no stat call per entry
+    with os.scandir(base_batch_dir) as entries:
+        return [
+            Path(entry.path)
+            for entry in entries
+            if (entry.is_dir() and pattern.match(entry.name))
+            or (entry.is_file() and entry.name in RUN_STATE_FILES)
+        ]
+
+
+@lru_cache(maxsize=None)
+def _open_remote_input(bucket_path: str, input_file: str) -> xr.Dataset:
+    """Opens a remote Zarr store lazily, once per process."""
+    mapping = get_gcsfs().get_mapper(os.path.join(bucket_path, input_file), check=True)
+    return xr.open_zarr(mapping, decode_times=False, chunks=None)
+
+
+def get_band_size(ds: xr.Dataset, memory: int = STREAMING_BAND_MEMORY) -> int:
+    """
+    Returns how many Y rows of a dataset are read at once.
+
+    A band is as tall as a Zarr chunk along Y, so every chunk is fetched
+    once, unless it doesn't fit in `memory`.
+    """
+    y_vars = [var for var in ds.data_vars.values() if "Y" in var.dims]
+    if not y_vars:
+        return ds.Y.size
+
+    row_bytes = sum(var.nbytes for var in y_vars) // ds.Y.size
+    chunks = y_vars[0].encoding.get("chunks") or y_vars[0].shape
+    chunk_rows = chunks[y_vars[0].dims.index("Y")]
+    return max(1, min(chunk_rows, memory // max(row_bytes, 1)))
+
+
+def split_remote_band(
+    bucket_path: str, input_file: str, y_start: int, y_end: int, base_batch_dir: Path
+) -> None:
+    """
+    Reads rows [y_start, y_end) of a remote Zarr store and writes every row
+    into the input folder of its batch.
+
+    The chunks of the rows are fetched concurrently by Zarr and only once,
+    and the batch files are written from memory.
+    """
+    ds = _open_remote_input(bucket_path, input_file)
+    band = ds.isel(Y=slice(y_start, y_end)).load()
+    file_name = f"{input_file[:len(input_file)-5]}.nc"
+    for index in range(y_start, y_end):
+        subset = band.isel({"Y": index - y_start}).expand_dims("Y")
+        subset.to_netcdf(
+            base_batch_dir / f"batch_{index}" / "input" / file_name, engine="h5netcdf"
+        )
+
+
+def get_remote_input_size(bucket_path: str) -> int:
+    """Returns the uncompressed size of the remote inputs to split in bytes."""
+    return sum(
+        _open_remote_input(bucket_path, input_file).nbytes
+        for input_file in INPUT_FILES_TO_SPLIT
+    )
+
 
 class BatchSplitCommand(BaseCommand):
     def __init__(self, args):
@@ -60,6 +164,13 @@ class BatchSplitCommand(BaseCommand):
         self.log_path.mkdir(exist_ok=True, parents=True)
 
         self.input_path = args.input_path
+        self.max_streaming_size = getattr(
+            args, "max_streaming_size", DEFAULT_MAX_STREAMING_SIZE
+        )
+        self.streaming_workers = getattr(
+            args, "streaming_workers", DEFAULT_STREAMING_WORKERS
+        )
+        self.cleanup_mode = getattr(args, "cleanup", DEFAULT_CLEANUP_MODE)
 
         # Patch setup_working_directory.py to include restart_from in sort_order
         self._patch_setup_working_directory()
@@ -166,59 +277,76 @@ class BatchSplitCommand(BaseCommand):
                 )
             print("done splitting ", input_file)
 
-    def _split_with_dask(self, bucket_path):
-        cluster = get_cluster(n_workers=100)
-        client = dask.distributed.Client(cluster)
-        client.wait_for_workers(50)
-        print(f"Dashboard link: {client.dashboard_link}")
-        fs = get_gcsfs()
+    def _get_band_tasks(self, bucket_path) -> List[tuple]:
+        """Returns the `split_remote_band` arguments of every band of every input."""
+        tasks = []
         for input_file in INPUT_FILES_TO_SPLIT:
-            print(f"Processing {input_file}")
-            bucket_mapping = fs.get_mapper(
-                os.path.join(bucket_path, input_file), check=True
-            )
-            ds = xr.open_zarr(bucket_mapping, decode_times=False)
-            if input_file in [
-                "historic-climate.zarr",
-                "historic-explicit-fire.zarr",
-                "projected-climate.zarr",
-                "projected-explicit-fire.zarr",
-            ]:
-                chunk_dict = {"Y": 1, "X": -1, "time": -1}
-            else:
-                chunk_dict = {"Y": 1, "X": -1}
-
-            ds = ds.chunk(chunk_dict)
-            y_dim = ds.Y.size
-
-            # I know this is ugly but passing `ds` as an argument makes things painfully slow
-            @dask.delayed
-            def _process_data(col_index, output_path):
-                subset = ds.isel({"Y": col_index}).expand_dims("Y")
-                obj = subset.to_netcdf(output_path, engine="h5netcdf")
-                return obj
-
-            delayed_objs = [
-                _process_data(
-                    i,
-                    os.path.join(
-                        self.base_batch_dir,
-                        f"batch_{i}",
-                        "input",
-                        f"{input_file[:len(input_file)-5]}.nc",
-                    ),
+            ds = _open_remote_input(bucket_path, input_file)
+            band_size = get_band_size(ds)
+            for y_start in range(0, ds.Y.size, band_size):
+                y_end = min(y_start + band_size, ds.Y.size)
+                tasks.append(
+                    (bucket_path, input_file, y_start, y_end, self.base_batch_dir)
                 )
-                for i in range(y_dim)
-            ]
-            batch_size = 125
-            for i in range(0, y_dim, batch_size):
-                print(f"Computing batch number {(i // batch_size) + 1}")
-                batch = delayed_objs[i : i + batch_size]
-                dask.compute(*batch)
 
-            ds.close()
+        return tasks
+
+    def _split_with_dask(self, bucket_path):
+        """
+        Splits the remote inputs with a dask cluster.
+
+        Every task is a `split_remote_band` call that opens the Zarr store on
+        the worker, reads a band of rows at once and writes their batch
+        files. All tasks are submitted together, so the workers never wait
+        for each other.
+        """
+        tasks = self._get_band_tasks(bucket_path)
+        band_bytes = []
+        for _, input_file, y_start, y_end, _ in tasks:
+            ds = _open_remote_input(bucket_path, input_file)
+            band_bytes.append(ds.nbytes // ds.Y.size * (y_end - y_start))
+
+        plan = plan_cluster(
+            data_bytes=sum(band_bytes),
+            task_count=len(tasks),
+            chunk_bytes=max(band_bytes),
+        )
+        cluster, client = start_cluster(plan)
+        # the workers are Slurm jobs, so they are released even if a band
+        # fails, instead of running until their walltime
+        try:
+            print(f"Dashboard link: {client.dashboard_link}")
+
+            print(f"Splitting {len(tasks)} bands")
+            futures = [
+                client.submit(split_remote_band, *task, pure=False) for task in tasks
+            ]
+            completed = as_completed(futures, with_results=True)
+            for done, (future, _) in enumerate(completed, start=1):
+                if done % 100 == 0 or done == len(futures):
+                    print(f"{done}/{len(futures)} bands are written")
+        finally:
+            client.close()
+            cluster.close()
+
+    def _split_with_streaming(self, bucket_path):
+        """
+        Splits the remote inputs on this node, without a dask cluster.
 
-        cluster.close()
+        Every input is read in bands of rows by a bounded pool of processes,
+        which write the batch files of their rows directly.
+        """
+        tasks = self._get_band_tasks(bucket_path)
+        print(f"Streaming {len(tasks)} bands with {self.streaming_workers} workers")
+        # spawned, so the workers don't inherit the event loop of gcsfs
+        with ProcessPoolExecutor(
+            max_workers=self.streaming_workers, mp_context=get_context("spawn")
+        ) as executor:
+            futures = [executor.submit(split_remote_band, *task) for task in tasks]
+            for done, future in enumerate(futures, start=1):
+                future.result()
+                if done % 100 == 0 or done == len(futures):
+                    print(f"{done}/{len(futures)} bands are written")
 
     def execute(self):
         reading_remote_data = False
@@ -239,6 +367,7 @@ class BatchSplitCommand(BaseCommand):
             ds = xr.open_dataset(self.input_path / "run-mask.nc", engine="h5netcdf")
 
         X, Y = ds.X.size, ds.Y.size
+        active_cells = (ds["run"] > 0).sum("X").values
         print("Dimension size of X:", X)
         print("Dimension size of Y:", Y)
 
@@ -251,16 +380,13 @@ class BatchSplitCommand(BaseCommand):
         ds.close()
 
         print("Cleaning up the existing directories")
-        if self.base_batch_dir.exists():
-            pattern = re.compile(r"^batch_\d+$")
-            to_be_removed = [
-                d
-                for d in self.base_batch_dir.iterdir()
-                if d.is_dir() and pattern.match(d.name)
-            ]
-
-            with ThreadPoolExecutor(max_workers=os.cpu_count() * 2) as executor:
-                executor.map(lambda elem: shutil.rmtree(elem), to_be_removed)
+        trash_dir = self.base_batch_dir / f"{TRASH_FOLDER_PREFIX}{time.time_ns()}"
+        to_be_removed = get_previous_run_paths(self.base_batch_dir)
+        if to_be_removed:
+            move_to_trash(to_be_removed, trash_dir)
+            delete_in_background(
+                trash_dir, self.cleanup_mode, self._args.slurm_partition
+            )
 
         print("Set up batch directories")
         self.base_batch_dir.mkdir(exist_ok=True)
@@ -272,24 +398,28 @@ class BatchSplitCommand(BaseCommand):
             path = path / "input"
             BATCH_INPUT_DIRS.append(path)
 
-        with ThreadPoolExecutor(max_workers=os.cpu_count() * 2) as executor:
-            executor.map(lambda elem: os.makedirs(elem), BATCH_INPUT_DIRS)
+        make_dirs(
+            self.base_batch_dir,
+            [
+                name
+                for index in range(DIMENSION_SIZE)
+                for name in (f"batch_{index}", f"batch_{index}/input")
+            ],
+            workers=os.cpu_count() * 2,
+        )
 
         co2_files = ["co2.zarr/", "projected-co2.zarr/"]
         if reading_remote_data:
+            # read straight from the bucket, they are small
             for co2_file in co2_files:
                 src = os.path.join(self.input_path, co2_file)
-                dst = os.path.join(self.base_batch_dir, co2_file)
-                fs.get(src, dst, recursive=True)
-
-                ds = xr.open_zarr(dst)
+                ds = xr.open_zarr(fs.get_mapper(src, check=True))
                 co2_file = Path(co2_file)
                 ds.to_netcdf(
                     os.path.join(self.base_batch_dir, f"{co2_file.stem}.nc"),
                     engine="h5netcdf",
                 )
                 ds.close()
-                shutil.rmtree(dst)
 
         # co2.nc and projected-co2.nc doesn't have X and Y dimensions. So, we copy
         # them instead of splitting.
@@ -313,7 +443,12 @@ class BatchSplitCommand(BaseCommand):
 
         print("Split input files")
         if reading_remote_data:
-            self._split_with_dask(self.input_path)
+            input_size = get_remote_input_size(self.input_path)
+            print(f"Remote inputs are {input_size / 1024**3:.1f} GB")
+            if input_size <= self.max_streaming_size * 1024**3:
+                self._split_with_streaming(self.input_path)
+            else:
+                self._split_with_dask(self.input_path)
         else:
             self._split_with_nco(0, DIMENSION_SIZE, self.input_path, SPLIT_DIMENSION)
 
@@ -325,11 +460,31 @@ class BatchSplitCommand(BaseCommand):
         for index, batch_dir in enumerate(BATCH_DIRS):
             self._configure(index, batch_dir)
 
+        # every batch is one row of the input
+        write_manifest(
+            self.base_batch_dir,
+            {"X": X, "Y": Y},
+            [
+                create_batch_entry(
+                    index, (index, index + 1), (0, X), int(active_cells[index])
+                )
+                for index in range(DIMENSION_SIZE)
+            ],
+        )
+
         # we have to do this otherwise there would be two inputs folders:
         # input/ and inputs/
         #
         # inputs/ folder is created because we are calling setup_working_directory.py
         print("Delete duplicated inputs files")
-        duplicated_input_paths = self.base_batch_dir.glob("*/inputs")
-        with ThreadPoolExecutor(max_workers=os.cpu_count() * 2) as executor:
-            executor.map(lambda elem: shutil.rmtree(elem), duplicated_input_paths)
+        duplicated_input_paths = [
+            batch_dir / "inputs"
+            for batch_dir in BATCH_DIRS
+            if (batch_dir / "inputs").exists()
+        ]
+        if duplicated_input_paths:
+            trash_dir = self.base_batch_dir / f"{TRASH_FOLDER_PREFIX}{time.time_ns()}"
+            move_to_trash(duplicated_input_paths, trash_dir)
+            delete_in_background(
+                trash_dir, self.cleanup_mode, self._args.slurm_partition
+            )
@@ -1,8 +1,501 @@
+import filecmp
+import hashlib
+import json
+import math
+import multiprocessing as mp
+import os
+import uuid
+from dataclasses import dataclass, field
 from pathlib import Path
-import subprocess
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+from netCDF4 import Dataset
 
 from batch_processing.cmd.base import BaseCommand
-from batch_processing.utils.utils import interpret_path
+from batch_processing.utils.utils import (
+    get_itemsize,
+    interpret_path,
+    read_json_file,
+    write_json_file,
+)
+
+# Upper bound for the number of bytes read from a single variable at a time.
+# Variables are compared block by block so that big climate outputs never
+# have to fit into memory at once.
+BLOCK_SIZE_BYTES = 64 * 1024 * 1024
+
+# Cached per-variable, per-block content hashes of a results directory.
+# The blocks are the same ones used for comparing, so the manifest becomes
+# invalid whenever the block size or the layout of the file changes.
+MANIFEST_FILE_NAME = ".bp_diff_manifest.json"
+MANIFEST_VERSION = 3
+
+
+@dataclass
+class VariableDiff:
+    name: str
+    mismatch_count: int = 0
+    max_abs_diff: float = 0.0
+    message: str = ""
+
+
+@dataclass
+class FileDiff:
+    name: str
+    message: str = ""
+    variables: List[VariableDiff] = field(default_factory=list)
+
+    @property
+    def is_identical(self) -> bool:
+        return not self.message and not self.variables
+
+
+@dataclass
+class FilePairTask:
+    name: str
+    path_one: Optional[Path]
+    path_two: Optional[Path]
+    atol: float
+    rtol: float
+    manifest_one: Optional[dict] = None
+    manifest_two: Optional[dict] = None
+
+
+def iter_blocks(
+    shape: Tuple[int, ...], itemsize: int, block_size: int = BLOCK_SIZE_BYTES
+) -> Iterator:
+    """
+    Yield indexers that split an array of the given shape into blocks along
+    its first axis. Each block is at most `block_size` bytes, unless a single
+    row is already bigger than that.
+    """
+    if not shape:
+        yield Ellipsis
+        return
+
+    row_bytes = itemsize * math.prod(shape[1:])
+    rows_per_block = max(1, block_size // max(row_bytes, 1))
+    for start in range(0, shape[0], rows_per_block):
+        yield slice(start, min(start + rows_per_block, shape[0]))
+
+
+def compare_arrays(
+    array_one: np.ndarray, array_two: np.ndarray, atol: float, rtol: float
+) -> Tuple[int, float]:
+    """
+    Compare two arrays of the same shape.
+
+    Returns:
+        Tuple[int, float]: Number of mismatching elements and the maximum
+            absolute difference among the mismatches where both sides are
+            numbers. The difference is NaN for non-numeric data, or when
+            every mismatch has a NaN on one side.
+    """
+    array_one = np.asarray(array_one)
+    array_two = np.asarray(array_two)
+
+    if array_one.dtype.kind in "biuf" and array_two.dtype.kind in "biuf":
+        array_one = array_one.astype(np.float64)
+        array_two = array_two.astype(np.float64)
+        mismatches = ~np.isclose(
+            array_one, array_two, rtol=rtol, atol=atol, equal_nan=True
+        )
+        mismatch_count = int(np.count_nonzero(mismatches))
+        if not mismatch_count:
+            return 0, 0.0
+
+        differences = np.abs(array_one[mismatches] - array_two[mismatches])
+        differences = differences[~np.isnan(differences)]
+        max_abs_diff = float(differences.max()) if differences.size else math.nan
+        return mismatch_count, max_abs_diff
+
+    mismatch_count = int(np.count_nonzero(array_one != array_two))
+    return mismatch_count, math.nan if mismatch_count else 0.0
+
+
+def compare_variables(
+    name: str, var_one, var_two, atol: float, rtol: float
+) -> Optional[VariableDiff]:
+    """Compare two netCDF variables block by block. Returns None if they match."""
+    if var_one.shape != var_two.shape:
+        return VariableDiff(
+            name, message=f"shape mismatch: {var_one.shape} vs {var_two.shape}"
+        )
+
+    if var_one.dtype != var_two.dtype:
+        return VariableDiff(name, message="data type mismatch")
+
+    result = VariableDiff(name)
+    for index in iter_blocks(var_one.shape, get_itemsize(var_one)):
+        mismatch_count, max_abs_diff = compare_arrays(
+            var_one[index], var_two[index], atol, rtol
+        )
+        if not mismatch_count:
+            continue
+
+        result.mismatch_count += mismatch_count
+        if math.isnan(max_abs_diff) or math.isnan(result.max_abs_diff):
+            result.max_abs_diff = math.nan
+        else:
+            result.max_abs_diff = max(result.max_abs_diff, max_abs_diff)
+
+    return result if result.mismatch_count else None
+
+
+def _to_json(value):
+    return value.tolist() if hasattr(value, "tolist") else value
+
+
+def get_metadata(dataset: Dataset) -> dict:
+    """Returns the global attributes, dimension sizes and variable attributes."""
+    return {
+        "attributes": {
+            name: _to_json(dataset.getncattr(name)) for name in dataset.ncattrs()
+        },
+        "dimensions": {
+            name: len(dimension) for name, dimension in dataset.dimensions.items()
+        },
+        "variable_attributes": {
+            variable_name: {
+                name: _to_json(variable.getncattr(name)) for name in variable.ncattrs()
+            }
+            for variable_name, variable in dataset.variables.items()
+        },
+    }
+
+
+def _get_changed_keys(items_one: dict, items_two: dict) -> List[str]:
+    """Returns the keys that are missing on either side or whose values differ."""
+    # compared as JSON, so NaN attributes, e.g. _FillValue, are equal
+    return [
+        key
+        for key in sorted(items_one.keys() | items_two.keys())
+        if key not in items_one
+        or key not in items_two
+        or json.dumps(items_one[key], default=str)
+        != json.dumps(items_two[key], default=str)
+    ]
+
+
+def compare_metadata(metadata_one: dict, metadata_two: dict, result: FileDiff) -> None:
+    """Adds the differences of the attributes and dimensions to the result."""
+    messages = []
+    attributes = _get_changed_keys(
+        metadata_one["attributes"], metadata_two["attributes"]
+    )
+    if attributes:
+        messages.append(f"global attributes differ: {', '.join(attributes)}")
+
+    dimensions_one = metadata_one["dimensions"]
+    dimensions_two = metadata_two["dimensions"]
+    dimensions = [
+        f"{name} ({dimensions_one.get(name, '-')} vs {dimensions_two.get(name, '-')})"
+        for name in _get_changed_keys(dimensions_one, dimensions_two)
+    ]
+    if dimensions:
+        messages.append(f"dimensions differ: {', '.join(dimensions)}")
+
+    if messages:
+        result.message = "; ".join(messages)
+
+    variables_one = metadata_one["variable_attributes"]
+    variables_two = metadata_two["variable_attributes"]
+    for name in sorted(variables_one.keys() & variables_two.keys()):
+        attributes = _get_changed_keys(variables_one[name], variables_two[name])
+        if attributes:
+            message = f"attributes differ: {', '.join(attributes)}"
+            result.variables.append(VariableDiff(name, message=message))
+
+
+def compare_file_pair(task: FilePairTask) -> FileDiff:
+    """
+    Compare two NetCDF files.
+
+    Files of equal size are compared byte by byte first, which stops at the
+    first differing byte. Only if that fails, the attributes and dimensions
+    are compared, and the variables value by value using the given
+    tolerances.
+    """
+    if task.path_one is None:
+        return FileDiff(task.name, message="only exists in the second directory")
+
+    if task.path_two is None:
+        return FileDiff(task.name, message="only exists in the first directory")
+
+    try:
+        if os.path.getsize(task.path_one) == os.path.getsize(
+            task.path_two
+        ) and filecmp.cmp(task.path_one, task.path_two, shallow=False):
+            return FileDiff(task.name)
+
+        result = FileDiff(task.name)
+        with Dataset(task.path_one) as ds_one, Dataset(task.path_two) as ds_two:
+            ds_one.set_auto_maskandscale(False)
+            ds_two.set_auto_maskandscale(False)
+            compare_metadata(get_metadata(ds_one), get_metadata(ds_two), result)
+
+            names_one = set(ds_one.variables)
+            names_two = set(ds_two.variables)
+            for name in sorted(names_one - names_two):
+                result.variables.append(
+                    VariableDiff(name, message="only exists in the first file")
+                )
+            for name in sorted(names_two - names_one):
+                result.variables.append(
+                    VariableDiff(name, message="only exists in the second file")
+                )
+
+            for name in sorted(names_one & names_two):
+                variable_diff = compare_variables(
+                    name,
+                    ds_one.variables[name],
+                    ds_two.variables[name],
+                    task.atol,
+                    task.rtol,
+                )
+                if variable_diff is not None:
+                    result.variables.append(variable_diff)
+
+        return result
+    except Exception as e:
+        return FileDiff(task.name, message=f"couldn't be compared: {e}")
+
+
+def hash_block(data: np.ndarray) -> str:
+    """Returns the blake2b digest of the given block."""
+    data = np.asarray(data)
+    hasher = hashlib.blake2b(digest_size=16)
+    hasher.update(f"{data.dtype.str}{data.shape}".encode())
+    if data.dtype.kind == "O":
+        hasher.update("\0".join(str(elem) for elem in data.ravel()).encode())
+    else:
+        hasher.update(np.ascontiguousarray(data).tobytes())
+    return hasher.hexdigest()
+
+
+def get_file_signature(path: Path) -> dict:
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def load_manifest(directory: Path) -> Dict[str, dict]:
+    """Returns the cached file entries of the given directory's manifest."""
+    try:
+        content = read_json_file(directory / MANIFEST_FILE_NAME)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+    if (
+        content.get("version") != MANIFEST_VERSION
+        or content.get("block_size") != BLOCK_SIZE_BYTES
+    ):
+        return {}
+
+    return content.get("files", {})
+
+
+def save_manifest(directory: Path, files: Dict[str, dict]) -> None:
+    """Writes the manifest atomically. Read-only directories are skipped."""
+    path = directory / MANIFEST_FILE_NAME
+    content = {
+        "version": MANIFEST_VERSION,
+        "block_size": BLOCK_SIZE_BYTES,
+        "files": files,
+    }
+    # a unique name, so concurrent runs don't write into the same file
+    tmp_path = directory / f"{MANIFEST_FILE_NAME}.{os.getpid()}.{uuid.uuid4().hex}.tmp"
+    try:
+        write_json_file(tmp_path, content, indent=None)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"Couldn't write the manifest to {path}: {e}")
+        if tmp_path.exists():
+            tmp_path.unlink()
+
+
+class _HashedFile:
+    """
+    Gives access to the block hashes of a NetCDF file. The hashes are taken
+    from the cached manifest entry when it is still valid, otherwise the file
+    is opened and the blocks are hashed while they are read.
+    """
+
+    def __init__(self, path: Path, entry: Optional[dict]):
+        self.path = path
+        self.signature = get_file_signature(path)
+        self.cached = entry is not None and all(
+            entry.get(key) == value for key, value in self.signature.items()
+        )
+        self.variables = entry["variables"] if self.cached else {}
+        self.metadata = entry["metadata"] if self.cached else None
+        self._dataset = None
+
+        if not self.cached:
+            self.metadata = get_metadata(self.dataset)
+            for name, variable in self.dataset.variables.items():
+                self.variables[name] = {
+                    "shape": list(variable.shape),
+                    "dtype": str(variable.dtype),
+                    "itemsize": get_itemsize(variable),
+                    "hashes": [],
+                }
+
+    @property
+    def dataset(self) -> Dataset:
+        if self._dataset is None:
+            self._dataset = Dataset(self.path)
+            self._dataset.set_auto_maskandscale(False)
+        return self._dataset
+
+    def read(self, name: str, index) -> np.ndarray:
+        data = self.dataset.variables[name][index]
+        if not self.cached:
+            self.variables[name]["hashes"].append(hash_block(data))
+        return data
+
+    def get_hash(
+        self, name: str, block_number: int, index
+    ) -> Tuple[str, Optional[np.ndarray]]:
+        """Returns the hash of the block, and its data if it had to be read."""
+        if self.cached:
+            return self.variables[name]["hashes"][block_number], None
+
+        data = self.read(name, index)
+        return self.variables[name]["hashes"][block_number], data
+
+    def hash_all(self, name: str) -> None:
+        if self.cached:
+            return
+
+        variable = self.variables[name]
+        for index in iter_blocks(tuple(variable["shape"]), variable["itemsize"]):
+            self.read(name, index)
+
+    def to_entry(self) -> dict:
+        return {
+            **self.signature,
+            "metadata": self.metadata,
+            "variables": self.variables,
+        }
+
+    def close(self) -> None:
+        if self._dataset is not None:
+            self._dataset.close()
+
+
+def compare_file_pair_with_manifest(
+    task: FilePairTask,
+) -> Tuple[FileDiff, Optional[dict], Optional[dict]]:
+    """
+    Compare two NetCDF files using their block hashes.
+
+    Only the blocks whose hashes differ are compared value by value. When
+    both files have valid manifest entries, identical files are detected
+    without reading any data. Returns the comparison result together with
+    the up-to-date manifest entries of both files.
+    """
+    if task.path_one is None or task.path_two is None:
+        return compare_file_pair(task), task.manifest_one, task.manifest_two
+
+    file_one = file_two = None
+    try:
+        file_one = _HashedFile(task.path_one, task.manifest_one)
+        file_two = _HashedFile(task.path_two, task.manifest_two)
+        result = FileDiff(task.name)
+        compare_metadata(file_one.metadata, file_two.metadata, result)
+
+        names_one = set(file_one.variables)
+        names_two = set(file_two.variables)
+        for name in sorted(names_one - names_two):
+            file_one.hash_all(name)
+            result.variables.append(
+                VariableDiff(name, message="only exists in the first file")
+            )
+        for name in sorted(names_two - names_one):
+            file_two.hash_all(name)
+            result.variables.append(
+                VariableDiff(name, message="only exists in the second file")
+            )
+
+        for name in sorted(names_one & names_two):
+            shape_one = tuple(file_one.variables[name]["shape"])
+            shape_two = tuple(file_two.variables[name]["shape"])
+            itemsize = file_one.variables[name]["itemsize"]
+            message = ""
+            if shape_one != shape_two:
+                message = f"shape mismatch: {shape_one} vs {shape_two}"
+            elif file_one.variables[name]["dtype"] != file_two.variables[name]["dtype"]:
+                message = "data type mismatch"
+
+            if message:
+                file_one.hash_all(name)
+                file_two.hash_all(name)
+                result.variables.append(VariableDiff(name, message=message))
+                continue
+
+            variable_diff = VariableDiff(name)
+            for block_number, index in enumerate(iter_blocks(shape_one, itemsize)):
+                hash_one, data_one = file_one.get_hash(name, block_number, index)
+                hash_two, data_two = file_two.get_hash(name, block_number, index)
+                if hash_one == hash_two:
+                    continue
+
+                if data_one is None:
+                    data_one = file_one.read(name, index)
+                if data_two is None:
+                    data_two = file_two.read(name, index)
+
+                mismatch_count, max_abs_diff = compare_arrays(
+                    data_one, data_two, task.atol, task.rtol
+                )
+                if not mismatch_count:
+                    continue
+
+                variable_diff.mismatch_count += mismatch_count
+                if math.isnan(max_abs_diff) or math.isnan(variable_diff.max_abs_diff):
+                    variable_diff.max_abs_diff = math.nan
+                else:
+                    variable_diff.max_abs_diff = max(
+                        variable_diff.max_abs_diff, max_abs_diff
+                    )
+
+            if variable_diff.mismatch_count:
+                result.variables.append(variable_diff)
+
+        return result, file_one.to_entry(), file_two.to_entry()
+    except Exception as e:
+        return (
+            FileDiff(task.name, message=f"couldn't be compared: {e}"),
+            task.manifest_one,
+            task.manifest_two,
+        )
+    finally:
+        for hashed_file in (file_one, file_two):
+            if hashed_file is not None:
+                hashed_file.close()
+
+
+def print_report(results: List[FileDiff]) -> None:
+    different = [result for result in results if not result.is_identical]
+    print(
+        f"Compared {len(results)} files: {len(results) - len(different)} identical, "
+        f"{len(different)} different."
+    )
+
+    for result in different:
+        print(f"\n{result.name}")
+        if result.message:
+            print(f"  {result.message}")
+
+        for variable in result.variables:
+            if variable.message:
+                print(f"  {variable.name}: {variable.message}")
+            else:
+                print(
+                    f"  {variable.name}: {variable.mismatch_count} values differ, "
+                    f"max abs diff: {variable.max_abs_diff:.6g}"
+                )
 
 
 class DiffCommand(BaseCommand):
@@ -13,6 +506,51 @@ class DiffCommand(BaseCommand):
         args.path_two = Path(interpret_path(args.path_two))
         self._args = args
 
+        self.atol = getattr(args, "atol", 0.0)
+        self.rtol = getattr(args, "rtol", 0.0)
+        self.workers = getattr(args, "workers", None) or mp.cpu_count()
+        self.use_manifest = getattr(args, "manifest", False)
+
+    def _prepare_tasks(self) -> List[FilePairTask]:
+        files_one = {path.name: path for path in self._args.path_one.glob("*.nc")}
+        files_two = {path.name: path for path in self._args.path_two.glob("*.nc")}
+
+        manifest_one, manifest_two = {}, {}
+        if self.use_manifest:
+            manifest_one = load_manifest(self._args.path_one)
+            manifest_two = load_manifest(self._args.path_two)
+
+        return [
+            FilePairTask(
+                name,
+                files_one.get(name),
+                files_two.get(name),
+                self.atol,
+                self.rtol,
+                manifest_one.get(name),
+                manifest_two.get(name),
+            )
+            for name in sorted(files_one.keys() | files_two.keys())
+        ]
+
+    def _compare_with_manifest(
+        self, pool, tasks: List[FilePairTask]
+    ) -> List[FileDiff]:
+        results = []
+        manifest_one, manifest_two = {}, {}
+        for result, entry_one, entry_two in pool.imap_unordered(
+            compare_file_pair_with_manifest, tasks
+        ):
+            results.append(result)
+            if entry_one is not None:
+                manifest_one[result.name] = entry_one
+            if entry_two is not None:
+                manifest_two[result.name] = entry_two
+
+        save_manifest(self._args.path_one, manifest_one)
+        save_manifest(self._args.path_two, manifest_two)
+        return results
+
     def execute(self):
         if not self._args.path_one.is_dir():
             raise Exception(f"The given path is not a directory: {self._args.path_one}")
@@ -20,30 +558,19 @@ class DiffCommand(BaseCommand):
         if not self._args.path_two.is_dir():
             raise Exception(f"The given path is not a directory: {self._args.path_two}")
 
-        files_one = sorted(self._args.path_one.glob("*.nc"))
-        files_two = sorted(self._args.path_two.glob("*.nc"))
+        tasks = self._prepare_tasks()
+        if not tasks:
+            print("No .nc files are found in the given directories.")
+            return
 
-        if len(files_one) != len(files_two):
-            raise Exception(
-                "The lengths of the folders are not the same. "
-                f"len(path_one): {len(files_one)}, len(path_two): {len(files_two)}"
-            )
-
-        for file_one, file_two in zip(files_one, files_two):
-            output = subprocess.run([
-                "cdo",
-                "diffv",
-                file_one,
-                file_two,
-            ],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            )
+        with mp.Pool(processes=min(self.workers, len(tasks))) as pool:
+            if self.use_manifest:
+                results = self._compare_with_manifest(pool, tasks)
+            else:
+                results = list(pool.imap_unordered(compare_file_pair, tasks))
 
-            if output.returncode != 0:
-                print(f"{file_one} and {file_two} are not the same.")
-                print(output.stdout.decode("utf-8"))
-                print(output.stderr.decode("utf-8"))
-                return
+        results.sort(key=lambda result: result.name)
+        print_report(results)
 
-        print("No difference is found. The two folders are identical.")
+        if all(result.is_identical for result in results):
+            print("No difference is found. The two folders are identical.")
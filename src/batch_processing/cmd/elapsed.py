@@ -1,27 +1,230 @@
+import csv
 import os
+import subprocess
 import sys
 import time
-from datetime import datetime
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
 
+import numpy as np
 from rich import print
 
 from batch_processing.cmd.base import BaseCommand
-from batch_processing.utils.utils import get_slurm_queue
+from batch_processing.utils.utils import read_json_file, run_sacct
+
+# Written by `bp batch run`, maps every batch to the ID of its job
+JOBS_FILE_NAME = "jobs.json"
+JOB_TIMES_FILE_NAME = "job_times.csv"
+
+# States a job doesn't leave anymore. Preempted jobs are requeued, so
+# PREEMPTED isn't one of them.
+TERMINAL_STATES = {
+    "BOOT_FAIL",
+    "CANCELLED",
+    "COMPLETED",
+    "DEADLINE",
+    "FAILED",
+    "NODE_FAIL",
+    "OUT_OF_MEMORY",
+    "TIMEOUT",
+}
+
+SACCT_FIELDS = ["JobID", "State", "Partition", "Submit", "Start", "End"]
+
+# A job that sacct hasn't returned for this many polls in a row, e.g. it was
+# purged from the accounting, is given up on and counted as finished
+MAX_MISSING_POLLS = 30
+MISSING_STATE = "MISSING"
+
+
+@dataclass
+class JobTimes:
+    job_id: str
+    batch: str
+    state: str = "UNKNOWN"
+    partition: str = ""
+    submit: Optional[datetime] = None
+    start: Optional[datetime] = None
+    end: Optional[datetime] = None
+    missing_polls: int = 0
+
+    @property
+    def is_finished(self) -> bool:
+        return self.state in TERMINAL_STATES or self.state == MISSING_STATE
+
+    @property
+    def queue_wait(self) -> Optional[timedelta]:
+        if self.submit is None or self.start is None:
+            return None
+        return self.start - self.submit
+
+    @property
+    def run_time(self) -> Optional[timedelta]:
+        if self.start is None or self.end is None:
+            return None
+        return self.end - self.start
+
+
+def _parse_sacct_time(value: str) -> Optional[datetime]:
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        # Unknown, None etc. for the jobs that haven't started or ended yet
+        return None
+
+
+def query_sacct(jobs: Dict[str, JobTimes]) -> None:
+    """
+    Updates the given jobs with their state and times from sacct.
+
+    Jobs that sacct doesn't return for MAX_MISSING_POLLS calls in a row get
+    the MISSING state, so the tracker doesn't wait for them forever.
+    """
+    found = set()
+    for record in run_sacct(list(jobs), SACCT_FIELDS):
+        job = jobs.get(record["JobID"])
+        if job is None:
+            continue
+
+        found.add(job.job_id)
+        job.missing_polls = 0
+        # e.g. "CANCELLED by 1234"
+        job.state = record["State"].split()[0] if record["State"] else job.state
+        job.partition = record["Partition"]
+        job.submit = _parse_sacct_time(record["Submit"])
+        job.start = _parse_sacct_time(record["Start"])
+        job.end = _parse_sacct_time(record["End"])
+
+    for job in jobs.values():
+        if job.job_id in found or job.is_finished:
+            continue
+
+        job.missing_polls += 1
+        if job.missing_polls >= MAX_MISSING_POLLS:
+            job.state = MISSING_STATE
+
+
+def format_duration(duration: timedelta) -> str:
+    days = duration.days
+    hours, remainder = divmod(duration.seconds, 3600)
+    minutes, seconds = divmod(remainder, 60)
+    return f"{days} days, {hours} hours, {minutes} minutes, {seconds} seconds"
+
+
+def summarize_durations(name: str, durations: List[timedelta]) -> str:
+    """Returns the min, median, 90th percentile, max and mean of the durations."""
+    if not durations:
+        return f"{name}: no data"
+
+    seconds = np.array([duration.total_seconds() for duration in durations])
+    stats = {
+        "min": seconds.min(),
+        "p50": np.percentile(seconds, 50),
+        "p90": np.percentile(seconds, 90),
+        "max": seconds.max(),
+        "mean": seconds.mean(),
+    }
+    values = ", ".join(
+        f"{key} {timedelta(seconds=round(value))}" for key, value in stats.items()
+    )
+    return f"{name}: {values}"
 
 
 class ElapsedCommand(BaseCommand):
+    """
+    Tracks the jobs of a batch run until all of them are finished.
+
+    Only the jobs submitted by `bp batch run` are tracked, and their submit,
+    start and end times are taken from sacct, so the results don't depend on
+    the poll interval or on the other jobs of the user.
+    """
+
     def __init__(self, args):
         super().__init__()
         self._args = args
         self._file_path = f"{args.base_batch_dir}/elapsed_time.txt"
+        self._table_path = f"{args.base_batch_dir}/{JOB_TIMES_FILE_NAME}"
+        self._jobs_path = f"{args.base_batch_dir}/{JOBS_FILE_NAME}"
         self._sleep_time = 60
 
-    def get_now_and_write(self, s: str):
-        now = datetime.now().ctime()
+    def _read_jobs(
+        self, jobs: Optional[Dict[str, JobTimes]] = None
+    ) -> Dict[str, JobTimes]:
+        """
+        Returns the jobs in jobs.json, keeping the times of the ones already
+        tracked.
+
+        `bp batch rebalance` and `bp batch retry` replace jobs in jobs.json
+        while they run, so it is read again on every poll: the new jobs are
+        tracked and the replaced ones are dropped.
+        """
+        jobs = jobs or {}
+        batches = read_json_file(self._jobs_path)["jobs"]
+        return {
+            job_id: jobs.get(job_id) or JobTimes(job_id=job_id, batch=batch)
+            for batch, job_id in batches.items()
+        }
+
+    def _write_table(self, jobs: Dict[str, JobTimes]) -> None:
+        temp_path = f"{self._table_path}.tmp"
+        with open(temp_path, "w", newline="") as file:
+            writer = csv.writer(file)
+            writer.writerow(
+                ["job_id", "batch", "state", "partition", "submit", "start", "end"]
+            )
+            for job in jobs.values():
+                writer.writerow(
+                    [
+                        job.job_id,
+                        job.batch,
+                        job.state,
+                        job.partition,
+                        *[
+                            value.isoformat() if value else ""
+                            for value in (job.submit, job.start, job.end)
+                        ],
+                    ]
+                )
+        os.replace(temp_path, self._table_path)
+
+    def _write_summary(self, jobs: Dict[str, JobTimes]) -> None:
+        submits = [job.submit for job in jobs.values() if job.submit]
+        ends = [job.end for job in jobs.values() if job.end]
+        queue_waits = [
+            job.queue_wait for job in jobs.values() if job.queue_wait is not None
+        ]
+        run_times = [job.run_time for job in jobs.values() if job.run_time is not None]
+        states = {}
+        for job in jobs.values():
+            states[job.state] = states.get(job.state, 0) + 1
+
         with open(self._file_path, "a") as file:
-            file.write(s + now + "\n")
+            if submits and ends:
+                makespan = max(ends) - min(submits)
+                file.write("start datetime: " + min(submits).ctime() + "\n")
+                file.write("end datetime: " + max(ends).ctime() + "\n")
+                file.write("elapsed time: " + format_duration(makespan) + "\n")
+            file.write(
+                "job states: "
+                + ", ".join(
+                    f"{state} {count}" for state, count in sorted(states.items())
+                )
+                + "\n"
+            )
+            file.write(summarize_durations("queue wait", queue_waits) + "\n")
+            file.write(summarize_durations("run time", run_times) + "\n")
 
     def execute(self):
+        if not os.path.exists(self._jobs_path):
+            print(
+                f"[red bold]{self._jobs_path} doesn't exist. "
+                "There are no submitted jobs to track.[/red bold]"
+            )
+            return
+
+        jobs = self._read_jobs()
+
         try:
             pid = os.fork()
             # exit the main process
@@ -35,35 +238,31 @@ class ElapsedCommand(BaseCommand):
             sys.exit(e)
 
         # continue the execution from the child process
-        start_time = datetime.now()
-        with open(self._file_path, "a") as file:
-            file.write("start datetime: " + start_time.ctime() + "\n")
-
         print(
-            "[blue bold]Timer has started. "
-            f"Check {self._file_path} for the results.[/blue bold]"
+            f"[blue bold]Tracking {len(jobs)} jobs. "
+            f"Check {self._file_path} and {self._table_path} "
+            "for the results.[/blue bold]"
         )
         while True:
-            queue = get_slurm_queue()
-            if not queue:
-                end_time = datetime.now()
-                time_difference = end_time - start_time
-                days = time_difference.days
-                hours, remainder = divmod(time_difference.seconds, 3600)
-                minutes, seconds = divmod(remainder, 60)
-                formatted_time = (
-                    f"{days} days, {hours} hours, {minutes} minutes, {seconds} seconds"
-                )
-
-                with open(self._file_path, "a") as file:
-                    file.write("end datetime: " + end_time.ctime() + "\n")
-                    file.write("elapsed time: " + formatted_time + "\n")
+            try:
+                jobs = self._read_jobs(jobs)
+            except (OSError, ValueError) as e:
+                # e.g. jobs.json is being written by another command
+                print(f"[red]Couldn't read {self._jobs_path}: {e}[/red]")
 
-                break
+            try:
+                query_sacct(jobs)
+            except (subprocess.CalledProcessError, OSError) as e:
+                print(f"[red]Couldn't query sacct: {e}[/red]")
+            else:
+                self._write_table(jobs)
+                if all(job.is_finished for job in jobs.values()):
+                    break
 
             time.sleep(self._sleep_time)
 
+        self._write_summary(jobs)
         print(
-            "[green bold]The timer has stopped. "
+            "[green bold]All jobs are finished. "
             f"Check {self._file_path} for the results.[/green bold]"
         )
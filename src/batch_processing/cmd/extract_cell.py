@@ -1,21 +1,160 @@
+import csv
 import json
+import re
 import shutil
-import subprocess
+from collections import defaultdict
 from pathlib import Path
 from string import Template
+from typing import Dict, List, Tuple
 
-import netCDF4
+import numpy as np
+from netCDF4 import Dataset
 
 from batch_processing.cmd.base import BaseCommand
 from batch_processing.utils.utils import (
     INPUT_FILES,
+    INPUT_FILES_TO_COPY,
     IO_PATHS,
     clean_and_load_json,
+    copy_variable_data,
+    create_netcdf_like,
     generate_random_string,
+    get_dimensions,
     get_project_root,
     interpret_path,
+    read_text_file,
+    write_json_file,
 )
 
+Cell = Tuple[int, int]
+
+# Written next to a packed batch. Maps every cell of the synthetic grid back
+# to its coordinates in the original input set.
+CELL_MAPPING_FILE_NAME = "cell_mapping.json"
+
+
+def read_coordinates(path: Path) -> List[Cell]:
+    """
+    Reads (X, Y) cell coordinates from the given file.
+
+    Two formats are supported:
+        - failed_cell_coords.txt written by `bp map`, which contains
+          (row, column), i.e. (Y, X), tuples of the run status matrix.
+        - A CSV file with X and Y columns. The header is optional; without
+          it, the first column is X and the second one is Y.
+
+    Duplicated coordinates are dropped while keeping the order.
+    """
+    content = read_text_file(path)
+
+    if path.suffix.lower() != ".csv":
+        matches = re.findall(r"\((\d+),\s*(\d+)\)", content)
+        return list(dict.fromkeys((int(x), int(y)) for y, x in matches))
+
+    rows = [row for row in csv.reader(content.splitlines()) if row]
+    x_index, y_index = 0, 1
+    if rows and not rows[0][0].strip().isdigit():
+        header = [column.strip().upper() for column in rows[0]]
+        x_index, y_index = header.index("X"), header.index("Y")
+        rows = rows[1:]
+
+    cells = ((int(row[x_index]), int(row[y_index])) for row in rows)
+    return list(dict.fromkeys(cells))
+
+
+def _read_cell_values(variable, cells: List[Cell]) -> Dict[Cell, np.ndarray]:
+    """
+    Reads the values of the given cells from a variable that has X and/or Y
+    dimensions. The X and Y axes are removed from the returned arrays.
+
+    When the variable has both dimensions, every Y row that contains a
+    requested cell is read once, and all cells of that row are taken from it.
+    """
+    dims = variable.dimensions
+    values = {}
+
+    if "X" in dims and "Y" in dims:
+        y_axis = dims.index("Y")
+        # the row loses its Y axis, which shifts X by one if Y comes first
+        x_axis = dims.index("X") - (1 if y_axis < dims.index("X") else 0)
+
+        xs_by_row = defaultdict(list)
+        for x, y in cells:
+            xs_by_row[y].append(x)
+
+        for y, xs in xs_by_row.items():
+            index = [slice(None)] * len(dims)
+            index[y_axis] = y
+            row = variable[tuple(index)]
+            for x in xs:
+                values[(x, y)] = np.take(row, x, axis=x_axis)
+
+        return values
+
+    for x, y in cells:
+        index = [slice(None)] * len(dims)
+        if "X" in dims:
+            index[dims.index("X")] = x
+        if "Y" in dims:
+            index[dims.index("Y")] = y
+        values[(x, y)] = variable[tuple(index)]
+
+    return values
+
+
+def _compose_cells(dims: tuple, values: Dict[Cell, np.ndarray], cells: List[Cell]):
+    """
+    Places the values of the given cells next to each other along X in a
+    single row, and restores the original order of the dimensions.
+    """
+    if "X" not in dims:
+        data = np.expand_dims(values[cells[0]], 0)
+        return np.moveaxis(data, 0, dims.index("Y"))
+
+    data = np.stack([values[cell] for cell in cells])
+    if "Y" not in dims:
+        return np.moveaxis(data, 0, dims.index("X"))
+
+    data = np.expand_dims(data, 0)
+    return np.moveaxis(data, [0, 1], [dims.index("Y"), dims.index("X")])
+
+
+def extract_cells(src_path: Path, destinations: Dict[Path, List[Cell]]) -> None:
+    """
+    Copies the given cells of a NetCDF input file into new files.
+
+    Args:
+        src_path (Path): The input file to read from.
+        destinations (Dict[Path, List[Cell]]): Maps every file to be written
+            to the (X, Y) cells it should contain. The cells of a file are
+            placed next to each other along X in a single row (Y=1).
+
+    The source is opened only once, and the values of all requested cells
+    are read before any of the destination files is written.
+    """
+    all_cells = list(
+        dict.fromkeys(cell for cells in destinations.values() for cell in cells)
+    )
+
+    with Dataset(src_path) as src:
+        src.set_auto_maskandscale(False)
+
+        cell_values = {}
+        for name, variable in src.variables.items():
+            if "X" in variable.dimensions or "Y" in variable.dimensions:
+                cell_values[name] = _read_cell_values(variable, all_cells)
+
+        for dest_path, cells in destinations.items():
+            dim_sizes = {"X": len(cells), "Y": 1}
+            with create_netcdf_like(src, dest_path, dim_sizes) as dest:
+                for name, variable in src.variables.items():
+                    if name in cell_values:
+                        dest.variables[name][:] = _compose_cells(
+                            variable.dimensions, cell_values[name], cells
+                        )
+                    else:
+                        copy_variable_data(variable, dest.variables[name])
+
 
 class ExtractCellCommand(BaseCommand):
     def __init__(self, args):
@@ -24,50 +163,78 @@ class ExtractCellCommand(BaseCommand):
         args.output_path = Path(interpret_path(args.output_path))
         self._args = args
 
-    def _do_coords_in_range(self, input_path, x, y):
-        file = netCDF4.Dataset(input_path)
-        return y <= file.dimensions["Y"].size and x <= file.dimensions["X"].size
+        coords_file = getattr(args, "coords_file", None)
+        if coords_file:
+            self.cells = read_coordinates(Path(interpret_path(coords_file)))
+        elif args.X is not None and args.Y is not None:
+            self.cells = [(args.X, args.Y)]
+        else:
+            raise ValueError("Either -X and -Y or --coords-file must be given.")
+
+        self.pack = getattr(args, "pack", False)
+
+    def _get_cell_dir(self, cell: Cell) -> Path:
+        # a single cell or a packed set of cells is extracted straight
+        # into the output path
+        if len(self.cells) == 1 or self.pack:
+            return self._args.output_path
+
+        x, y = cell
+        return self._args.output_path / f"cell_{x}_{y}"
+
+    def _get_batch_dirs(self) -> List[Path]:
+        return list(dict.fromkeys(self._get_cell_dir(cell) for cell in self.cells))
 
-    def _copy_folders(self):
-        calib_dest_path = self._args.output_path / "calibration"
+    def _get_destinations(self, input_file: str) -> Dict[Path, List[Cell]]:
+        if self.pack:
+            return {self._args.output_path / "input" / input_file: self.cells}
+
+        return {
+            self._get_cell_dir(cell) / "input" / input_file: [cell]
+            for cell in self.cells
+        }
+
+    def _write_cell_mapping(self):
+        cells = [
+            {"index": index, "X": x, "Y": y} for index, (x, y) in enumerate(self.cells)
+        ]
+        write_json_file(
+            self._args.output_path / CELL_MAPPING_FILE_NAME,
+            {"input_path": str(self._args.input_path), "cells": cells},
+        )
+
+    def _copy_folders(self, cell_dir: Path):
+        calib_dest_path = cell_dir / "calibration"
         calib_dest_path.mkdir(exist_ok=True)
         calib_src_path = self.dvmdostem_path / "calibration"
         shutil.copy(calib_src_path / "calibration_targets.py", calib_dest_path)
 
-        param_dst_path = self._args.output_path / "parameters"
+        param_dst_path = cell_dir / "parameters"
         param_dst_path.mkdir(exist_ok=True)
         param_src_path = self.dvmdostem_path / "parameters"
         shutil.copytree(param_src_path, param_dst_path, dirs_exist_ok=True)
 
-        config_dst_path = self._args.output_path / "config"
+        config_dst_path = cell_dir / "config"
         config_dst_path.mkdir(exist_ok=True)
         config_src_path = self.dvmdostem_path / "config"
         shutil.copytree(config_src_path, config_dst_path, dirs_exist_ok=True)
 
     def _copy_input_files(self):
-        dest_path = self._args.output_path / "input"
-        dest_path.mkdir(exist_ok=True, parents=True)
-
-        input_files = [self._args.input_path / file for file in INPUT_FILES]
-        for input_file in input_files:
-            if input_file.name in ["co2.nc", "projected-co2.nc"]:
-                shutil.copy(input_file, dest_path / input_file.name)
-            else:
-                subprocess.run(
-                    [
-                        "ncks",
-                        "-O",
-                        "-h",
-                        "-d",
-                        f"X,{self._args.X}",
-                        "-d",
-                        f"Y,{self._args.Y}",
-                        input_file,
-                        dest_path / input_file.name,
-                    ]
-                )
-
-    def _write_slurm_runner(self):
+        batch_dirs = self._get_batch_dirs()
+        for batch_dir in batch_dirs:
+            (batch_dir / "input").mkdir(exist_ok=True, parents=True)
+
+        for input_file in INPUT_FILES:
+            input_file_path = self._args.input_path / input_file
+            if input_file in INPUT_FILES_TO_COPY:
+                for batch_dir in batch_dirs:
+                    shutil.copy(input_file_path, batch_dir / "input" / input_file)
+                continue
+
+            print(f"Extracting {len(self.cells)} cells from {input_file}...")
+            extract_cells(input_file_path, self._get_destinations(input_file))
+
+    def _write_slurm_runner(self, cell_dir: Path):
         with open(get_project_root() / "templates" / "slurm_runner.sh") as file:
             template = Template(file.read())
 
@@ -77,28 +244,29 @@ class ExtractCellCommand(BaseCommand):
                 "job_name": job_name,
                 "partition": self._args.slurm_partition,
                 "dvmdostem_binary": self.dvmdostem_bin_path,
-                "log_file_path": self._args.output_path / f"{job_name}.log",
+                "log_file_path": cell_dir / f"{job_name}.log",
                 "log_level": self._args.log_level,
-                "config_path": Path(self._args.output_path / "config" / "config.js"),
+                "config_path": Path(cell_dir / "config" / "config.js"),
                 "p": self._args.p,
                 "e": self._args.e,
                 "s": self._args.s,
                 "t": self._args.t,
                 "n": self._args.n,
+                "additional_flags": "",
             }
         )
 
-        with open(self._args.output_path / "slurm_runner.sh", "w") as file:
+        with open(cell_dir / "slurm_runner.sh", "w") as file:
             file.write(slurm_runner)
 
-    def _configure(self):
-        config_file_path = Path(self._args.output_path / "config" / "config.js")
+    def _configure(self, cell_dir: Path):
+        config_file_path = Path(cell_dir / "config" / "config.js")
         with open(config_file_path) as f:
             config_data_str = f.read()
 
         config_data = clean_and_load_json(config_data_str)
         for key, val in IO_PATHS.items():
-            config_data["IO"][key] = f"{self._args.output_path}/{val}"
+            config_data["IO"][key] = f"{cell_dir}/{val}"
 
         with open(config_file_path, "w") as f:
             json.dump(config_data, f, indent=4)
@@ -110,19 +278,36 @@ class ExtractCellCommand(BaseCommand):
                 "Run 'bp init' first to set up the environment."
             )
 
-        if not self._do_coords_in_range(
-            Path(self._args.input_path / "drainage.nc"), self._args.X, self._args.Y
-        ):
+        if not self.cells:
+            raise Exception("No coordinates are given to extract.")
+
+        X, Y = get_dimensions(self._args.input_path / "drainage.nc")
+        out_of_bounds = [
+            (x, y) for x, y in self.cells if not (0 <= x < X and 0 <= y < Y)
+        ]
+        if out_of_bounds:
             raise Exception(
                 "The given coordinates are out of bounds for the given dataset. Provided values are: "
-                f"\nX: {self._args.X}"
-                f"\nY: {self._args.Y}"
+                f"\n(X, Y): {', '.join(str(cell) for cell in out_of_bounds)}"
                 f"\nInput Path: {self._args.input_path}"
             )
 
         self._copy_input_files()
-        self._copy_folders()
-        self._write_slurm_runner()
-        self._configure()
+        for batch_dir in self._get_batch_dirs():
+            self._copy_folders(batch_dir)
+            self._write_slurm_runner(batch_dir)
+            self._configure(batch_dir)
 
-        print("The given cell is successfully extracted.")
+        if self.pack:
+            self._write_cell_mapping()
+            print(
+                f"{len(self.cells)} cells are successfully packed into a single batch "
+                f"in {self._args.output_path}."
+            )
+        elif len(self.cells) == 1:
+            print("The given cell is successfully extracted.")
+        else:
+            print(
+                f"{len(self.cells)} cells are successfully extracted to "
+                f"{self._args.output_path}."
+            )
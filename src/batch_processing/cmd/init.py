@@ -1,11 +1,42 @@
-import json
+import os
+import shutil
 import subprocess
 from pathlib import Path
 
 from rich import print
 
-from batch_processing.cmd.base import BaseCommand, CONFIG_FILE_PATH, DEFAULT_BASEDIR
-from batch_processing.utils.utils import download_directory, download_file, run_command
+from batch_processing.cmd.base import (
+    BaseCommand,
+    CONFIG_FILE_PATH,
+    DEFAULT_BASEDIR,
+    read_config,
+    write_config,
+)
+from batch_processing.utils.install_cache import (
+    CACHE_FOLDER,
+    CCACHE_FOLDER,
+    CHECKOUT_FOLDER,
+    DVMDOSTEM_REPOSITORY,
+    activate_install,
+    complete_install,
+    get_active_install,
+    get_cached_installs,
+    get_commit_key,
+    get_partial_path,
+    get_prebuilt_key,
+    resolve_commit,
+    setup_ccache,
+)
+from batch_processing.utils.utils import (
+    download_directory,
+    download_file,
+    get_directory_files,
+    run_command,
+)
+
+PREBUILT_BUCKET = "gcp-slurm"
+PREBUILT_FOLDER = "dvm-dos-tem/"
+DEFAULT_VERSION = "master"
 
 
 class InitCommand(BaseCommand):
@@ -14,6 +45,155 @@ class InitCommand(BaseCommand):
         super().__init__(basedir=basedir)
         self._args = args
         self._compile = getattr(args, "compile", False)
+        self._version = getattr(args, "version", None)
+        # 0 uses all the cores available to the process
+        self._jobs = getattr(args, "jobs", 0)
+        self._ccache = getattr(args, "ccache", True)
+        cache_dir = getattr(args, "cache_dir", None)
+        self.cache_dir = (
+            Path(cache_dir) if cache_dir else self.dvmdostem_path.parent / CACHE_FOLDER
+        )
+
+    def _make_executable(self, install_dir: Path) -> None:
+        subprocess.run([f"chmod +x {install_dir}/dvmdostem"], shell=True, check=True)
+        # Make all Python scripts in scripts directory executable (recursively)
+        subprocess.run(
+            f"find {install_dir}/scripts -name '*.py' -exec chmod +x {{}} \\;",
+            shell=True,
+            check=True
+        )
+
+    def _install_prebuilt(self) -> Path:
+        """Copies the pre-built dvm-dos-tem from the bucket into the cache."""
+        files = get_directory_files(PREBUILT_BUCKET, PREBUILT_FOLDER)
+        install_dir = self.cache_dir / get_prebuilt_key(files)
+        if install_dir.exists():
+            print(
+                "[bold yellow]The pre-built dvm-dos-tem is cached in "
+                f"{install_dir}[/bold yellow]"
+            )
+            return install_dir
+
+        # an interrupted download is resumed from its partial folder
+        partial_dir = get_partial_path(install_dir)
+        partial_dir.mkdir(parents=True, exist_ok=True)
+        print(
+            f"[bold blue]Copying dvm-dos-tem to {install_dir} directory...[/bold blue]"
+        )
+        downloaded, skipped = download_directory(
+            PREBUILT_BUCKET, PREBUILT_FOLDER, partial_dir.as_posix(), strip_prefix=True
+        )
+        self._make_executable(partial_dir)
+        complete_install(install_dir)
+        print(
+            f"[bold green]dvm-dos-tem is copied to {install_dir} "
+            f"({downloaded} files downloaded, {skipped} already up to date)"
+            "[/bold green]"
+        )
+        return install_dir
+
+    def _get_build_command(self, checkout_dir: Path) -> str:
+        jobs = self._jobs or len(os.sched_getaffinity(0))
+        ccache_setup = ""
+        ccache_bin_dir = setup_ccache(self.cache_dir) if self._ccache else None
+        if ccache_bin_dir:
+            # after loading the modules, so their compilers go through ccache too.
+            # Paths are hashed relative to the cache, so any checkout hits it.
+            ccache_setup = (
+                f"export PATH={ccache_bin_dir}:$PATH "
+                f"CCACHE_DIR={self.cache_dir / CCACHE_FOLDER} "
+                f"CCACHE_BASEDIR={self.cache_dir} && "
+            )
+        print(
+            f"[bold blue]Compiling dvmdostem binary with {jobs} jobs"
+            f"{' and ccache' if ccache_bin_dir else ''}...[/bold blue]"
+        )
+
+        return f"""
+        cd {checkout_dir} && \
+        export DOWNLOADPATH=/dependencies && \
+        if [ -f "$DOWNLOADPATH/setup-env.sh" ]; then \
+            . $DOWNLOADPATH/setup-env.sh && \
+            module load openmpi; \
+        fi && \
+        {ccache_setup}make -j {jobs} USEMPI=true
+        """
+
+    def _checkout(self, checkout_dir: Path, commit: str) -> None:
+        """Checks out the commit in the shared checkout, cloning it the first time.
+
+        Only the files that differ between the commits are touched, so make
+        only rebuilds what they affect.
+        """
+        git = ["git", "-C", checkout_dir.as_posix()]
+        if not (checkout_dir / ".git").exists():
+            print(
+                f"[bold blue]Cloning dvm-dos-tem to {checkout_dir} directory..."
+                "[/bold blue]"
+            )
+            checkout_dir.parent.mkdir(parents=True, exist_ok=True)
+            subprocess.run(
+                ["git", "clone", DVMDOSTEM_REPOSITORY, checkout_dir.as_posix()],
+                check=True,
+            )
+        elif subprocess.run(
+            [*git, "cat-file", "-e", f"{commit}^{{commit}}"], capture_output=True
+        ).returncode != 0:
+            subprocess.run([*git, "fetch", "--tags", "origin"], check=True)
+            subprocess.run([*git, "fetch", "origin", commit], check=True)
+
+        subprocess.run([*git, "checkout", "--force", commit], check=True)
+
+    def _install_compiled(self) -> Path:
+        """Compiles the requested commit of dvm-dos-tem into the cache."""
+        version = self._version or DEFAULT_VERSION
+        commit = resolve_commit(version)
+        install_dir = self.cache_dir / get_commit_key(commit)
+        if install_dir.exists():
+            print(
+                f"[bold yellow]dvm-dos-tem {version} is cached in {install_dir}"
+                "[/bold yellow]"
+            )
+            return install_dir
+
+        checkout_dir = self.cache_dir / CHECKOUT_FOLDER
+        self._checkout(checkout_dir, commit)
+        print(
+            f"[bold green]dvm-dos-tem {version} ({commit[:12]}) is checked out"
+            "[/bold green]"
+        )
+
+        subprocess.run(
+            self._get_build_command(checkout_dir),
+            shell=True,
+            check=True,
+            executable="/bin/bash",
+        )
+        print("[bold green]dvmdostem binary is successfully compiled.[/bold green]")
+
+        partial_dir = get_partial_path(install_dir)
+        if partial_dir.exists():
+            shutil.rmtree(partial_dir)
+        shutil.copytree(
+            checkout_dir,
+            partial_dir,
+            symlinks=True,
+            ignore=shutil.ignore_patterns(".git"),
+        )
+        self._make_executable(partial_dir)
+        complete_install(install_dir)
+        return install_dir
+
+    def _install(self) -> Path:
+        # a cached installation is switched to without asking the remotes
+        if self._version in get_cached_installs(self.cache_dir):
+            return self.cache_dir / self._version
+
+        # a version other than a cached one can only be compiled
+        if self._compile or self._version:
+            return self._install_compiled()
+
+        return self._install_prebuilt()
 
     def execute(self):
         if self.user == "root":
@@ -22,46 +202,33 @@ class InitCommand(BaseCommand):
         # Copy necessary files from the cloud
         # dvm-dos-tem version v0.7.0 - 2023-06-14
         # Note: dvmdostem binary is compiled with USEMPI=true flag
-        if self.dvmdostem_path.exists():
-            print("[bold yellow]dvm-dos-tem already exists, using current installation...[/bold yellow]")
-        else:
-            if self._compile:
-                # Clone from GitHub and compile
-                print(f"[bold blue]Cloning dvm-dos-tem to {self.dvmdostem_path} directory...[/bold blue]")
-                subprocess.run(
-                    f"git clone https://github.com/uaf-arctic-eco-modeling/dvm-dos-tem.git {self.dvmdostem_path}",
-                    shell=True,
-                    check=True,
-                    executable="/bin/bash",
+        install_key = None
+        if self.dvmdostem_path.exists() and not self.dvmdostem_path.is_symlink():
+            if self._version:
+                print(
+                    f"[red bold]{self.dvmdostem_path} isn't managed by the "
+                    "installation cache. "
+                    f"Move it away to install {self._version}.[/red bold]"
                 )
-                print(f"[bold green]dvm-dos-tem is cloned to {self.dvmdostem_path}[/bold green]")
-
-                print("[bold blue]Compiling dvmdostem binary...[/bold blue]")
-                command = f"""
-                cd {self.dvmdostem_path} && \
-                export DOWNLOADPATH=/dependencies && \
-                if [ -f "$DOWNLOADPATH/setup-env.sh" ]; then \
-                    . $DOWNLOADPATH/setup-env.sh && \
-                    module load openmpi; \
-                fi && \
-                make USEMPI=true
-                """
-
-                subprocess.run(command, shell=True, check=True, executable="/bin/bash")
-                print("[bold green]dvmdostem binary is successfully compiled.[/bold green]")
-            else:
-                # Copy pre-built version from bucket (default)
-                basedir = str(self.dvmdostem_path.parent)
-                print(f"[bold blue]Copying dvm-dos-tem to {self.dvmdostem_path} directory...[/bold blue]")
-                download_directory("gcp-slurm", "dvm-dos-tem/", basedir)
-                print(f"[bold green]dvm-dos-tem is copied to {self.dvmdostem_path}[/bold green]")
-
-            subprocess.run([f"chmod +x {self.dvmdostem_bin_path}"], shell=True, check=True)
-            # Make all Python scripts in scripts directory executable (recursively)
-            subprocess.run(
-                f"find {self.dvmdostem_scripts_path} -name '*.py' -exec chmod +x {{}} \\;",
-                shell=True,
-                check=True
+                exit(1)
+            print(
+                "[bold yellow]dvm-dos-tem already exists, "
+                "using current installation...[/bold yellow]"
+            )
+        elif self.dvmdostem_path.exists() and not (self._version or self._compile):
+            # the active installation, e.g. a compiled version, is kept
+            install_key = get_active_install(self.dvmdostem_path)
+            print(
+                f"[bold yellow]dvm-dos-tem already exists, using current installation "
+                f"{install_key}...[/bold yellow]"
+            )
+        else:
+            install_dir = self._install()
+            activate_install(install_dir, self.dvmdostem_path)
+            install_key = install_dir.name
+            print(
+                f"[bold green]{self.dvmdostem_path} points to {install_dir}"
+                "[/bold green]"
             )
 
         if Path(self.output_spec_path).exists():
@@ -113,9 +280,12 @@ class InitCommand(BaseCommand):
         # )
 
         # Save configuration to config file (save the parent directory, not the full path)
-        config = {"basedir": str(self.dvmdostem_path.parent)}
-        with open(CONFIG_FILE_PATH, "w") as f:
-            json.dump(config, f, indent=2)
+        config = read_config()
+        config["basedir"] = str(self.dvmdostem_path.parent)
+        config["cache_dir"] = str(self.cache_dir)
+        if install_key:
+            config["dvmdostem_install"] = install_key
+        write_config(config)
         print(f"[bold green]Configuration saved to {CONFIG_FILE_PATH}[/bold green]")
 
         print(
@@ -7,6 +7,7 @@ from netCDF4 import Dataset
 from numpy.ma.core import MaskedArray
 
 from batch_processing.cmd.base import BaseCommand
+from batch_processing.utils.manifest import get_batch_dirs
 from batch_processing.utils.utils import (
     get_batch_number,
     get_dimensions,
@@ -28,12 +29,15 @@ class MapCommand(BaseCommand):
 
     def execute(self):
         print("Pulling run_status and run-mask files...")
+        batch_dirs = get_batch_dirs(self.base_batch_dir)
         run_status_files = [
-            file for file in self.base_batch_dir.glob("batch_*/output/run_status.nc")
+            batch_dir / "output" / "run_status.nc" for batch_dir in batch_dirs
         ]
+        run_status_files = [file for file in run_status_files if file.exists()]
         run_mask_files = [
-            file for file in self.base_batch_dir.glob("batch_*/input/run-mask.nc")
+            batch_dir / "input" / "run-mask.nc" for batch_dir in batch_dirs
         ]
+        run_mask_files = [file for file in run_mask_files if file.exists()]
 
         run_status_batch_numbers = [get_batch_number(file) for file in run_status_files]
         run_status_files.sort(key=get_batch_number)
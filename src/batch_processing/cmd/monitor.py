@@ -9,15 +9,20 @@ examining SLURM reason codes and partition constraints to prevent false positive
 Based on the pseudo-code from the paper:
 1. Initialize job_status_map = {} and preemption_count = {}
 2. While True:
-    a. Fetch SLURM queue state: `squeue --format="%i,%T,%R,%P"`
-    b. For each job: compare current vs. previous status
+    a. Fetch SLURM queue state of the user's pending and running jobs on the
+       spot partitions: `squeue --me --partition=<spot> --states=PENDING,RUNNING`
+    b. For each job: compare current vs. cached status, only changed jobs
+       are looked at further
     c. Validate preemption assumption:
        - RUNNING -> PENDING + NodeFail reason + spot partition = preemption
        - Other transitions or reasons indicate scheduling constraints
     d. For validated preempted jobs:
-       - Execute `scontrol update JobID=<id> Partition=regular`
+       - Execute `scontrol update JobID=<id>,<id>,... Partition=regular` for
+         batches of jobs, concurrently
        - Log rollback action and increment preemption count
-    e. Update job_status_map and sleep for 60 seconds
+    e. Append the preemption events to the persistent store
+    f. Update job_status_map and sleep for the poll interval, which is
+       tightened during preemption storms and backed off when the queue is idle
 """
 
 import subprocess
@@ -27,14 +32,21 @@ import os
 import sys
 import signal
 import atexit
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from typing import Dict, Tuple, Set
-from dataclasses import dataclass
+from typing import Dict, List, Tuple, Set
 from pathlib import Path
 from rich.console import Console
 from rich.logging import RichHandler
+from rich.table import Table
 
 from batch_processing.cmd.base import BaseCommand
+from batch_processing.utils.preemption_store import (
+    DEFAULT_STORE_PATH,
+    PreemptionEvent,
+    PreemptionStore,
+)
 
 logging.basicConfig(
     level=logging.INFO,
@@ -45,6 +57,18 @@ logging.basicConfig(
 
 logger = logging.getLogger("monitor")
 
+# Job states a preemption can be detected from
+MONITORED_STATES = ("PENDING", "RUNNING")
+
+# Poll intervals in seconds
+MIN_POLL_INTERVAL = 15
+DEFAULT_POLL_INTERVAL = 60
+MAX_POLL_INTERVAL = 300
+
+# Number of jobs updated by a single scontrol call and number of concurrent calls
+ROLLBACK_BATCH_SIZE = 100
+ROLLBACK_WORKERS = 4
+
 
 class Daemon:
     """Daemon class to run the monitor in the background"""
@@ -189,73 +213,188 @@ class Daemon:
             return False
 
 
-@dataclass
 class JobState:
     """Represents the state of a SLURM job"""
-    job_id: str
-    status: str
-    reason: str
-    partition: str
-    timestamp: datetime
+
+    __slots__ = ("job_id", "status", "reason", "partition", "name", "timestamp")
+
+    def __init__(
+        self,
+        job_id: str,
+        status: str,
+        reason: str,
+        partition: str,
+        name: str,
+        timestamp: datetime,
+    ):
+        self.job_id = job_id
+        self.status = status
+        self.reason = reason
+        self.partition = partition
+        self.name = name
+        self.timestamp = timestamp
+
+    def __repr__(self):
+        return (
+            f"JobState(job_id={self.job_id!r}, status={self.status!r}, "
+            f"reason={self.reason!r}, partition={self.partition!r}, "
+            f"name={self.name!r})"
+        )
+
+
+def format_job_ids(job_ids: List[str]) -> str:
+    """
+    Format job IDs as a comma separated list for scontrol
+
+    Tasks of the same array job are written as a single range expression,
+    e.g. ["12_1", "12_2", "12_3", "12_7", "15"] becomes "12_[1-3,7],15".
+
+    Args:
+        job_ids: Job IDs, either plain or <array_job_id>_<task_id>
+
+    Returns:
+        Comma separated job list
+    """
+    tasks_by_array = defaultdict(list)
+    # a plain job ID can also be the ID of an array job, e.g. "12" and
+    # "12_1", so plain jobs and arrays are kept apart, in order of appearance
+    tokens = {}
+    for job_id in job_ids:
+        array_id, _, task_id = job_id.partition("_")
+        if task_id.isdigit():
+            tokens[(True, array_id)] = None
+            tasks_by_array[array_id].append(int(task_id))
+        else:
+            tokens[(False, job_id)] = None
+
+    formatted = []
+    for is_array, token in tokens:
+        if not is_array:
+            formatted.append(token)
+            continue
+
+        task_ids = sorted(set(tasks_by_array[token]))
+        ranges = []
+        start = previous = task_ids[0]
+        for task_id in task_ids[1:] + [None]:
+            if task_id is not None and task_id == previous + 1:
+                previous = task_id
+                continue
+            ranges.append(str(start) if start == previous else f"{start}-{previous}")
+            if task_id is not None:
+                start = previous = task_id
+        if len(task_ids) == 1:
+            formatted.append(f"{token}_{task_ids[0]}")
+        else:
+            formatted.append(f"{token}_[{','.join(ranges)}]")
+
+    return ",".join(formatted)
 
 
 class SlurmJobMonitor:
     """Monitors SLURM jobs and handles preemption rollbacks"""
     
-    def __init__(self, spot_partitions: Set[str] = None, regular_partition: str = "compute"):
+    def __init__(
+        self,
+        spot_partitions: Set[str] = None,
+        regular_partition: str = "compute",
+        store: PreemptionStore = None,
+    ):
         """
         Initialize the monitor
         
         Args:
             spot_partitions: Set of partition names for spot/preemptible nodes
             regular_partition: Name of the regular/on-premise partition
+            store: Store the preemption events are appended to
         """
         self.spot_partitions = spot_partitions or {"spot", "dask"}
         self.regular_partition = regular_partition
+        self.store = store
         self.job_status_map: Dict[str, JobState] = {}
-        self.preemption_count: Dict[str, int] = {}
+        # Counts are restored from the store, so they survive restarts
+        self.preemption_count: Dict[str, int] = store.count_by_job() if store else {}
         
         logger.info(f"Initialized SLURM monitor")
         logger.info(f"Spot partitions: {self.spot_partitions}")
         logger.info(f"Regular partition: {self.regular_partition}")
     
-    def fetch_slurm_queue_state(self) -> Dict[str, JobState]:
+    def fetch_slurm_queue_state(self) -> Dict[str, Tuple[str, str, str, str]]:
         """
         Fetch current SLURM queue state using squeue command
-        
+
+        Only the user's own pending and running jobs on the spot partitions
+        are queried, since no other job can be rolled back.
+
         Returns:
-            Dictionary mapping job_id to JobState
+            Dictionary mapping job_id to a (status, reason, partition, name)
+            tuple, or None if the queue state couldn't be fetched
         """
         try:
-            cmd = ["squeue", "--format=%i,%T,%R,%P", "--noheader"]
+            cmd = [
+                "squeue",
+                "--me",
+                f"--partition={','.join(sorted(self.spot_partitions))}",
+                f"--states={','.join(MONITORED_STATES)}",
+                "--format=%i,%T,%R,%P,%j",
+                "--noheader",
+            ]
             result = subprocess.run(cmd, capture_output=True, text=True, check=True)
-            
+
             current_jobs = {}
-            timestamp = datetime.now()
-            
-            for line in result.stdout.strip().split('\n'):
-                if not line.strip():
-                    continue
-                    
-                parts = line.strip().split(',')
-                if len(parts) >= 4:
-                    job_id, status, reason, partition = parts[0], parts[1], parts[2], parts[3]
-                    current_jobs[job_id] = JobState(
-                        job_id=job_id,
-                        status=status,
-                        reason=reason,
-                        partition=partition,
-                        timestamp=timestamp
-                    )
-            
+            for line in result.stdout.splitlines():
+                # the job name comes last since it may contain commas
+                parts = line.strip().split(',', 4)
+                if len(parts) == 5:
+                    current_jobs[parts[0]] = (parts[1], parts[2], parts[3], parts[4])
+
             return current_jobs
-            
+
         except subprocess.CalledProcessError as e:
             logger.error(f"Failed to fetch SLURM queue state: {e}")
-            return {}
+            return None
         except Exception as e:
             logger.error(f"Unexpected error fetching queue state: {e}")
-            return {}
+            return None
+
+    def update_job_states(
+        self, current_jobs: Dict[str, Tuple[str, str, str, str]]
+    ) -> List[Tuple[JobState, JobState]]:
+        """
+        Update the cached job states with the current queue state
+
+        Jobs whose state didn't change since the last poll are left as they
+        are, so a new record is only created for new and changed jobs.
+
+        Args:
+            current_jobs: Dictionary mapping job_id to (status, reason, partition, name)
+
+        Returns:
+            List of (old_state, new_state) pairs of the jobs that changed
+        """
+        changes = []
+        timestamp = datetime.now()
+
+        for job_id, (status, reason, partition, name) in current_jobs.items():
+            old_state = self.job_status_map.get(job_id)
+            if old_state is None:
+                logger.debug(
+                    f"Job {job_id}: Adding to tracking "
+                    f"(status: {status}, partition: {partition})"
+                )
+            elif (old_state.status, old_state.reason, old_state.partition) == (
+                status,
+                reason,
+                partition,
+            ):
+                continue
+
+            new_state = JobState(job_id, status, reason, partition, name, timestamp)
+            self.job_status_map[job_id] = new_state
+            if old_state is not None:
+                changes.append((old_state, new_state))
+
+        return changes
     
     def validate_preemption(self, job_id: str, old_state: JobState, new_state: JobState) -> bool:
         """
@@ -297,27 +436,114 @@ class SlurmJobMonitor:
         Returns:
             True if rollback was successful, False otherwise
         """
-        try:
-            # Update job partition to regular
-            cmd = ["scontrol", "update", f"JobID={job_id}", f"Partition={self.regular_partition}"]
-            result = subprocess.run(cmd, capture_output=True, text=True, check=True)
-            
+        return self.rollback_jobs([job_id])[job_id]
+
+    def rollback_jobs(self, job_ids: List[str]) -> Dict[str, bool]:
+        """
+        Rollback many preempted jobs to the regular partition
+
+        The jobs are updated in batches of ROLLBACK_BATCH_SIZE with a single
+        scontrol call each, and the batches are sent concurrently. If a batch
+        fails, its jobs are retried one by one to find out which of them
+        couldn't be rolled back.
+
+        Args:
+            job_ids: Job IDs to rollback
+
+        Returns:
+            Dictionary mapping every job_id to True if its rollback was
+            successful, False otherwise
+        """
+        job_ids = list(dict.fromkeys(job_ids))
+        batches = [
+            job_ids[i:i + ROLLBACK_BATCH_SIZE]
+            for i in range(0, len(job_ids), ROLLBACK_BATCH_SIZE)
+        ]
+
+        results = {}
+        with ThreadPoolExecutor(max_workers=ROLLBACK_WORKERS) as executor:
+            for batch_results in executor.map(self._rollback_batch, batches):
+                results.update(batch_results)
+
+        for job_id, succeeded in results.items():
+            if not succeeded:
+                continue
+
             # Increment preemption count
             self.preemption_count[job_id] = self.preemption_count.get(job_id, 0) + 1
-            
             logger.info(f"Job {job_id}: Successfully rolled back to '{self.regular_partition}' partition "
                        f"(preemption #{self.preemption_count[job_id]})")
-            
+
+        return results
+
+    def _rollback_batch(self, job_ids: List[str]) -> Dict[str, bool]:
+        """Rollback a batch of jobs, or one job at a time if the batch fails"""
+        if self._update_partition(format_job_ids(job_ids)):
+            return {job_id: True for job_id in job_ids}
+
+        if len(job_ids) == 1:
+            return {job_ids[0]: False}
+
+        logger.warning(
+            f"Rollback of {len(job_ids)} jobs failed, retrying them one by one"
+        )
+        return {job_id: self._update_partition(job_id) for job_id in job_ids}
+
+    def _update_partition(self, job_list: str) -> bool:
+        """Move the given comma separated jobs to the regular partition"""
+        try:
+            cmd = [
+                "scontrol",
+                "update",
+                f"JobID={job_list}",
+                f"Partition={self.regular_partition}",
+            ]
+            subprocess.run(cmd, capture_output=True, text=True, check=True)
             return True
-            
+
         except subprocess.CalledProcessError as e:
-            logger.error(f"Job {job_id}: Failed to rollback - {e}")
+            logger.error(
+                f"Jobs {job_list}: Failed to rollback - {e.stderr.strip() or e}"
+            )
             return False
         except Exception as e:
-            logger.error(f"Job {job_id}: Unexpected error during rollback - {e}")
+            logger.error(f"Jobs {job_list}: Unexpected error during rollback - {e}")
             return False
     
-    def cleanup_completed_jobs(self, current_jobs: Dict[str, JobState]):
+    def record_preemptions(
+        self,
+        preempted_jobs: List[Tuple[JobState, JobState]],
+        results: Dict[str, bool],
+    ):
+        """
+        Append the preemption events to the store
+
+        Args:
+            preempted_jobs: (old_state, new_state) pairs of the preempted jobs
+            results: Dictionary mapping job_id to the result of its rollback
+        """
+        if self.store is None:
+            return
+
+        events = [
+            PreemptionEvent(
+                job_id=new_state.job_id,
+                job_name=new_state.name,
+                partition=old_state.partition,
+                reason=new_state.reason,
+                preempted_at=new_state.timestamp,
+                rolled_back=results.get(new_state.job_id, False),
+            )
+            for old_state, new_state in preempted_jobs
+        ]
+        try:
+            self.store.record(events)
+        except Exception as e:
+            logger.error(f"Failed to record {len(events)} preemptions: {e}")
+
+    def cleanup_completed_jobs(
+        self, current_jobs: Dict[str, Tuple[str, str, str, str]]
+    ):
         """
         Clean up tracking data for completed/cancelled jobs
         
@@ -340,51 +566,100 @@ class SlurmJobMonitor:
             # if job_id in self.preemption_count:
             #     del self.preemption_count[job_id]
     
+    def next_poll_interval(
+        self, interval: float, preemptions: int, changes: int
+    ) -> float:
+        """
+        Pick the time to wait before the next poll
+
+        Preempted jobs usually come in storms when the spot capacity is
+        reclaimed, so the interval is tightened as soon as a preemption is
+        seen. It relaxes back to the default while the queue is steady, and
+        backs off further while there are no jobs to watch.
+
+        Args:
+            interval: Current poll interval in seconds
+            preemptions: Number of preemptions detected in the last cycle
+            changes: Number of job state changes seen in the last cycle
+
+        Returns:
+            Poll interval in seconds
+        """
+        if preemptions > 0:
+            return MIN_POLL_INTERVAL
+
+        if not self.job_status_map:
+            return min(interval * 2, MAX_POLL_INTERVAL)
+
+        if changes > 0:
+            return min(interval, DEFAULT_POLL_INTERVAL)
+
+        return min(max(interval * 2, MIN_POLL_INTERVAL), DEFAULT_POLL_INTERVAL)
+
     def monitor_jobs(self):
         """
         Main monitoring loop - continuously monitor and handle preemptions
         """
         logger.info("Starting SLURM job monitoring loop...")
-        
+        interval = DEFAULT_POLL_INTERVAL
+
         try:
             while True:
                 current_jobs = self.fetch_slurm_queue_state()
-                
+
+                if current_jobs is None:
+                    # keep the cached states, the jobs may still be in the queue
+                    time.sleep(interval)
+                    continue
+
                 if not current_jobs:
-                    logger.debug("No jobs found in queue or failed to fetch queue state")
+                    logger.debug("No jobs found in queue")
                 else:
                     logger.debug(f"Monitoring {len(current_jobs)} jobs")
-                
+
                 preemptions_detected = 0
-                
-                # Check each job for preemption
-                for job_id, current_state in current_jobs.items():
-                    if job_id in self.job_status_map:
-                        # Job exists in our tracking - check for state changes
-                        old_state = self.job_status_map[job_id]
-                        
-                        if self.validate_preemption(job_id, old_state, current_state):
-                            if self.rollback_job(job_id):
-                                preemptions_detected += 1
-                    else:
-                        # New job - add to tracking
-                        logger.debug(f"Job {job_id}: Adding to tracking (status: {current_state.status}, "
-                                   f"partition: {current_state.partition})")
-                
-                # Update job status map with current states
-                self.job_status_map.update(current_jobs)
-                
+
+                # Check the changed jobs for preemption
+                changes = self.update_job_states(current_jobs)
+                preempted_jobs = [
+                    (old_state, new_state)
+                    for old_state, new_state in changes
+                    if self.validate_preemption(new_state.job_id, old_state, new_state)
+                ]
+                if preempted_jobs:
+                    results = self.rollback_jobs(
+                        [new_state.job_id for _, new_state in preempted_jobs]
+                    )
+                    self.record_preemptions(preempted_jobs, results)
+                    preemptions_detected = sum(results.values())
+                    failed_jobs = [
+                        job_id for job_id, succeeded in results.items() if not succeeded
+                    ]
+                    if failed_jobs:
+                        logger.error(
+                            f"Failed to rollback {len(failed_jobs)} jobs: "
+                            f"{', '.join(failed_jobs)}"
+                        )
+
                 # Clean up completed jobs from tracking
                 self.cleanup_completed_jobs(current_jobs)
-                
+
                 # Log summary if preemptions were detected
                 if preemptions_detected > 0:
                     total_preemptions = sum(self.preemption_count.values())
                     logger.info(f"Cycle complete: {preemptions_detected} new preemptions detected, "
                                f"{total_preemptions} total preemptions handled")
-                
-                # Sleep for 60 seconds before next check
-                time.sleep(60)
+
+                new_interval = self.next_poll_interval(
+                    interval, preemptions_detected, len(changes)
+                )
+                if new_interval != interval:
+                    logger.debug(
+                        f"Poll interval changed from {interval}s to {new_interval}s"
+                    )
+                interval = new_interval
+
+                time.sleep(interval)
                 
         except KeyboardInterrupt:
             logger.info("Monitoring stopped by user")
@@ -404,7 +679,45 @@ class MonitorCommand(BaseCommand):
         home_dir = Path.home()
         self.pidfile = home_dir / ".slurm-monitor.pid"
         self.logfile = home_dir / ".slurm-monitor.log"
+        self.store_path = DEFAULT_STORE_PATH
         self.daemon = Daemon(str(self.pidfile), str(self.logfile))
+
+    def _print_stats(self):
+        """Print the preemptions per batch, per partition and per hour"""
+        if not self.store_path.exists():
+            logger.info(
+                f"No preemptions are recorded yet ({self.store_path} doesn't exist)"
+            )
+            return
+
+        campaign = getattr(self._args, "campaign", None)
+        console = Console()
+        with PreemptionStore(self.store_path) as store:
+            tables = [
+                (
+                    "Preemptions per batch",
+                    ("Job Name", "Preemptions", "Last Preemption"),
+                    store.count_by_batch(campaign),
+                ),
+                (
+                    "Preemptions per partition",
+                    ("Partition", "Preemptions", "Rolled Back"),
+                    store.count_by_partition(campaign),
+                ),
+                (
+                    "Preemptions per hour",
+                    ("Hour", "Preemptions"),
+                    store.count_by_hour(campaign),
+                ),
+            ]
+
+        for title, columns, rows in tables:
+            table = Table(title=title)
+            for column in columns:
+                table.add_column(column)
+            for row in rows:
+                table.add_row(*[str(value) for value in row])
+            console.print(table)
     
     def _run_monitor(self):
         """Internal method to run the actual monitoring"""
@@ -427,7 +740,8 @@ class MonitorCommand(BaseCommand):
         # Initialize and start monitor
         monitor = SlurmJobMonitor(
             spot_partitions=set(spot_partitions),
-            regular_partition=regular_partition
+            regular_partition=regular_partition,
+            store=PreemptionStore(self.store_path)
         )
         
         try:
@@ -467,6 +781,9 @@ class MonitorCommand(BaseCommand):
             
         elif action == 'status':
             self.daemon.status()
+
+        elif action == 'stats':
+            self._print_stats()
             
         else:
             logger.error(f"Unknown action: {action}")
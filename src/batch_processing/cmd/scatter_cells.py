@@ -0,0 +1,87 @@
+from pathlib import Path
+
+from netCDF4 import Dataset
+
+from batch_processing.cmd.base import BaseCommand
+from batch_processing.cmd.extract_cell import CELL_MAPPING_FILE_NAME
+from batch_processing.utils.utils import interpret_path, read_json_file
+
+
+def _get_grid_dims(dims: tuple):
+    """Returns the names of the X and Y dimensions, None if there aren't any.
+
+    Regular outputs use lower case dimension names, restart and run_status
+    files use upper case ones.
+    """
+    for x_dim, y_dim in (("x", "y"), ("X", "Y")):
+        if x_dim in dims and y_dim in dims:
+            return x_dim, y_dim
+    return None
+
+
+def scatter_file(packed_file: Path, merged_file: Path, cells: list) -> None:
+    """Writes every cell of a packed output file into the merged output file
+    at the cell's original coordinates."""
+    with Dataset(packed_file) as packed, Dataset(merged_file, "r+") as merged:
+        packed.set_auto_maskandscale(False)
+        merged.set_auto_maskandscale(False)
+
+        for name, variable in packed.variables.items():
+            grid_dims = _get_grid_dims(variable.dimensions)
+            if grid_dims is None or name not in merged.variables:
+                continue
+
+            x_axis = variable.dimensions.index(grid_dims[0])
+            y_axis = variable.dimensions.index(grid_dims[1])
+            data = variable[:]
+            merged_variable = merged.variables[name]
+            for cell in cells:
+                packed_index = [slice(None)] * data.ndim
+                packed_index[x_axis] = cell["index"]
+                packed_index[y_axis] = 0
+
+                merged_index = [slice(None)] * data.ndim
+                merged_index[x_axis] = cell["X"]
+                merged_index[y_axis] = cell["Y"]
+
+                merged_variable[tuple(merged_index)] = data[tuple(packed_index)]
+
+
+class ScatterCellsCommand(BaseCommand):
+    """Writes the results of a packed batch back into the merged outputs."""
+
+    def __init__(self, args):
+        super().__init__()
+        self._args = args
+        self.packed_path = Path(interpret_path(args.input_path))
+        self.merged_path = Path(interpret_path(args.output_path))
+
+    def execute(self):
+        mapping_path = self.packed_path / CELL_MAPPING_FILE_NAME
+        if not mapping_path.exists():
+            raise FileNotFoundError(
+                f"{mapping_path} doesn't exist. Is {self.packed_path} created "
+                "with 'bp extract_cell --pack'?"
+            )
+
+        cells = read_json_file(mapping_path)["cells"]
+        packed_files = sorted((self.packed_path / "output").glob("*.nc"))
+        if not packed_files:
+            print(f"No output files are found in {self.packed_path / 'output'}.")
+            return
+
+        for packed_file in packed_files:
+            merged_file = self.merged_path / packed_file.name
+            if not merged_file.exists():
+                print(
+                    f"Skipping {packed_file.name}, it doesn't exist in "
+                    f"{self.merged_path}"
+                )
+                continue
+
+            print(f"Scattering {packed_file.name}...")
+            scatter_file(packed_file, merged_file, cells)
+
+        print(
+            f"{len(cells)} cells are successfully written back to {self.merged_path}."
+        )
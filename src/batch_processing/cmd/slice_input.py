@@ -1,56 +1,335 @@
+import math
 import multiprocessing as mp
+import queue
 import shutil
 import subprocess
+from contextlib import ExitStack
 from dataclasses import dataclass
+from multiprocessing import shared_memory
+from multiprocessing.connection import wait
 from pathlib import Path
-from typing import List, Union
+from typing import Dict, List, Tuple, Union
 
-import xarray as xr
+import numpy as np
+from netCDF4 import Dataset
 
 from batch_processing.cmd.base import BaseCommand
 from batch_processing.utils.utils import (
     INPUT_FILES,
     INPUT_FILES_TO_COPY,
     Chunk,
-    create_chunks,
+    copy_variable_data,
+    create_balanced_chunks,
+    create_netcdf_like,
+    get_available_memory,
     get_dimensions,
+    get_itemsize,
     interpret_path,
     render_slurm_job_script,
+    write_json_file,
 )
 
 MIN_CELL_COUNT = 500_000
 SLICE_COUNT = 10
+X_SLICE_COUNT = 1
+# Memory a single reader is allowed to use for its shared Y windows, in MB.
+DEFAULT_MEMORY_BUDGET = 1024
+# One buffer is filled by the reader while the other one is being written.
+BUFFER_COUNT = 2
+# Seconds to wait for the writers before checking whether they are alive.
+WRITER_POLL_INTERVAL = 5
+TILE_MANIFEST_FILE_NAME = "tiles.json"
 
 
 @dataclass
-class ChunkTask:
-    chunk: Chunk
-    src_path: str
-    dest_path: str
+class Tile:
+    id: int
+    y: Chunk
+    x: Chunk
+    active_cells: int
 
+    @property
+    def name(self) -> str:
+        return f"{self.y.start}_{self.y.end}_{self.x.start}_{self.x.end}"
 
-def slice_and_save(chunk_task: ChunkTask) -> None:
-    """Slice a chunk of the dataset and save it to a new NetCDF file."""
+
+@dataclass
+class SliceTask:
+    src_path: Path
+    tiles: List[Tile]
+    dest_paths: List[Path]
+    memory_budget: int
+    writer_count: int = 1
+
+
+def create_tiles(run_mask: np.ndarray, y_slices: int, x_slices: int) -> List[Tile]:
+    """
+    Split the grid into tiles with about the same number of active cells.
+
+    The grid is first split into `y_slices` bands along Y, then every band is
+    split into `x_slices` tiles along X, both balanced by the active cells
+    of the run mask.
+    """
+    active = run_mask > 0
+    tiles = []
+    for y_chunk in create_balanced_chunks(active.sum(axis=1), y_slices):
+        band = active[y_chunk.start : y_chunk.end]
+        for x_chunk in create_balanced_chunks(band.sum(axis=0), x_slices):
+            active_cells = int(band[:, x_chunk.start : x_chunk.end].sum())
+            tiles.append(Tile(len(tiles), y_chunk, x_chunk, active_cells))
+
+    return tiles
+
+
+@dataclass
+class WindowMessage:
+    """Tells a writer which variable and Y window a shared buffer holds."""
+
+    slot: int
+    name: str
+    start: int
+    end: int
+    shape: Tuple[int, ...]
+    dtype: str
+
+
+def _get_row_size(variable) -> int:
+    """Returns the size of a single Y row of the variable in bytes."""
+    y_size = variable.shape[variable.dimensions.index("Y")]
+    return get_itemsize(variable) * math.prod(variable.shape) // max(y_size, 1)
+
+
+def _write_window(
+    window: np.ndarray,
+    message: WindowMessage,
+    dims: tuple,
+    tiles: List[Tile],
+    dests: List[Dataset],
+) -> None:
+    """Writes the part of a Y window that overlaps with each of the tiles."""
+    y_axis = dims.index("Y")
+    x_axis = dims.index("X") if "X" in dims else None
+
+    for tile, dest in zip(tiles, dests):
+        start = max(tile.y.start, message.start)
+        end = min(tile.y.end, message.end)
+        if start >= end:
+            continue
+
+        # explicit bounds let unlimited dimensions grow in the output
+        src_index = [slice(0, size) for size in window.shape]
+        src_index[y_axis] = slice(start - message.start, end - message.start)
+        dest_index = list(src_index)
+        dest_index[y_axis] = slice(start - tile.y.start, end - tile.y.start)
+        if x_axis is not None:
+            src_index[x_axis] = slice(tile.x.start, tile.x.end)
+            dest_index[x_axis] = slice(0, tile.x.end - tile.x.start)
+        dest.variables[message.name][tuple(dest_index)] = window[tuple(src_index)]
+
+
+def _copy_variable_in_tiles(
+    name: str, variable, dests: List[Dataset], tiles: List[Tile]
+) -> None:
+    """Copies the X range of every tile from a variable without a Y dimension."""
+    x_axis = variable.dimensions.index("X")
+    data = variable[:]
+    for tile, dest in zip(tiles, dests):
+        src_index = [slice(0, size) for size in data.shape]
+        src_index[x_axis] = slice(tile.x.start, tile.x.end)
+        dest_index = list(src_index)
+        dest_index[x_axis] = slice(0, tile.x.end - tile.x.start)
+        dest.variables[name][tuple(dest_index)] = data[tuple(src_index)]
+
+
+def _create_destinations(src: Dataset, task: SliceTask) -> None:
+    """
+    Creates the output files of a task and copies the variables without a Y
+    dimension, which are small enough to be written by the reader itself.
+    """
+    with ExitStack() as stack:
+        dests = []
+        for tile, dest_path in zip(task.tiles, task.dest_paths):
+            dim_sizes = {
+                "Y": tile.y.end - tile.y.start,
+                "X": tile.x.end - tile.x.start,
+            }
+            dest = create_netcdf_like(src, dest_path, dim_sizes)
+            dests.append(stack.enter_context(dest))
+
+        for name, variable in src.variables.items():
+            if "Y" in variable.dimensions:
+                continue
+            if "X" in variable.dimensions:
+                _copy_variable_in_tiles(name, variable, dests, task.tiles)
+            else:
+                for dest in dests:
+                    copy_variable_data(variable, dest.variables[name])
+
+
+def write_tiles(
+    tiles: List[Tile],
+    dest_paths: List[Path],
+    dims_by_name: Dict[str, tuple],
+    buffers: List[shared_memory.SharedMemory],
+    messages: mp.Queue,
+    done: mp.Queue,
+) -> None:
+    """
+    Writer side of the slicer. Owns the output files of the given tiles and
+    copies every Y window the reader puts into the shared buffers into them.
+    """
+    with ExitStack() as stack:
+        dests = []
+        for dest_path in dest_paths:
+            dest = stack.enter_context(Dataset(dest_path, "r+"))
+            dest.set_auto_maskandscale(False)
+            dests.append(dest)
+
+        failed = False
+        while (message := messages.get()) is not None:
+            if not failed:
+                try:
+                    window = np.ndarray(
+                        message.shape, message.dtype, buffer=buffers[message.slot].buf
+                    )
+                    dims = dims_by_name[message.name]
+                    _write_window(window, message, dims, tiles, dests)
+                    del window
+                except Exception as e:
+                    print(f"Error writing {message.name} to {dest_paths}: {e}")
+                    failed = True
+
+            # the reader waits for every writer before reusing the slot, so
+            # the slot is released even if the window couldn't be written
+            done.put(message.slot)
+
+    if failed:
+        raise SystemExit(1)
+
+
+def _wait_for_writer(done: mp.Queue, writers: List[mp.Process]) -> int:
+    """Returns the next slot released by a writer."""
+    while True:
+        try:
+            return done.get(timeout=WRITER_POLL_INTERVAL)
+        except queue.Empty:
+            stopped = [writer.pid for writer in writers if not writer.is_alive()]
+            if stopped:
+                raise RuntimeError(f"Writer processes {stopped} stopped unexpectedly")
+
+
+def _stream_windows(src: Dataset, task: SliceTask) -> None:
+    """Feeds the Y windows of the source to the writers of the task's tiles."""
+    variables = {
+        name: variable
+        for name, variable in src.variables.items()
+        if "Y" in variable.dimensions
+    }
+    if not variables:
+        return
+
+    # a buffer holds at least one Y row of every variable
+    row_sizes = [_get_row_size(variable) for variable in variables.values()]
+    buffer_size = max(1, task.memory_budget // BUFFER_COUNT, *row_sizes)
+    buffers = [
+        shared_memory.SharedMemory(create=True, size=buffer_size)
+        for _ in range(BUFFER_COUNT)
+    ]
+    dims_by_name = {name: variable.dimensions for name, variable in variables.items()}
+
+    writer_count = max(1, min(task.writer_count, len(task.tiles)))
+    done = mp.Queue()
+    writers = []
+    queues = []
+    for index in range(writer_count):
+        tile_indices = range(index, len(task.tiles), writer_count)
+        messages = mp.Queue()
+        writer = mp.Process(
+            target=write_tiles,
+            args=(
+                [task.tiles[i] for i in tile_indices],
+                [task.dest_paths[i] for i in tile_indices],
+                dims_by_name,
+                buffers,
+                messages,
+                done,
+            ),
+        )
+        writer.start()
+        writers.append(writer)
+        queues.append(messages)
+
+    pending = [0] * BUFFER_COUNT
+    slot = 0
     try:
-        print(f"Processing {chunk_task.src_path}...")
-        with xr.open_dataset(
-            chunk_task.src_path, engine="netcdf4", decode_times=False
-        ) as dataset:
-            subset = dataset.isel(Y=slice(chunk_task.chunk.start, chunk_task.chunk.end))
-            subset.to_netcdf(
-                chunk_task.dest_path,
-                encoding={
-                    "albers_conical_equal_area": {"dtype": "str"},
-                    "lat": {"_FillValue": None},
-                    "lon": {"_FillValue": None},
-                },
-            )
-        print(f"Done processing {chunk_task.src_path}!")
+        for name, variable in variables.items():
+            y_axis = variable.dimensions.index("Y")
+            y_size = variable.shape[y_axis]
+            rows_per_window = max(1, buffer_size // max(_get_row_size(variable), 1))
+
+            for start in range(0, y_size, rows_per_window):
+                while pending[slot]:
+                    pending[_wait_for_writer(done, writers)] -= 1
+
+                end = min(start + rows_per_window, y_size)
+                index = [slice(None)] * variable.ndim
+                index[y_axis] = slice(start, end)
+                data = np.asarray(variable[tuple(index)])
+                window = np.ndarray(data.shape, data.dtype, buffer=buffers[slot].buf)
+                window[...] = data
+                del window
+
+                message = WindowMessage(
+                    slot, name, start, end, data.shape, data.dtype.str
+                )
+                for messages in queues:
+                    messages.put(message)
+                pending[slot] = len(writers)
+                slot = (slot + 1) % BUFFER_COUNT
+
+        while any(pending):
+            pending[_wait_for_writer(done, writers)] -= 1
+    finally:
+        for messages in queues:
+            messages.put(None)
+        for writer in writers:
+            writer.join()
+        for buffer in buffers:
+            buffer.close()
+            buffer.unlink()
+
+    failed = [writer.pid for writer in writers if writer.exitcode != 0]
+    if failed:
+        raise RuntimeError(f"Writer processes {failed} exited with an error")
+
+
+def slice_file(task: SliceTask) -> None:
+    """
+    Slice a NetCDF file into all of the given tiles.
+
+    This is the reader side of the slicer. The source is opened once and
+    read in contiguous Y windows into shared memory buffers, which the
+    writer processes copy into the tile outputs. Two buffers are used, so
+    the next window is read while the previous one is being written, and
+    every byte of the source is read exactly once.
+
+    Raises the error of the reader or of any of the writers.
+    """
+    print(f"Processing {task.src_path}...")
+    with Dataset(task.src_path) as src:
+        src.set_auto_maskandscale(False)
+        _create_destinations(src, task)
+        _stream_windows(src, task)
+
+    print(f"Done processing {task.src_path}!")
+
+
+def slice_and_save(task: SliceTask) -> None:
+    """Slices a NetCDF file like slice_file, printing the error if it fails."""
+    try:
+        slice_file(task)
     except Exception as e:
-        print(
-            f"Error processing chunk {chunk_task.src_path} for "
-            f"{chunk_task.src_path}: {e}"
-        )
+        print(f"Error processing {task.src_path}: {e}")
 
 
 class SliceInputCommand(BaseCommand):
@@ -60,6 +339,9 @@ class SliceInputCommand(BaseCommand):
 
         self.input_path = Path(interpret_path(args.input_path))
         self.output_path = Path(interpret_path(args.output_path))
+        self.memory_budget = getattr(args, "memory_budget", DEFAULT_MEMORY_BUDGET)
+        self.slices = getattr(args, "slices", SLICE_COUNT)
+        self.x_slices = getattr(args, "x_slices", X_SLICE_COUNT)
 
     def _check_cell_count(self, input_file_path: str) -> Union[bool, int]:
         """
@@ -82,25 +364,87 @@ class SliceInputCommand(BaseCommand):
 
         return False, Y
 
-    def _prepare_tasks_from_chunks(self, chunks: List[Chunk]) -> List[ChunkTask]:
+    def _get_tile_directory(self, tile: Tile) -> Path:
+        # slicing only along Y keeps the original directory names
+        if self.x_slices == 1:
+            return self.output_path / f"{tile.y.start}_{tile.y.end}"
+
+        return self.output_path / tile.name
+
+    def _create_tiles(self) -> List[Tile]:
+        with Dataset(self.input_path / "run-mask.nc") as dataset:
+            run_mask = np.asarray(dataset.variables["run"][:]).astype(int)
+
+        return create_tiles(run_mask, self.slices, self.x_slices)
+
+    def _write_tile_manifest(self, tiles: List[Tile]) -> None:
+        content = {
+            "input_path": str(self.input_path),
+            "tiles": [
+                {
+                    "id": tile.id,
+                    "path": self._get_tile_directory(tile).name,
+                    "y_start": tile.y.start,
+                    "y_end": tile.y.end,
+                    "x_start": tile.x.start,
+                    "x_end": tile.x.end,
+                    "active_cells": tile.active_cells,
+                }
+                for tile in tiles
+            ],
+        }
+        write_json_file(self.output_path / TILE_MANIFEST_FILE_NAME, content)
+
+    def _prepare_tasks_from_tiles(self, tiles: List[Tile]) -> List[SliceTask]:
+        tile_directory_paths = []
+        for tile in tiles:
+            tile_directory_path = self._get_tile_directory(tile)
+            tile_directory_path.mkdir(parents=True, exist_ok=True)
+            tile_directory_paths.append(tile_directory_path)
+
         tasks = []
         for input_file in INPUT_FILES:
-            print(f"Processing {input_file}...")
             input_file_path = self.input_path / input_file
+            dest_paths = [path / input_file for path in tile_directory_paths]
 
-            for chunk in chunks:
-                chunk_directory_path = self.output_path / f"{chunk.start}_{chunk.end}"
-                chunk_directory_path.mkdir(parents=True, exist_ok=True)
-
-                chunk_file_path = chunk_directory_path / input_file
-                if input_file in INPUT_FILES_TO_COPY:
-                    shutil.copy(input_file_path, chunk_file_path)
-                else:
-                    t = ChunkTask(chunk, input_file_path, chunk_file_path)
-                    tasks.append(t)
+            if input_file in INPUT_FILES_TO_COPY:
+                for dest_path in dest_paths:
+                    shutil.copy(input_file_path, dest_path)
+            else:
+                task = SliceTask(
+                    input_file_path,
+                    tiles,
+                    dest_paths,
+                    self.memory_budget * 1024 * 1024,
+                )
+                tasks.append(task)
 
         return tasks
 
+    def _get_reader_count(self, task_count: int) -> int:
+        """Picks as many readers as the available memory and the CPUs allow."""
+        memory_budget = self.memory_budget * 1024 * 1024
+        readers_fit_in_memory = get_available_memory() // memory_budget
+        return max(1, min(mp.cpu_count(), task_count, readers_fit_in_memory))
+
+    def _run_tasks(self, tasks: List[SliceTask], reader_count: int) -> None:
+        """
+        Runs a reader process for every task, at most `reader_count` at once.
+        Readers start their own writers, so they can't be pool workers.
+        """
+        running = []
+        for task in tasks:
+            if len(running) >= reader_count:
+                wait([process.sentinel for process in running])
+                running = [process for process in running if process.is_alive()]
+
+            process = mp.Process(target=slice_and_save, args=(task,))
+            process.start()
+            running.append(process)
+
+        for process in running:
+            process.join()
+
     def _submit_job(self) -> Union[str, str]:
         substitution_values = {
             "job_name": "slice input job",
@@ -108,6 +452,9 @@ class SliceInputCommand(BaseCommand):
             "log_path": f"{self.exacloud_user_dir}/slice_input.log",
             "input_path": self._args.input_path,
             "output_path": self._args.output_path,
+            "memory_budget": self.memory_budget,
+            "slices": self.slices,
+            "x_slices": self.x_slices,
         }
         job_script = render_slurm_job_script("slice_input_job.sh", substitution_values)
         result = subprocess.run(
@@ -127,18 +474,31 @@ class SliceInputCommand(BaseCommand):
             print("The given output path exists. Removing it...")
             shutil.rmtree(self.output_path)
 
-        should_terminate, DIMENSION_SIZE = self._check_cell_count(
-            self.input_path / "vegetation.nc"
-        )
+        should_terminate, _ = self._check_cell_count(self.input_path / "vegetation.nc")
         if should_terminate:
             exit(1)
 
         if self._args.launch_as_job:
-            chunks = create_chunks(DIMENSION_SIZE, SLICE_COUNT)
-            tasks = self._prepare_tasks_from_chunks(chunks)
+            tiles = self._create_tiles()
+            print(
+                f"Slicing into {len(tiles)} tiles with "
+                f"{min(tile.active_cells for tile in tiles)} to "
+                f"{max(tile.active_cells for tile in tiles)} active cells each"
+            )
+            tasks = self._prepare_tasks_from_tiles(tiles)
+            self._write_tile_manifest(tiles)
+
+            reader_count = self._get_reader_count(len(tasks))
+            # the CPUs left by the readers are shared between their writers
+            writer_count = max(1, mp.cpu_count() // reader_count - 1)
+            for task in tasks:
+                task.writer_count = writer_count
 
-            with mp.Pool(processes=mp.cpu_count()) as pool:
-                pool.map(slice_and_save, tasks)
+            print(
+                f"Slicing {len(tasks)} files with {reader_count} readers, "
+                f"each using up to {self.memory_budget} MB and {writer_count} writers"
+            )
+            self._run_tasks(tasks, reader_count)
         else:
             stdout, stderr = self._submit_job()
             if stderr == "":
@@ -6,7 +6,18 @@ import textwrap
 import lazy_import
 
 from batch_processing.utils.utils import get_email_from_username
-from batch_processing.cmd.base import get_basedir_from_config, DVMDOSTEM_FOLDER
+from batch_processing.cmd.base import (
+    DVMDOSTEM_FOLDER,
+    get_basedir_from_config,
+    read_config,
+    write_config,
+)
+from batch_processing.utils.install_cache import (
+    CACHE_FOLDER,
+    activate_install,
+    get_active_install,
+    get_cached_installs,
+)
 
 InitCommand = lazy_import.lazy_class("batch_processing.cmd.init.InitCommand")
 BatchSplitCommand = lazy_import.lazy_class(
@@ -21,6 +32,15 @@ BatchMergeCommand = lazy_import.lazy_class(
 BatchPlotCommand = lazy_import.lazy_class(
     "batch_processing.cmd.batch.plot.BatchPlotCommand"
 )
+BatchRebalanceCommand = lazy_import.lazy_class(
+    "batch_processing.cmd.batch.rebalance.BatchRebalanceCommand"
+)
+BatchRetryCommand = lazy_import.lazy_class(
+    "batch_processing.cmd.batch.retry.BatchRetryCommand"
+)
+BatchReportCommand = lazy_import.lazy_class(
+    "batch_processing.cmd.batch.report.BatchReportCommand"
+)
 BatchPostprocessCommand = lazy_import.lazy_class(
     "batch_processing.cmd.batch.postprocess.BatchPostprocessCommand"
 )
@@ -29,6 +49,9 @@ ExtractCellCommand = lazy_import.lazy_class(
     "batch_processing.cmd.extract_cell.ExtractCellCommand"
 )
 MapCommand = lazy_import.lazy_class("batch_processing.cmd.map.MapCommand")
+ScatterCellsCommand = lazy_import.lazy_class(
+    "batch_processing.cmd.scatter_cells.ScatterCellsCommand"
+)
 SliceInputCommand = lazy_import.lazy_class(
     "batch_processing.cmd.slice_input.SliceInputCommand"
 )
@@ -51,6 +74,12 @@ class SlurmPartition(str, Enum):
     compute = "compute"
 
 
+class CleanupMode(str, Enum):
+    background = "background"
+    slurm = "slurm"
+    sync = "sync"
+
+
 app = typer.Typer(
     help=textwrap.dedent(
         """
@@ -96,18 +125,83 @@ def init(
         "--compile",
         help="Clone dvm-dos-tem from GitHub and compile it instead of copying pre-built version from bucket",
     ),
+    version: Optional[str] = typer.Option(
+        None,
+        "--version",
+        help=(
+            "Branch, tag or commit of dvm-dos-tem to compile, implies --compile "
+            "(master by default), or the name of a cached installation to switch to"
+        ),
+    ),
+    cache_dir: Optional[str] = typer.Option(
+        None,
+        "--cache-dir",
+        help=(
+            "Directory of the cached dvm-dos-tem installations. "
+            "Defaults to <basedir>/.dvm-dos-tem-cache"
+        ),
+    ),
+    jobs: int = typer.Option(
+        0,
+        "--jobs",
+        "-j",
+        help=(
+            "Number of parallel compile jobs with --compile. "
+            "0 uses all available cores"
+        ),
+    ),
+    ccache: bool = typer.Option(
+        True,
+        "--ccache/--no-ccache",
+        help="Compile through ccache when it's installed",
+    ),
 ):
     """Initialize the environment for running the simulation."""
-    args = type("Args", (), {"basedir": basedir, "compile": compile})()
+    args = type(
+        "Args",
+        (),
+        {
+            "basedir": basedir,
+            "compile": compile,
+            "version": version,
+            "cache_dir": cache_dir,
+            "jobs": jobs,
+            "ccache": ccache,
+        },
+    )()
     InitCommand(args).execute()
 
 
 @app.command("tem")
-def tem():
+def tem(
+    list_installs: bool = typer.Option(
+        False, "--list", help="List the cached dvm-dos-tem installations"
+    ),
+    use: Optional[str] = typer.Option(
+        None, "--use", help="Switch to the given cached dvm-dos-tem installation"
+    ),
+):
     """Show the current dvm-dos-tem installation path."""
     from pathlib import Path
     basedir = get_basedir_from_config()
     dvmdostem_path = Path(basedir) / DVMDOSTEM_FOLDER
+    config = read_config()
+    cache_dir = Path(config.get("cache_dir", Path(basedir) / CACHE_FOLDER))
+
+    if use:
+        if use not in get_cached_installs(cache_dir):
+            typer.echo(f"{use} isn't in the cache at {cache_dir}. Run 'bp tem --list'.")
+            raise typer.Exit(1)
+        activate_install(cache_dir / use, dvmdostem_path)
+        config["dvmdostem_install"] = use
+        write_config(config)
+
+    if list_installs:
+        active = get_active_install(dvmdostem_path)
+        for key in get_cached_installs(cache_dir):
+            typer.echo(f"{'*' if key == active else ' '} {key}")
+        return
+
     typer.echo(dvmdostem_path)
 
 
@@ -137,12 +231,43 @@ def diff(
     path_two: str = typer.Argument(
         ..., help="Second path to compare"
     ),
+    atol: float = typer.Option(
+        0.0, "--atol", help="Absolute tolerance when comparing values"
+    ),
+    rtol: float = typer.Option(
+        0.0, "--rtol", help="Relative tolerance when comparing values"
+    ),
+    workers: Optional[int] = typer.Option(
+        None,
+        "--workers",
+        "-w",
+        help="Number of processes comparing files. By default, the CPU count",
+    ),
+    manifest: bool = typer.Option(
+        False,
+        "--manifest",
+        help=(
+            "Cache per-block content hashes in both directories and only read "
+            "the blocks whose hashes differ"
+        ),
+    ),
 ):
     """
     Compare the NetCDF files in the given directories.
-    The given two directories must contain the same files.
+    Every differing file and variable is reported.
     """
-    args = type("Args", (), {"path_one": path_one, "path_two": path_two})()
+    args = type(
+        "Args",
+        (),
+        {
+            "path_one": path_one,
+            "path_two": path_two,
+            "atol": atol,
+            "rtol": rtol,
+            "workers": workers,
+            "manifest": manifest,
+        },
+    )()
     DiffCommand(args).execute()
 
 
@@ -163,6 +288,23 @@ def slice_input(
     force: bool = typer.Option(
         False, "--force", "-f", help="Override if the given output path exists"
     ),
+    memory_budget: int = typer.Option(
+        1024,
+        "--memory-budget",
+        "-m",
+        help=(
+            "Memory in MB each reader may use for its shared buffers. "
+            "The number of readers is chosen from the available memory"
+        ),
+    ),
+    slices: int = typer.Option(
+        10, "--slices", "-s", help="Number of slices along the Y dimension"
+    ),
+    x_slices: int = typer.Option(
+        1,
+        "--x-slices",
+        help="Number of tiles every Y slice is split into along the X dimension",
+    ),
     launch_as_job: bool = typer.Option(
         False,
         "--launch-as-job",
@@ -171,7 +313,7 @@ def slice_input(
     ),
 ):
     """
-    Slices the given input data into 10 smaller folders.
+    Slices the given input data into smaller folders with balanced active cells.
     To use this command, the given input has to have at least 500,000 cells.
     """
     args = type(
@@ -181,6 +323,9 @@ def slice_input(
             "input_path": input_path,
             "output_path": output_path,
             "force": force,
+            "memory_budget": memory_budget,
+            "slices": slices,
+            "x_slices": x_slices,
             "launch_as_job": launch_as_job,
         },
     )()
@@ -238,6 +383,27 @@ def batch_split(
     restart_run: bool = typer.Option(
         False, "--restart-run", help="Add --no-output-cleanup flag to mpirun command"
     ),
+    max_streaming_size: float = typer.Option(
+        64,
+        "--max-streaming-size",
+        help=(
+            "Remote inputs up to this many GB are split on this node without a "
+            "dask cluster"
+        ),
+    ),
+    streaming_workers: int = typer.Option(
+        8,
+        "--streaming-workers",
+        help="Number of processes that split remote inputs on this node",
+    ),
+    cleanup: CleanupMode = typer.Option(
+        CleanupMode.background,
+        "--cleanup",
+        help=(
+            "How the old batches are deleted after they are moved aside: in a "
+            "background process, in a Slurm job, or before the split goes on"
+        ),
+    ),
 ):
     """Split the given input data into smaller batches."""
     # Create args object for compatibility with command class
@@ -254,6 +420,9 @@ def batch_split(
         "log_level": log_level.value,
         "job_name_prefix": job_name_prefix,
         "restart_run": restart_run,
+        "max_streaming_size": max_streaming_size,
+        "streaming_workers": streaming_workers,
+        "cleanup": cleanup.value,
     }
     args = type("Args", (), all_args)()
     BatchSplitCommand(args).execute()
@@ -270,9 +439,33 @@ def batch_run(
             "with /mnt/exacloud/$USER"
         ),
     ),
+    placement: bool = typer.Option(
+        False,
+        "--placement",
+        help=(
+            "Decide per batch whether to submit to spot or compute using the "
+            "runtimes of the previous run and the recorded preemptions"
+        ),
+    ),
+    max_preemption_risk: float = typer.Option(
+        0.5,
+        "--max-preemption-risk",
+        help=(
+            "Batches more likely than this to be preempted on spot are "
+            "submitted to compute. Used with --placement"
+        ),
+    ),
 ):
     """Submit the batches to the Slurm queue."""
-    args = type("Args", (), {"batches": batches})()
+    args = type(
+        "Args",
+        (),
+        {
+            "batches": batches,
+            "placement": placement,
+            "max_preemption_risk": max_preemption_risk,
+        },
+    )()
     BatchRunCommand(args).execute()
 
 
@@ -306,6 +499,120 @@ def batch_merge(
     BatchMergeCommand(args).execute()
 
 
+@batch_app.command("rebalance")
+def batch_rebalance(
+    batches: str = typer.Option(
+        ...,
+        "--batches",
+        "-b",
+        help=(
+            "Path to store the splitted batches. The given path will be concataned "
+            "with /mnt/exacloud/$USER"
+        ),
+    ),
+    sub_batches: int = typer.Option(
+        4, "--sub-batches", "-n", help="Number of sub-batches a straggler is split into"
+    ),
+    straggler_factor: float = typer.Option(
+        2.0,
+        "--straggler-factor",
+        help=(
+            "Running batches taking longer than this times the median run time "
+            "of the finished batches are stragglers"
+        ),
+    ),
+    min_finished: int = typer.Option(
+        5,
+        "--min-finished",
+        help="Minimum number of finished batches to compare the running ones with",
+    ),
+    dry_run: bool = typer.Option(
+        False, "--dry-run", help="Only list the stragglers without cancelling them"
+    ),
+):
+    """Cancel straggling batches, split them into sub-batches and resubmit them."""
+    args = type(
+        "Args",
+        (),
+        {
+            "batches": batches,
+            "sub_batches": sub_batches,
+            "straggler_factor": straggler_factor,
+            "min_finished": min_finished,
+            "dry_run": dry_run,
+        },
+    )()
+    BatchRebalanceCommand(args).execute()
+
+
+@batch_app.command("retry")
+def batch_retry(
+    batches: str = typer.Option(
+        ...,
+        "--batches",
+        "-b",
+        help=(
+            "Path to store the splitted batches. The given path will be concataned "
+            "with /mnt/exacloud/$USER"
+        ),
+    ),
+    max_attempts: int = typer.Option(
+        3, "--max-attempts", help="Maximum number of times a batch is resubmitted"
+    ),
+    dry_run: bool = typer.Option(
+        False,
+        "--dry-run",
+        help="Only list the failed batches without resubmitting them",
+    ),
+):
+    """Resubmit the failed batches, keeping their outputs and restart files."""
+    args = type(
+        "Args",
+        (),
+        {"batches": batches, "max_attempts": max_attempts, "dry_run": dry_run},
+    )()
+    BatchRetryCommand(args).execute()
+
+
+@batch_app.command("report")
+def batch_report(
+    batches: str = typer.Option(
+        ...,
+        "--batches",
+        "-b",
+        help=(
+            "Path to store the splitted batches. The given path will be concataned "
+            "with /mnt/exacloud/$USER"
+        ),
+    ),
+    output_path: Optional[str] = typer.Option(
+        None,
+        "--output-path",
+        "-o",
+        help=(
+            "File to write the report into. A .parquet suffix writes Parquet, "
+            "anything else CSV. By default, report.csv in the batch folder"
+        ),
+    ),
+    straggler_factor: float = typer.Option(
+        1.5,
+        "--straggler-factor",
+        help="Batches taking longer than this times the median are stragglers",
+    ),
+):
+    """Report the timing and throughput of every batch."""
+    args = type(
+        "Args",
+        (),
+        {
+            "batches": batches,
+            "output_path": output_path,
+            "straggler_factor": straggler_factor,
+        },
+    )()
+    BatchReportCommand(args).execute()
+
+
 @batch_app.command("plot")
 def batch_plot(
     batches: str = typer.Option(
@@ -345,8 +652,26 @@ def extract_cell(
     output_path: str = typer.Option(
         ..., "--output-path", "-o", help="Path to the output folder"
     ),
-    x: int = typer.Option(..., "-X", help="The row to extract"),
-    y: int = typer.Option(..., "-Y", help="The column to extract"),
+    x: Optional[int] = typer.Option(None, "-X", help="The row to extract"),
+    y: Optional[int] = typer.Option(None, "-Y", help="The column to extract"),
+    coords_file: Optional[str] = typer.Option(
+        None,
+        "--coords-file",
+        "-c",
+        help=(
+            "Extract every cell listed in the given file instead of a single one. "
+            "Either failed_cell_coords.txt written by 'bp map' or a CSV file "
+            "with X and Y columns"
+        ),
+    ),
+    pack: bool = typer.Option(
+        False,
+        "--pack",
+        help=(
+            "Pack all of the given cells into a single batch with a synthetic "
+            "grid. The original coordinates are written to cell_mapping.json"
+        ),
+    ),
     slurm_partition: SlurmPartition = typer.Option(
         SlurmPartition.spot,
         "--slurm-partition",
@@ -362,12 +687,18 @@ def extract_cell(
         LogLevel.disabled, "--log-level", "-l", help="Set the log level"
     ),
 ):
-    """Extracts a single cell and creates a batch."""
+    """Extracts one or more cells and creates a batch for each of them."""
+    if coords_file is None and (x is None or y is None):
+        typer.echo("Error: Either -X and -Y or --coords-file must be specified")
+        raise typer.Exit(1)
+
     all_args = {
         "input_path": input_path,
         "output_path": output_path,
         "X": x,
         "Y": y,
+        "coords_file": coords_file,
+        "pack": pack,
         "slurm_partition": slurm_partition.value,
         "p": p,
         "e": e,
@@ -380,6 +711,26 @@ def extract_cell(
     ExtractCellCommand(args).execute()
 
 
+@app.command("scatter_cells")
+def scatter_cells(
+    input_path: str = typer.Option(
+        ...,
+        "--input-path",
+        "-i",
+        help="Path to the batch created by 'bp extract_cell --pack'",
+    ),
+    output_path: str = typer.Option(
+        ...,
+        "--output-path",
+        "-o",
+        help="Path to the merged outputs, e.g. all_merged folder of a run",
+    ),
+):
+    """Writes the results of a packed batch back to their original coordinates."""
+    args = type("Args", (), {"input_path": input_path, "output_path": output_path})()
+    ScatterCellsCommand(args).execute()
+
+
 @app.command("map")
 def map_command(
     batches: str = typer.Option(
@@ -401,8 +752,17 @@ def map_command(
 def monitor(
     action: str = typer.Argument(
         "start",
-        help="Action to perform: start, stop, restart, or status"
-    )
+        help="Action to perform: start, stop, restart, status, or stats"
+    ),
+    campaign: str = typer.Option(
+        None,
+        "--campaign",
+        "-c",
+        help=(
+            "Only show the statistics of the batch jobs of the given campaign, "
+            "e.g. my-run-input"
+        ),
+    ),
 ):
     """
     Monitor SLURM jobs and automatically rollback preempted jobs (runs as background daemon).
@@ -416,13 +776,17 @@ def monitor(
         bp monitor stop     # Stop the monitoring daemon  
         bp monitor restart  # Restart the monitoring daemon
         bp monitor status   # Check daemon status
+        bp monitor stats    # Show recorded preemptions per batch, partition and hour
         bp monitor          # Same as 'start'
     """
-    if action not in ["start", "stop", "restart", "status"]:
-        typer.echo(f"Error: Invalid action '{action}'. Use: start, stop, restart, or status")
+    if action not in ["start", "stop", "restart", "status", "stats"]:
+        typer.echo(
+            f"Error: Invalid action '{action}'. "
+            "Use: start, stop, restart, status, or stats"
+        )
         raise typer.Exit(1)
         
-    args = type("Args", (), {"action": action})()
+    args = type("Args", (), {"action": action, "campaign": campaign})()
     MonitorCommand(args).execute()
 
 
@@ -14,4 +14,4 @@ git clone https://github.com/whrc/batch-processing.git
 cd batch-processing/
 pip install .
 
-~/.local/bin/bp slice_input -i $input_path -o $output_path --launch-as-job
+~/.local/bin/bp slice_input -i $input_path -o $output_path --memory-budget $memory_budget --slices $slices --x-slices $x_slices --launch-as-job
@@ -0,0 +1,274 @@
+"""Google Cloud Storage and Dask helpers.
+
+Importing this module loads gcsfs, google-cloud-storage and dask-jobqueue.
+"""
+
+import base64
+import math
+import os
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from pathlib import Path
+from typing import List, Tuple, Union
+
+import gcsfs
+import google_crc32c
+from dask.distributed import Client
+from dask_jobqueue import SLURMCluster
+from google.cloud import storage
+
+DEFAULT_DOWNLOAD_WORKERS = 16
+# Blobs of at least this size are downloaded in slices
+SLICED_DOWNLOAD_THRESHOLD = 64 * 1024 * 1024
+DOWNLOAD_CHUNK_SIZE = 16 * 1024 * 1024
+PARTIAL_DOWNLOAD_SUFFIX = ".part"
+
+# Workers of the dask partition
+WORKER_CORES = 4
+MIN_WORKER_MEMORY_GB = 8
+MAX_WORKER_MEMORY_GB = 30
+MAX_WORKERS = 100
+BYTES_PER_WORKER = 2 * 1024**3
+# Chunks per core a worker needs memory for: input, output and spilling
+CHUNKS_IN_MEMORY = 4
+
+
+def compute_crc32c(path: Union[Path, str]) -> str:
+    """Returns the CRC32C of a file, base64 encoded like the one of a blob."""
+    checksum = google_crc32c.Checksum()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(DOWNLOAD_CHUNK_SIZE), b""):
+            checksum.update(chunk)
+
+    return base64.b64encode(checksum.digest()).decode("ascii")
+
+
+def is_up_to_date(blob, path: Path) -> bool:
+    """Checks if the local file has the same size and CRC32C as the blob."""
+    if not path.is_file() or blob.size is None:
+        return False
+
+    if path.stat().st_size != blob.size:
+        return False
+
+    # the size is enough for the blobs without a CRC32C
+    return blob.crc32c is None or compute_crc32c(path) == blob.crc32c
+
+
+def _download_blob(blob, temp_path: Path) -> None:
+    blob.download_to_filename(temp_path.as_posix())
+
+
+def _download_slice(blob, temp_path: Path, start: int, end: int) -> None:
+    # ranges are inclusive, checksums can only be validated for whole blobs
+    data = blob.download_as_bytes(start=start, end=end, checksum=None)
+    with open(temp_path, "r+b") as file:
+        file.seek(start)
+        file.write(data)
+
+
+def _finish_download(blob, temp_path: Path, path: Path) -> None:
+    if blob.crc32c is not None and compute_crc32c(temp_path) != blob.crc32c:
+        temp_path.unlink()
+        raise OSError(f"CRC32C of {blob.name} doesn't match, the download is corrupted")
+
+    os.replace(temp_path, path)
+
+
+def get_directory_files(
+    bucket_name: str, blob_name: str, bucket=None
+) -> List[Tuple[str, int, str]]:
+    """Returns the name relative to `blob_name`, size and CRC32C of every
+    file in a directory of a bucket."""
+    if bucket is None:
+        bucket = storage.Client().bucket(bucket_name)
+
+    return [
+        (blob.name[len(blob_name) :], blob.size, blob.crc32c)
+        for blob in bucket.list_blobs(prefix=blob_name)
+        if not blob.name.endswith("/")
+    ]
+
+
+def download_directory(
+    bucket_name: str,
+    blob_name: str,
+    output_path: str,
+    workers: int = DEFAULT_DOWNLOAD_WORKERS,
+    bucket=None,
+    strip_prefix: bool = False,
+) -> Tuple[int, int]:
+    """Downloads a directory from Google Cloud Storage.
+
+    The blobs are downloaded concurrently by a thread pool, and the ones
+    larger than SLICED_DOWNLOAD_THRESHOLD are downloaded in slices of
+    DOWNLOAD_CHUNK_SIZE bytes in parallel. Files that already exist with
+    the same size and CRC32C as their blob are skipped, and every file is
+    written next to its destination and moved into place once it's
+    complete, so an interrupted download can be resumed by calling this
+    again.
+
+    Args:
+        bucket_name (str): Bucket name
+        blob_name (str): The full path of the desired directory
+        output_path (str): Directory to download the blobs into
+        workers (int): Number of download threads
+        bucket: Bucket to download from instead of `bucket_name`. Anything
+            with the `list_blobs(prefix=...)` method of
+            google.cloud.storage.Bucket works, as long as its blobs have
+            `name`, `size`, `crc32c`, `download_to_filename(path)` and
+            `download_as_bytes(start=..., end=..., checksum=...)`.
+        strip_prefix (bool): Write the files relative to `blob_name`
+            instead of with their full blob names.
+
+    Returns:
+        Tuple[int, int]: The number of downloaded and skipped files
+
+    Example:
+        Consider the below `gsutil URI`:
+
+        gs://wcrc-tfstate-9486302/slurm-lustre-dvmdostem-v5/slurm-lustre-dvmdostem-v5/primary
+
+        In the above URI, `wcrc-tfstate-9486302` is the bucket name and
+        `slurm-lustre-dvmdostem-v5/slurm-lustre-dvmdostem-v5/primary` is the blob_name.
+    """
+    if bucket is None:
+        bucket = storage.Client().bucket(bucket_name)
+
+    to_download = []
+    skipped = 0
+    for blob in bucket.list_blobs(prefix=blob_name):
+        if blob.name.endswith("/"):
+            continue
+
+        name = blob.name[len(blob_name) :] if strip_prefix else blob.name
+        path = Path(output_path, name)
+        if is_up_to_date(blob, path):
+            skipped += 1
+            continue
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        to_download.append((blob, path))
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {}
+        for blob, path in to_download:
+            temp_path = path.with_name(path.name + PARTIAL_DOWNLOAD_SUFFIX)
+            if blob.size is None or blob.size < SLICED_DOWNLOAD_THRESHOLD:
+                futures[executor.submit(_download_blob, blob, temp_path)] = path
+                continue
+
+            # the slices write into their own ranges of a preallocated file
+            with open(temp_path, "wb") as file:
+                file.truncate(blob.size)
+            for start in range(0, blob.size, DOWNLOAD_CHUNK_SIZE):
+                end = min(start + DOWNLOAD_CHUNK_SIZE, blob.size) - 1
+                future = executor.submit(_download_slice, blob, temp_path, start, end)
+                futures[future] = path
+
+        remaining = Counter(futures.values())
+        blobs = {path: blob for blob, path in to_download}
+        for future in as_completed(futures):
+            # raises the error of a failed download
+            future.result()
+            path = futures[future]
+            remaining[path] -= 1
+            if remaining[path] == 0:
+                temp_path = path.with_name(path.name + PARTIAL_DOWNLOAD_SUFFIX)
+                _finish_download(blobs[path], temp_path, path)
+
+    return len(to_download), skipped
+
+
+def download_file(bucket_name: str, blob_name: str, output_file_name: str) -> None:
+    """
+    Downloads a file from a Google Cloud Storage bucket to a local file.
+
+    This function retrieves a blob from the specified bucket in Google Cloud Storage
+    and downloads it to a local file. The local file is saved with the specified output
+    file name.
+
+    Parameters:
+    - bucket_name (str): The name of the Google Cloud Storage bucket from which to
+    download the file.
+    - blob_name (str): The name of the blob (file) within the bucket to download.
+    - output_file_name (str): The name (including path) under which the file should be
+    saved locally.
+    """
+    storage_client = storage.Client()
+    bucket = storage_client.get_bucket(bucket_name)
+    blob = bucket.get_blob(blob_name)
+    blob.download_to_filename(output_file_name)
+
+
+def get_gcsfs():
+    return gcsfs.GCSFileSystem(project="spherical-berm-323321", token=None)
+
+
+def get_cluster(n_workers, walltime="06:00:00", memory="30GB"):
+    return SLURMCluster(
+        queue="dask",
+        n_workers=n_workers,
+        interface="ens4",
+        cores=WORKER_CORES,
+        memory=memory,
+        log_directory=f"{os.getenv('HOME')}/slurm_logs",
+        python="/usr/bin/python3",
+        walltime=walltime,
+    )
+
+
+@dataclass
+class ClusterPlan:
+    # the computation starts once this many workers are up
+    min_workers: int
+    # adaptive scaling adds workers up to this many
+    max_workers: int
+    worker_memory_gb: int
+
+
+def plan_cluster(data_bytes: int, task_count: int, chunk_bytes: int) -> ClusterPlan:
+    """Sizes a dask cluster for the given amount of work.
+
+    Every worker gets about BYTES_PER_WORKER of the data, but there are never
+    more workers than tasks or MAX_WORKERS. A worker gets enough memory to
+    hold a few chunks per core, between MIN_WORKER_MEMORY_GB and
+    MAX_WORKER_MEMORY_GB.
+
+    Args:
+        data_bytes (int): Size of the data to process
+        task_count (int): Number of tasks that can run in parallel, e.g.
+            the number of chunks or output files
+        chunk_bytes (int): Size of the largest chunk a task holds in memory
+
+    Returns:
+        ClusterPlan: Worker counts and memory to start the cluster with
+    """
+    max_workers = max(
+        1, min(math.ceil(data_bytes / BYTES_PER_WORKER), task_count, MAX_WORKERS)
+    )
+    memory_gb = math.ceil(chunk_bytes * WORKER_CORES * CHUNKS_IN_MEMORY / 1024**3)
+    memory_gb = min(max(memory_gb, MIN_WORKER_MEMORY_GB), MAX_WORKER_MEMORY_GB)
+    # the computation starts once half of the workers are up
+    min_workers = max(1, max_workers // 2)
+    return ClusterPlan(min_workers, max_workers, memory_gb)
+
+
+def start_cluster(
+    plan: ClusterPlan, walltime: str = "06:00:00"
+) -> Tuple[SLURMCluster, Client]:
+    """Starts an adaptive cluster for the plan and waits for its minimum workers.
+
+    New workers are requested up to the maximum while there are pending
+    tasks, and idle ones are released down to a single worker.
+    """
+    print(
+        f"Starting a dask cluster of {plan.min_workers}-{plan.max_workers} workers "
+        f"with {plan.worker_memory_gb}GB of memory each"
+    )
+    cluster = get_cluster(0, walltime, memory=f"{plan.worker_memory_gb}GB")
+    cluster.adapt(minimum=1, maximum=plan.max_workers)
+    client = Client(cluster)
+    client.wait_for_workers(plan.min_workers)
+    return cluster, client
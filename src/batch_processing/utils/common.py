@@ -0,0 +1,631 @@
+"""Helpers that only need the standard library.
+
+Everything here is cheap to import, so the CLI can load it on startup.
+Helpers that need numpy, netCDF4, xarray, dask or the Google Cloud
+libraries live in `netcdf`, `cloud` and `plotting`.
+"""
+
+import errno
+import json
+import os
+import random
+import re
+import shlex
+import shutil
+import string
+import subprocess
+from bisect import bisect_left
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from itertools import accumulate
+from pathlib import Path
+from string import Template
+from subprocess import CompletedProcess
+from typing import List, Optional, Sequence, Union
+
+INPUT_FILES = [
+    "co2.nc",
+    "projected-co2.nc",
+    "drainage.nc",
+    "fri-fire.nc",
+    "run-mask.nc",
+    "soil-texture.nc",
+    "topo.nc",
+    "vegetation.nc",
+    "historic-explicit-fire.nc",
+    "projected-explicit-fire.nc",
+    "projected-climate.nc",
+    "historic-climate.nc",
+]
+
+INPUT_FILES_TO_COPY = ["co2.nc", "projected-co2.nc"]
+
+IO_PATHS = {
+    "parameter_dir": "parameters/",
+    "output_dir": "output/",
+    "output_spec_file": "config/output_spec.csv",
+    "runmask_file": "input/run-mask.nc",
+    "hist_climate_file": "input/historic-climate.nc",
+    "proj_climate_file": "input/projected-climate.nc",
+    "veg_class_file": "input/vegetation.nc",
+    "drainage_file": "input/drainage.nc",
+    "soil_texture_file": "input/soil-texture.nc",
+    "co2_file": "input/co2.nc",
+    "proj_co2_file": "input/projected-co2.nc",
+    "topo_file": "input/topo.nc",
+    "fri_fire_file": "input/fri-fire.nc",
+    "hist_exp_fire_file": "input/historic-explicit-fire.nc",
+    "proj_exp_fire_file": "input/projected-explicit-fire.nc",
+}
+
+
+@dataclass
+class Chunk:
+    id: int
+    start: int
+    end: int
+
+
+def create_chunks(total_size: int, num_chunks: int) -> List[Chunk]:
+    """
+    Create chunk boundaries for slicing the dataset.
+
+    Parameters:
+    total_size (int): The total size of the dimension to be chunked.
+    num_chunks (int): The number of chunks to create.
+
+    Returns:
+    List[Chunk]: A list of Chunk instances, each containing the chunk index,
+        start index, and end index.
+    """
+    if num_chunks <= 0:
+        raise ValueError("num_chunks must be a positive integer")
+
+    chunk_size = total_size // num_chunks
+    chunks = []
+
+    for i in range(num_chunks):
+        start = i * chunk_size
+        end = start + chunk_size if i < num_chunks - 1 else total_size
+        chunks.append(Chunk(i, start, end))
+
+    return chunks
+
+
+def create_balanced_chunks(weights: Sequence[int], num_chunks: int) -> List[Chunk]:
+    """
+    Create chunk boundaries so that every chunk carries about the same weight.
+
+    Parameters:
+    weights (Sequence[int]): The weight of every index of the dimension to be
+        chunked, e.g. the number of active cells in every row.
+    num_chunks (int): The number of chunks to create. It is capped at the
+        size of the dimension so that no chunk is empty.
+
+    Returns:
+    List[Chunk]: A list of Chunk instances, each containing the chunk index,
+        start index, and end index.
+    """
+    if num_chunks <= 0:
+        raise ValueError("num_chunks must be a positive integer")
+
+    total_size = len(weights)
+    num_chunks = min(num_chunks, total_size)
+    cumulative = list(accumulate(int(weight) for weight in weights))
+    if num_chunks == 0 or cumulative[-1] <= 0:
+        return create_chunks(total_size, num_chunks) if num_chunks else []
+
+    boundaries = [0]
+    for i in range(1, num_chunks):
+        target = cumulative[-1] * i / num_chunks
+        boundary = bisect_left(cumulative, target) + 1
+        # every remaining chunk needs at least one index
+        boundary = max(boundary, boundaries[-1] + 1)
+        boundary = min(boundary, total_size - (num_chunks - i))
+        boundaries.append(boundary)
+    boundaries.append(total_size)
+
+    return [Chunk(i, boundaries[i], boundaries[i + 1]) for i in range(num_chunks)]
+
+
+def run_command(command: list) -> None:
+    """Executes a shell command."""
+    subprocess.run(command, check=True)
+
+
+def mkdir_p(path: str) -> None:
+    """Provides similar functionality to bash mkdir -p"""
+    try:
+        os.makedirs(path)
+    except OSError as exc:  # Python >2.5
+        if exc.errno == errno.EEXIST and os.path.isdir(path):
+            pass
+        else:
+            raise
+
+
+def remove_file(file: Union[str, list]):
+    """Remove the specified file or list of files.
+
+    Parameters:
+        file (str or list): File path or list of file paths to be removed.
+
+    Returns:
+        None
+    """
+    if isinstance(file, str):
+        os.remove(file)
+        return
+
+    if isinstance(file, list):
+        _ = [os.remove(f) for f in file]
+
+
+def clean_and_load_json(input: str) -> dict:
+    """
+    Cleans comments from JSON-formatted string and loads it into a Python object.
+
+    Args:
+        input (str): Input JSON-formatted string possibly containing comments.
+
+    Returns:
+        dict: Python dictionary representing the JSON data.
+    """
+    cleaned_str = re.sub("//.*\n", "\n", input)
+    json_data = json.loads(cleaned_str)
+    return json_data
+
+
+def get_slurm_queue(params: list = []) -> str:
+    command = ["squeue", "--me", "--noheader"]
+    command.extend(params)
+
+    return subprocess.check_output(command).decode("utf-8")
+
+
+def run_sacct(
+    job_ids: List[str], fields: List[str], allocations_only: bool = True
+) -> List[dict]:
+    """Queries the accounting records of the given jobs with `sacct`.
+
+    The job IDs are passed in batches of 500 per call, so thousands of jobs
+    need only a few calls.
+
+    Args:
+        job_ids (List[str]): IDs of the jobs to query.
+        fields (List[str]): sacct fields to return, e.g. ["JobID", "State"].
+        allocations_only (bool): Only return the job allocations (-X),
+                                 without the job steps.
+
+    Returns:
+        List[dict]: One dictionary per record, mapping every field to its value.
+
+    Raises:
+        subprocess.CalledProcessError: If the `sacct` command fails.
+    """
+    records = []
+    for i in range(0, len(job_ids), 500):
+        command = [
+            "sacct",
+            "--noheader",
+            "--parsable2",
+            f"--format={','.join(fields)}",
+            f"--jobs={','.join(job_ids[i : i + 500])}",
+        ]
+        if allocations_only:
+            command.append("-X")
+
+        output = subprocess.check_output(command, text=True)
+        for line in output.splitlines():
+            values = line.split("|")
+            if len(values) == len(fields):
+                records.append(dict(zip(fields, values)))
+
+    return records
+
+
+def get_progress_bar():
+    # rich.progress pulls in most of rich, so it's only imported when needed
+    from rich.progress import (
+        BarColumn,
+        MofNCompleteColumn,
+        Progress,
+        TextColumn,
+        TimeElapsedColumn,
+    )
+
+    return Progress(
+        TextColumn("[progress.percentage]{task.percentage:>3.0f}%"),
+        BarColumn(),
+        MofNCompleteColumn(),
+        TextColumn("•"),
+        TimeElapsedColumn(),
+    )
+
+
+def get_project_root() -> Path:
+    """Returns the project root."""
+    return Path(__file__).parent.parent
+
+
+def interpret_path(path: str) -> str:
+    """Converts any given relative path to an absolute path."""
+    if path.startswith("gcs://"):
+        return path
+
+    path = os.path.expanduser(path)
+
+    return os.path.abspath(path)
+
+
+def generate_random_string(N=5):
+    return "".join(random.choices(string.ascii_uppercase + string.digits, k=N))
+
+
+def get_available_memory() -> int:
+    """Returns the memory available for new processes in bytes."""
+    try:
+        with open("/proc/meminfo") as file:
+            for line in file:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+
+    return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+
+
+def get_batch_number(path: Union[Path, str]) -> int:
+    """Returns the batch number from the given path.
+
+    An example argument would be like this:
+
+    /mnt/exacloud/dteber_woodwellclimate_org/output/batch_0/output/restart-eq.nc
+
+    The return value for the above path is 0.
+    """
+    match_found = re.search(r"batch_(\d+)", str(path))
+    return int(match_found.group(1)) if match_found else -1
+
+
+def _group_dir_ranges(relative_paths: List[str], workers: int) -> List[List[str]]:
+    """Splits the folders into at most `workers` contiguous ranges.
+
+    Folders are grouped by their first path component, so a folder always
+    lands in the same range as its parent and after it.
+    """
+    groups = {}
+    for path in relative_paths:
+        groups.setdefault(path.split("/", 1)[0], []).append(path)
+
+    groups = list(groups.values())
+    size = max(1, -(-len(groups) // workers))
+    return [
+        [path for group in groups[i : i + size] for path in group]
+        for i in range(0, len(groups), size)
+    ]
+
+
+def make_dirs(base_dir: Path, relative_paths: List[str], workers: int = 16) -> None:
+    """Creates the given folders under an existing folder.
+
+    The folders are created relative to a descriptor of `base_dir`, so the
+    path of the base folder isn't resolved again for every one of them, and
+    without the existence checks of `os.makedirs`. Parents have to come
+    before their children in `relative_paths`. The paths are split into
+    contiguous ranges that are created by a few threads in parallel.
+    """
+    base_fd = os.open(base_dir, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+
+        def _make_range(paths: List[str]) -> None:
+            for path in paths:
+                os.mkdir(path, dir_fd=base_fd)
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(_make_range, _group_dir_ranges(relative_paths, workers)))
+    finally:
+        os.close(base_fd)
+
+
+def move_to_trash(paths: List[Path], trash_dir: Path) -> None:
+    """Moves the given files or folders into `trash_dir` with one rename each.
+
+    The paths have to be on the same filesystem as `trash_dir`, and none of
+    them may be inside another one since they are moved in parallel. Their
+    names in the trash are numbered, so paths with the same name don't collide.
+    """
+    trash_dir.mkdir(parents=True, exist_ok=True)
+
+    def _move(index: int, path: Path) -> None:
+        os.rename(path, trash_dir / f"{index}_{path.name}")
+
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        list(executor.map(_move, range(len(paths)), paths))
+
+
+def delete_in_background(
+    path: Path, mode: str = "background", partition: Optional[str] = None
+) -> None:
+    """Deletes a folder without waiting for it.
+
+    Args:
+        path (Path): Folder to delete.
+        mode (str): `background` deletes it in a detached process, `slurm` in
+                    a Slurm job, and `sync` deletes it before returning.
+        partition (str): Partition of the Slurm job.
+    """
+    if mode == "sync":
+        shutil.rmtree(path)
+    elif mode == "slurm":
+        command = ["sbatch", "--job-name=bp-cleanup", "--output=/dev/null"]
+        if partition:
+            command.append(f"--partition={partition}")
+        # the path is quoted, as --wrap runs the command through a shell
+        wrap = f"--wrap=rm -rf {shlex.quote(str(path))}"
+        subprocess.run([*command, wrap], check=True)
+    else:
+        # in its own session, so it keeps running after bp exits
+        subprocess.Popen(
+            ["rm", "-rf", path.as_posix()],
+            start_new_session=True,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+
+
+def get_batch_folders(path: Path) -> List[Path]:
+    """
+    Find all folders that match the pattern 'batch_[integer]' in the given path.
+
+    Args:
+        path (Path): A Path object representing the directory to search in
+
+    Returns:
+        list: A list of Path objects for folders matching the pattern
+    """
+    if not isinstance(path, Path):
+        path = Path(path)
+
+    batch_folders = []
+    for item in path.iterdir():
+        if item.is_dir():
+            batch_num = get_batch_number(item)
+            if batch_num >= 0:  # Valid batch number found
+                batch_folders.append(item)
+
+    batch_folders.sort(key=get_batch_number)
+
+    return batch_folders
+
+
+def render_slurm_job_script(template_name: str, values: dict) -> str:
+    """Reads the specified template file and populates it with the given values.
+
+    Args:
+        template_name (str): Name of the template file located in the templates folder
+                             at the root of the project.
+        values (dict): A dictionary of key-value pairs for substitution in the template.
+                       Keys represent placeholders in the template, and values are the
+                       corresponding substitution values.
+
+    Returns:
+        str: The populated job script ready to be submitted to Slurm.
+
+    Raises:
+        FileNotFoundError: If the specified template file does not exist.
+
+    """
+    template_path = get_project_root() / "templates" / template_name
+    if not template_path.exists():
+        raise FileNotFoundError(f"{template_path} doesn't exist.")
+
+    with open(template_path) as file:
+        template = Template(file.read())
+
+    return template.substitute(values)
+
+
+def read_text_file(path: str) -> str:
+    """Reads and returns the content of a text file.
+
+    Args:
+        path (str): The file system path to the text file to be read.
+
+    Returns:
+        str: The content of the file as a string.
+
+    Raises:
+        FileNotFoundError: If the specified file does not exist.
+    """
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"The given file is not found: {path}")
+
+    with open(path) as file:
+        content = file.read()
+
+    return content
+
+
+def read_json_file(path: str) -> dict:
+    """Reads and returns the content of a JSON file.
+
+    Args:
+        path (str): The file system path to the JSON file to be read.
+
+    Returns:
+        dict: The content of the file as a dictionary.
+
+    Raises:
+        FileNotFoundError: If the specified file does not exist.
+        json.JSONDecodeError: If the file content is not valid JSON.
+    """
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"The given file is not found: {path}")
+
+    with open(path) as file:
+        content = json.load(file)
+
+    return content
+
+
+def write_text_file(path: str, content: str) -> None:
+    """A self-explanatory function
+
+    Args:
+        path (str): The file system path where the content should be written.
+        content (str): The content to write to the file.
+
+    Returns:
+        None
+    """
+    with open(path, "w") as file:
+        file.write(content)
+
+
+def write_json_file(path: str, content: dict, indent: int = 4) -> None:
+    """Writes a dictionary to a file in JSON format with specified indentation.
+
+    Args:
+        path (str): The file system path where the JSON content should be written.
+        content (dict): A dictionary representing the JSON data to be written
+            to the file.
+        indent (int, optional): The number of spaces to use as indentation in the
+            JSON file. Defaults to 4.
+
+    Returns:
+        None
+    """
+    with open(path, "w") as file:
+        json.dump(content, file, indent=indent)
+
+
+def submit_job(path: str, partition: str = None) -> CompletedProcess:
+    """Submits a job script to the Slurm workload manager using the `sbatch` command.
+
+    Args:
+        path (str): The file system path to the job script to be submitted.
+        partition (str): Partition to submit the job to. Overrides the one
+                         in the job script if given.
+
+    Returns:
+        CompletedProcess: An object representing the completed process, containing
+                          information about the execution of the `sbatch` command,
+                          including stdout, stderr, and the return code.
+
+    Raises:
+        FileNotFoundError: If the specified job script file does not exist.
+        subprocess.CalledProcessError: If the `sbatch` command fails.
+    """
+    command = ["sbatch", path]
+    if partition:
+        command = ["sbatch", "-p", partition, path]
+    return subprocess.run(command, text=True, capture_output=True)
+
+
+def get_job_id(result: CompletedProcess) -> Union[str, None]:
+    """Returns the ID of the job submitted by `submit_job`, None if it failed."""
+    match = re.search(r"Submitted batch job (\d+)", result.stdout)
+    return match.group(1) if match else None
+
+
+def update_config(path: str, prefix_value: str) -> None:
+    """Updates the 'IO' section of config.js with new paths.
+
+    This function reads the JSON configuration file, modifies the 'IO' section
+    by updating the paths with a new prefix, and then writes the updated
+    configuration back to the file.
+
+    Args:
+        path (str): The file system path to the JSON configuration file to be updated.
+        prefix_value (str): The new prefix to be added to the paths in the 'IO' section.
+
+    Returns:
+        None
+    """
+    config_data = read_json_file(path)
+    for key, val in IO_PATHS.items():
+        config_data["IO"][key] = f"{prefix_value}/{val}"
+
+    write_json_file(path, config_data)
+
+
+def create_slurm_script(
+    path: str, template_name: str, substitution_values: dict
+) -> None:
+    """Creates a Slurm job script by rendering a template and writing it to a file.
+
+    This function uses a template and a set of substitution values to generate a
+    Slurm job script, and then writes the resulting script to the specified path.
+
+    Args:
+        path (str): The file system path where the Slurm job script should be saved.
+        template_name (str): The name of the template file located in the templates
+            folder at the root of the project.
+        substitution_values (dict): A dictionary of key-value pairs for substituting
+            placeholders in the template.
+
+    Returns:
+        None
+    """
+    slurm_runner = render_slurm_job_script(template_name, substitution_values)
+    write_text_file(path, slurm_runner)
+
+
+def extract_variable_name(filename):
+    """Extracts the variable name and stage name from the filename.
+
+    Example:
+        >>> extract_variable_name(
+        ...     "ALD_yearly_eq.nc"
+        ... )
+        ('ALD', 'eq')
+    """
+    parts = filename.split("_")
+    if len(parts) >= 2:
+        # Get first part and stage name (without .nc extension)
+        stage_name = parts[-1].split(".")[0]
+        return parts[0], stage_name
+    return None
+
+
+def get_email_from_username():
+    """Helper function to get the current user's email from their username"""
+    username = os.getenv("USER")
+    email_username = username.split("_")[0]
+
+    return f"{email_username}@woodwellclimate.org"
+
+
+def send_email(to: str, subject: str, body: str, pdf_path: str = None):
+    # smtplib loads ssl, which isn't needed by anything else on startup
+    import smtplib
+    from email.mime.application import MIMEApplication
+    from email.mime.multipart import MIMEMultipart
+    from email.mime.text import MIMEText
+
+    sender_email = "dteber@woodwellclimate.org"
+    password = os.getenv("CLUSTER_SEND_EMAIL_PASSWORD_DOGUKAN")
+
+    message = MIMEMultipart()
+    message["From"] = sender_email
+    message["To"] = to
+    message["Subject"] = subject
+
+    message.attach(MIMEText(body, "plain"))
+
+    if pdf_path:
+        with open(pdf_path, "rb") as file:
+            attachment = MIMEApplication(file.read(), _subtype="pdf")
+            attachment.add_header(
+                "Content-Disposition",
+                f"attachment; filename={os.path.basename(pdf_path)}",
+            )
+            message.attach(attachment)
+
+    with smtplib.SMTP_SSL("smtp.gmail.com", 465) as server:
+        server.login(sender_email, password)
+
+        server.send_message(message)
+
+    print(f"Email sent successfully to {to}")
@@ -0,0 +1,155 @@
+"""Cache of dvm-dos-tem installations.
+
+Every installation lives in a folder of the cache named after its content:
+the commit of a compiled one, or the checksum of the bucket folder of a
+pre-built one. `<basedir>/dvm-dos-tem` is a symlink to the active one, so
+switching between cached installations only replaces the symlink.
+"""
+
+import hashlib
+import os
+import re
+import shutil
+import subprocess
+from pathlib import Path
+from typing import Iterable, List, Optional, Tuple
+
+CACHE_FOLDER = ".dvm-dos-tem-cache"
+# Git checkout the commits are compiled in, so a new commit only rebuilds
+# the files it changed
+CHECKOUT_FOLDER = "checkout"
+CCACHE_FOLDER = "ccache"
+# Compiler names that are redirected to ccache
+CCACHE_COMPILERS = ("cc", "c++", "gcc", "g++")
+# Installations are built here and renamed to their key once they're complete
+PARTIAL_SUFFIX = ".partial"
+PREBUILT_KEY_PREFIX = "prebuilt-"
+COMMIT_KEY_PREFIX = "commit-"
+
+DVMDOSTEM_REPOSITORY = "https://github.com/uaf-arctic-eco-modeling/dvm-dos-tem.git"
+
+
+def get_prebuilt_key(blobs: Iterable[Tuple[str, int, str]]) -> str:
+    """Returns the cache key of a pre-built installation.
+
+    Args:
+        blobs: The name, size and CRC32C of every file of the installation
+
+    Returns:
+        str: `prebuilt-` followed by a hash of the files, so the same files
+            always map to the same key
+    """
+    digest = hashlib.sha256()
+    for name, size, crc32c in sorted(blobs):
+        digest.update(f"{name}\0{size}\0{crc32c}\n".encode())
+
+    return PREBUILT_KEY_PREFIX + digest.hexdigest()[:16]
+
+
+def resolve_commit(version: str, repository: str = DVMDOSTEM_REPOSITORY) -> str:
+    """Returns the commit of a branch, tag or commit of the repository.
+
+    Full commit hashes are returned as they are, without asking the remote.
+
+    Raises:
+        ValueError: If the version doesn't exist in the repository.
+    """
+    if re.fullmatch(r"[0-9a-f]{40}", version):
+        return version
+
+    output = subprocess.check_output(
+        ["git", "ls-remote", repository, version, f"{version}^{{}}"], text=True
+    )
+    commits = {}
+    for line in output.splitlines():
+        commit, ref = line.split("\t")
+        commits[ref] = commit
+
+    if not commits:
+        raise ValueError(f"{version} doesn't exist in {repository}")
+
+    # the commit of an annotated tag is on its peeled ref, ending with ^{}
+    peeled = [commit for ref, commit in commits.items() if ref.endswith("^{}")]
+    return peeled[0] if peeled else next(iter(commits.values()))
+
+
+def get_commit_key(commit: str) -> str:
+    return COMMIT_KEY_PREFIX + commit[:12]
+
+
+def get_cached_installs(cache_dir: Path) -> List[str]:
+    """Returns the keys of the complete installations in the cache."""
+    if not cache_dir.is_dir():
+        return []
+
+    return sorted(
+        entry.name
+        for entry in os.scandir(cache_dir)
+        if entry.is_dir()
+        and entry.name.startswith((PREBUILT_KEY_PREFIX, COMMIT_KEY_PREFIX))
+        and not entry.name.endswith(PARTIAL_SUFFIX)
+    )
+
+
+def get_partial_path(install_dir: Path) -> Path:
+    return install_dir.with_name(install_dir.name + PARTIAL_SUFFIX)
+
+
+def complete_install(install_dir: Path) -> None:
+    """Moves a finished installation from its partial folder into the cache."""
+    os.replace(get_partial_path(install_dir), install_dir)
+
+
+def get_active_install(link_path: Path) -> Optional[str]:
+    """Returns the key of the active installation, None if there is none."""
+    if not link_path.is_symlink():
+        return None
+
+    return Path(os.readlink(link_path)).name
+
+
+def activate_install(install_dir: Path, link_path: Path) -> None:
+    """Points the dvm-dos-tem symlink to the given installation.
+
+    The new symlink is created next to the old one and renamed over it, so
+    the path always points to a complete installation.
+
+    Raises:
+        IsADirectoryError: If `link_path` is a folder rather than a symlink,
+            i.e. an installation that isn't in the cache.
+    """
+    if link_path.exists() and not link_path.is_symlink():
+        raise IsADirectoryError(
+            f"{link_path} is a folder, not a cached installation. "
+            "Move it away to use the cache."
+        )
+
+    temp_link = link_path.with_name(f".{link_path.name}.{os.getpid()}.tmp")
+    if temp_link.is_symlink():
+        temp_link.unlink()
+    temp_link.symlink_to(install_dir, target_is_directory=True)
+    os.replace(temp_link, link_path)
+
+
+def setup_ccache(cache_dir: Path) -> Optional[Path]:
+    """Prepares a folder that redirects the compilers to ccache.
+
+    The folder has symlinks named after the compilers pointing to ccache.
+    Putting it at the front of PATH makes the builds, including the MPI
+    compiler wrappers, compile through ccache.
+
+    Returns:
+        The folder of the symlinks, None if ccache isn't installed
+    """
+    ccache = shutil.which("ccache")
+    if ccache is None:
+        return None
+
+    bin_dir = cache_dir / CCACHE_FOLDER / "bin"
+    bin_dir.mkdir(parents=True, exist_ok=True)
+    for compiler in CCACHE_COMPILERS:
+        link = bin_dir / compiler
+        if not link.is_symlink():
+            link.symlink_to(ccache)
+
+    return bin_dir
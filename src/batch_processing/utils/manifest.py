@@ -0,0 +1,116 @@
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from batch_processing.utils.utils import (
+    get_batch_folders,
+    read_json_file,
+    write_json_file,
+)
+
+# Written next to the batches by `bp batch split`. Keeps the layout of the
+# run, so the other commands don't have to scan the batch folder to find
+# the batches, and the job and status of every batch.
+MANIFEST_FILE_NAME = "manifest.json"
+MANIFEST_VERSION = 1
+
+SPLIT_STATUS = "split"
+SUBMITTED_STATUS = "submitted"
+REBALANCED_STATUS = "rebalanced"
+DONE_STATUS = "done"
+FAILED_STATUS = "failed"
+
+
+def create_batch_entry(
+    index: int, y_range: tuple, x_range: tuple, active_cells: int
+) -> dict:
+    """Returns the manifest entry of a batch, the ranges are [start, end)."""
+    return {
+        "index": index,
+        "name": f"batch_{index}",
+        "y_start": y_range[0],
+        "y_end": y_range[1],
+        "x_start": x_range[0],
+        "x_end": x_range[1],
+        "active_cells": active_cells,
+        "job_id": None,
+        "status": SPLIT_STATUS,
+    }
+
+
+def write_manifest(
+    base_batch_dir: Path, dimensions: Dict[str, int], batches: List[dict]
+) -> None:
+    write_json_file(
+        base_batch_dir / MANIFEST_FILE_NAME,
+        {
+            "version": MANIFEST_VERSION,
+            "created_at": datetime.now().isoformat(),
+            "dimensions": dimensions,
+            "batches": sorted(batches, key=lambda batch: batch["index"]),
+        },
+        indent=None,
+    )
+
+
+def read_manifest(base_batch_dir: Path) -> Optional[dict]:
+    """Returns the manifest of the given batch folder, None if it has none."""
+    path = base_batch_dir / MANIFEST_FILE_NAME
+    return read_json_file(path) if path.exists() else None
+
+
+def get_batch_dirs(base_batch_dir: Path) -> List[Path]:
+    """
+    Returns the batch folders sorted by batch number.
+
+    They are taken from the manifest, so the batch folder isn't listed.
+    Batches split before the manifest existed are found by scanning the
+    folder instead.
+    """
+    manifest = read_manifest(base_batch_dir)
+    if manifest is None:
+        return get_batch_folders(base_batch_dir)
+
+    return [base_batch_dir / batch["name"] for batch in manifest["batches"]]
+
+
+def update_batch_jobs(
+    base_batch_dir: Path, job_ids: Dict[str, str], status: str = SUBMITTED_STATUS
+) -> None:
+    """
+    Records the jobs of the given batches and sets their status.
+
+    Args:
+        base_batch_dir: Folder of the batches
+        job_ids: Dictionary mapping batch names to their job IDs
+        status: New status of the batches
+    """
+    manifest = read_manifest(base_batch_dir)
+    if manifest is None or not job_ids:
+        return
+
+    for batch in manifest["batches"]:
+        if batch["name"] in job_ids:
+            batch["job_id"] = job_ids[batch["name"]]
+            batch["status"] = status
+
+    write_json_file(base_batch_dir / MANIFEST_FILE_NAME, manifest, indent=None)
+
+
+def update_batch_statuses(base_batch_dir: Path, statuses: Dict[str, str]) -> None:
+    """
+    Sets the status of the given batches, keeping their jobs.
+
+    Args:
+        base_batch_dir: Folder of the batches
+        statuses: Dictionary mapping batch names to their new status
+    """
+    manifest = read_manifest(base_batch_dir)
+    if manifest is None or not statuses:
+        return
+
+    for batch in manifest["batches"]:
+        if batch["name"] in statuses:
+            batch["status"] = statuses[batch["name"]]
+
+    write_json_file(base_batch_dir / MANIFEST_FILE_NAME, manifest, indent=None)
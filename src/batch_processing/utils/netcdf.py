@@ -0,0 +1,104 @@
+"""NetCDF helpers. Importing this module loads numpy, netCDF4 and xarray."""
+
+from pathlib import Path
+from typing import Tuple, Union
+
+import numpy as np
+import xarray as xr
+from netCDF4 import Dataset
+
+
+def get_dimensions(file_name: str) -> Tuple[int, int]:
+    """Retrieve the dimensions sizes from the given NetCDF file using netCDF4."""
+    with Dataset(file_name, "r") as dataset:
+        x = dataset.dimensions["X"].size
+        y = dataset.dimensions["Y"].size
+    return x, y
+
+
+def get_itemsize(variable) -> int:
+    """Returns the item size of a netCDF variable, 8 bytes for variable-length types."""
+    try:
+        return np.dtype(variable.dtype).itemsize or 8
+    except TypeError:
+        return 8
+
+
+def copy_variable_data(src_variable, dest_variable) -> None:
+    """Copies all values of a netCDF variable, including scalar ones."""
+    if src_variable.dimensions:
+        dest_variable[:] = src_variable[:]
+    else:
+        dest_variable.assignValue(src_variable.getValue())
+
+
+def create_netcdf_like(
+    src: Dataset, dest_path: Union[Path, str], dim_sizes: dict
+) -> Dataset:
+    """Creates an empty NetCDF file with the same structure as the given dataset.
+
+    Dimensions, global attributes, variable definitions, variable attributes
+    and compression settings are copied. No data is copied.
+
+    Args:
+        src (Dataset): The dataset whose structure is copied.
+        dest_path (Path or str): Path of the new file.
+        dim_sizes (dict): Dimension sizes that override the ones of `src`,
+            e.g. {"X": 1, "Y": 1}.
+
+    Returns:
+        Dataset: The new dataset opened for writing with automatic masking and
+            scaling turned off, so that raw values can be copied into it.
+    """
+    dest = Dataset(dest_path, "w", format=src.data_model)
+    dest.setncatts(src.__dict__)
+
+    for name, dimension in src.dimensions.items():
+        size = None if dimension.isunlimited() else dimension.size
+        dest.createDimension(name, dim_sizes.get(name, size))
+
+    for name, variable in src.variables.items():
+        attrs = variable.__dict__.copy()
+        fill_value = attrs.pop("_FillValue", None)
+        filters = variable.filters() or {}
+        dest_variable = dest.createVariable(
+            name,
+            variable.datatype,
+            variable.dimensions,
+            fill_value=fill_value,
+            zlib=filters.get("zlib", False),
+            complevel=filters.get("complevel", 4),
+            shuffle=filters.get("shuffle", True),
+        )
+        dest_variable.setncatts(attrs)
+
+    dest.set_auto_maskandscale(False)
+    return dest
+
+
+def read_runtimes(run_status_path: Union[Path, str]) -> np.ndarray:
+    """Returns the valid `total_runtime` values of a run_status.nc file in seconds.
+
+    Fill values, NaT/NaN and non-positive runtimes are dropped. The values
+    may be stored either as timedelta64 or as plain numbers of seconds.
+
+    Args:
+        run_status_path (Union[Path, str]): Path to the run_status.nc file.
+
+    Returns:
+        np.ndarray: One runtime per cell that has finished.
+    """
+    with xr.open_dataset(str(run_status_path), engine="h5netcdf") as ds:
+        total_runtime_values = ds.total_runtime.values.flatten()
+
+    if np.issubdtype(total_runtime_values.dtype, np.timedelta64):
+        valid_runtimes = total_runtime_values[~np.isnat(total_runtime_values)]
+        runtimes_in_seconds = valid_runtimes / np.timedelta64(1, "s")
+        return runtimes_in_seconds[runtimes_in_seconds > 0]
+
+    valid_mask = (
+        (~np.isnan(total_runtime_values))
+        & (total_runtime_values > 0)
+        & (total_runtime_values != -9999)
+    )
+    return total_runtime_values[valid_mask].astype(float)
@@ -0,0 +1,153 @@
+import math
+import re
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from batch_processing.utils.preemption_store import (
+    DEFAULT_STORE_PATH,
+    PreemptionStore,
+    parse_batch_job_name,
+)
+from batch_processing.utils.utils import (
+    read_json_file,
+    read_runtimes,
+    read_text_file,
+    write_json_file,
+)
+
+# Written next to the batches by `bp batch run --placement`. Keeps the
+# partition every batch was submitted to, which the next placement needs
+# to know how long the campaign was exposed to preemptions.
+PLACEMENT_FILE_NAME = "placement.json"
+
+SPOT_PARTITIONS = ("spot", "dask")
+COMPUTE_PARTITION = "compute"
+DEFAULT_MAX_PREEMPTION_RISK = 0.5
+
+
+@dataclass
+class BatchPlacement:
+    batch_dir: Path
+    job_name: str
+    default_partition: str
+    # Sum of the cell runtimes of the batch's previous run, in hours
+    work_hours: Optional[float] = None
+    # Probability of the batch being preempted at least once on spot
+    risk: Optional[float] = None
+    partition: Optional[str] = None
+
+
+def read_sbatch_option(slurm_runner_path: Path, pattern: str) -> Optional[str]:
+    """Returns the value of an #SBATCH option of the given job script."""
+    match = re.search(pattern, read_text_file(slurm_runner_path), re.MULTILINE)
+    return match.group(1) if match else None
+
+
+def get_batch_work_hours(batch_dir: Path) -> Optional[float]:
+    """
+    Returns the sum of the cell runtimes of the batch's previous run in
+    hours, or None if the batch hasn't finished a run yet.
+    """
+    run_status_path = batch_dir / "output" / "run_status.nc"
+    if not run_status_path.exists():
+        return None
+
+    try:
+        runtimes = read_runtimes(run_status_path)
+    except Exception as e:
+        print(f"Could not read the runtimes in {run_status_path}: {e}")
+        return None
+
+    return float(runtimes.sum()) / 3600 if len(runtimes) > 0 else None
+
+
+def plan_placement(
+    slurm_runner_paths: List[Path],
+    max_risk: float = DEFAULT_MAX_PREEMPTION_RISK,
+    store_path: Path = DEFAULT_STORE_PATH,
+) -> List[BatchPlacement]:
+    """
+    Decides, per batch, whether it should be submitted to spot or compute.
+
+    Preemptions are modelled as a Poisson process: a batch that runs for
+    `work_hours` on spot is preempted at least once with probability
+    1 - exp(-rate * work_hours). The rate is estimated from the campaign's
+    preemptions recorded by `bp monitor` since the previous submission,
+    divided by the work that ran on spot in that submission. Work is
+    measured as the sum of the cell runtimes in `run_status.nc`, so it
+    doesn't depend on the number of cores of a node.
+
+    Batches whose risk is above `max_risk` go to the compute partition. The
+    others, and every batch when there is no history, keep the partition
+    of their job script.
+    """
+    placements = []
+    for path in slurm_runner_paths:
+        job_name = read_sbatch_option(path, r'^#SBATCH --job-name="?([^"\n]+)"?')
+        partition = read_sbatch_option(path, r"^#SBATCH -p (\S+)")
+        work_hours = get_batch_work_hours(path.parent)
+        placements.append(
+            BatchPlacement(
+                path.parent, job_name or "", partition, work_hours, partition=partition
+            )
+        )
+
+    known_work = [p.work_hours for p in placements if p.work_hours is not None]
+    if not known_work:
+        print("No runtime history is found. Keeping the partitions of the batches.")
+        return placements
+
+    # batches without history are assumed to do as much work as the others
+    average_work = sum(known_work) / len(known_work)
+    for placement in placements:
+        if placement.work_hours is None:
+            placement.work_hours = average_work
+
+    base_batch_dir = placements[0].batch_dir.parent
+    previous = {}
+    since = None
+    if (base_batch_dir / PLACEMENT_FILE_NAME).exists():
+        previous = read_json_file(base_batch_dir / PLACEMENT_FILE_NAME)
+        since = datetime.fromisoformat(previous["submitted_at"])
+    previous_partitions = previous.get("partitions", {})
+
+    spot_work = sum(
+        p.work_hours
+        for p in placements
+        if previous_partitions.get(p.batch_dir.name, p.default_partition)
+        in SPOT_PARTITIONS
+    )
+
+    campaign, _ = parse_batch_job_name(placements[0].job_name)
+    preemptions = 0
+    if campaign and store_path.exists():
+        with PreemptionStore(store_path) as store:
+            preemptions = store.count_for_campaign(campaign, since)
+
+    rate = preemptions / spot_work if spot_work > 0 else 0
+    print(
+        f"{preemptions} preemptions over {spot_work:.1f} cell-hours on spot, "
+        f"{rate:.4f} preemptions per cell-hour"
+    )
+
+    for placement in placements:
+        if placement.default_partition not in SPOT_PARTITIONS:
+            continue
+
+        placement.risk = 1 - math.exp(-rate * placement.work_hours)
+        if placement.risk > max_risk:
+            placement.partition = COMPUTE_PARTITION
+
+    return placements
+
+
+def write_placement(base_batch_dir: Path, placements: List[BatchPlacement]) -> None:
+    partitions: Dict[str, str] = {
+        placement.batch_dir.name: placement.partition for placement in placements
+    }
+    write_json_file(
+        base_batch_dir / PLACEMENT_FILE_NAME,
+        {"submitted_at": datetime.now().isoformat(), "partitions": partitions},
+    )
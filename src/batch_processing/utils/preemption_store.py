@@ -0,0 +1,164 @@
+import re
+import sqlite3
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+DEFAULT_STORE_PATH = Path.home() / ".slurm-monitor.db"
+
+# Job names are given by `bp batch split` as <prefix>-<input>-batch-<index>,
+# sub-batches created by `bp batch rebalance` get a -sub-<index> suffix
+BATCH_JOB_NAME_PATTERN = re.compile(
+    r"^(?P<campaign>.+)-batch-(?P<index>\d+)(-sub-\d+)?$"
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS preemptions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_id TEXT NOT NULL,
+    job_name TEXT NOT NULL,
+    campaign TEXT,
+    batch INTEGER,
+    partition TEXT NOT NULL,
+    reason TEXT NOT NULL,
+    preempted_at REAL NOT NULL,
+    rolled_back INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS preemptions_campaign ON preemptions (campaign);
+"""
+
+
+@dataclass
+class PreemptionEvent:
+    job_id: str
+    job_name: str
+    partition: str
+    reason: str
+    preempted_at: datetime
+    rolled_back: bool
+
+
+def parse_batch_job_name(job_name: str) -> Tuple[Optional[str], Optional[int]]:
+    """
+    Splits a batch job name into its campaign and batch index.
+
+    Args:
+        job_name: Job name, e.g. "my-run-input-batch-12"
+
+    Returns:
+        (campaign, batch index), e.g. ("my-run-input", 12), or (None, None)
+        if the job isn't a batch job
+    """
+    match = BATCH_JOB_NAME_PATTERN.match(job_name)
+    if match is None:
+        return None, None
+
+    return match.group("campaign"), int(match.group("index"))
+
+
+class PreemptionStore:
+    """
+    Append-only store of preemption events backed by a SQLite database.
+
+    Events are only ever inserted, so the history survives restarts of the
+    monitor and can be queried at any time with `bp monitor stats`.
+    """
+
+    def __init__(self, path: Union[str, Path] = DEFAULT_STORE_PATH):
+        self.path = Path(path)
+        self._connection = sqlite3.connect(self.path, timeout=30)
+        self._connection.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self) -> None:
+        self._connection.close()
+
+    def record(self, events: Iterable[PreemptionEvent]) -> None:
+        """Appends the given events in a single transaction."""
+        rows = []
+        for event in events:
+            campaign, batch = parse_batch_job_name(event.job_name)
+            rows.append(
+                (
+                    event.job_id,
+                    event.job_name,
+                    campaign,
+                    batch,
+                    event.partition,
+                    event.reason,
+                    event.preempted_at.timestamp(),
+                    int(event.rolled_back),
+                )
+            )
+
+        with self._connection:
+            self._connection.executemany(
+                "INSERT INTO preemptions (job_id, job_name, campaign, batch, "
+                "partition, reason, preempted_at, rolled_back) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+
+    def count_by_job(self) -> Dict[str, int]:
+        """Returns the number of rolled back preemptions of every job."""
+        rows = self._connection.execute(
+            "SELECT job_id, COUNT(*) FROM preemptions WHERE rolled_back = 1 "
+            "GROUP BY job_id"
+        )
+        return dict(rows)
+
+    def count_by_batch(self, campaign: Optional[str] = None) -> List[Tuple]:
+        """Returns (job name, preemptions, last preemption) rows."""
+        return self._query(
+            "job_name, COUNT(*), datetime(MAX(preempted_at), 'unixepoch', 'localtime')",
+            "job_name",
+            campaign,
+            order="COUNT(*) DESC, job_name",
+        )
+
+    def count_by_partition(self, campaign: Optional[str] = None) -> List[Tuple]:
+        """Returns (partition, preemptions, rolled back) rows."""
+        return self._query(
+            "partition, COUNT(*), SUM(rolled_back)",
+            "partition",
+            campaign,
+            order="COUNT(*) DESC",
+        )
+
+    def count_by_hour(self, campaign: Optional[str] = None) -> List[Tuple]:
+        """Returns (hour, preemptions) rows in chronological order."""
+        hour = "strftime('%Y-%m-%d %H:00', preempted_at, 'unixepoch', 'localtime')"
+        return self._query(f"{hour}, COUNT(*)", hour, campaign, order=hour)
+
+    def count_for_campaign(
+        self, campaign: str, since: Optional[datetime] = None
+    ) -> int:
+        """
+        Returns the number of preemptions of the given campaign's jobs,
+        optionally only the ones that happened after `since`.
+        """
+        since_timestamp = since.timestamp() if since else 0
+        row = self._connection.execute(
+            "SELECT COUNT(*) FROM preemptions WHERE campaign = ? AND preempted_at >= ?",
+            (campaign, since_timestamp),
+        ).fetchone()
+        return row[0]
+
+    def _query(
+        self, columns: str, group_by: str, campaign: Optional[str], order: str
+    ) -> List[Tuple]:
+        where, params = "", ()
+        if campaign is not None:
+            where, params = "WHERE campaign = ?", (campaign,)
+
+        return self._connection.execute(
+            f"SELECT {columns} FROM preemptions {where} "
+            f"GROUP BY {group_by} ORDER BY {order}",
+            params,
+        ).fetchall()
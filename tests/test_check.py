@@ -0,0 +1,72 @@
+import json
+
+from batch_processing.cmd.batch.check import (
+    get_expected_output_files,
+    get_run_stages,
+    scan_output_files,
+)
+
+OUTPUT_SPEC = """Name,Description,Units,Yearly,Monthly,Daily,PFT,Compartments,Layers
+ALD,active layer depth,m,y,,invalid,,,
+GPP,gross primary productivity,g/m2/time,y,m,,,,
+LAI,leaf area index,m2/m2,,,,,,
+"""
+
+
+def make_batch_dir(tmp_path, io_config=None, flags="-p 100 -e 1000 -s 85 -t 115 -n 0"):
+    batch_dir = tmp_path / "batch_0"
+    (batch_dir / "config").mkdir(parents=True)
+    spec_path = batch_dir / "config" / "output_spec.csv"
+    spec_path.write_text(OUTPUT_SPEC)
+    config = {"output_spec_file": str(spec_path), "output_nc_eq": 0}
+    config.update(io_config or {})
+    (batch_dir / "config" / "config.js").write_text(json.dumps({"IO": config}))
+    (batch_dir / "slurm_runner.sh").write_text(
+        f"mpirun dvmdostem {flags} --log-level disabled\n"
+    )
+    return batch_dir
+
+
+def test_get_run_stages_skips_stages_without_years(tmp_path):
+    batch_dir = make_batch_dir(tmp_path)
+
+    assert get_run_stages(batch_dir) == ["eq", "sp", "tr"]
+
+
+def test_get_expected_output_files_uses_the_finest_resolution(tmp_path):
+    batch_dir = make_batch_dir(tmp_path)
+
+    assert get_expected_output_files(batch_dir) == {
+        "ALD_yearly_sp.nc",
+        "ALD_yearly_tr.nc",
+        "GPP_monthly_sp.nc",
+        "GPP_monthly_tr.nc",
+    }
+
+
+def test_get_expected_output_files_follows_the_stage_switches(tmp_path):
+    batch_dir = make_batch_dir(tmp_path, {"output_nc_eq": 1, "output_nc_tr": 0})
+
+    assert get_expected_output_files(batch_dir) == {
+        "ALD_yearly_eq.nc",
+        "ALD_yearly_sp.nc",
+        "GPP_monthly_eq.nc",
+        "GPP_monthly_sp.nc",
+    }
+
+
+def test_get_expected_output_files_of_unconfigured_batches(tmp_path):
+    batch_dir = make_batch_dir(tmp_path)
+    (batch_dir / "slurm_runner.sh").unlink()
+
+    assert get_expected_output_files(batch_dir) == set()
+    assert get_expected_output_files(tmp_path / "batch_1") == set()
+
+
+def test_scan_output_files(tmp_path):
+    (tmp_path / "output").mkdir()
+    (tmp_path / "output" / "GPP_monthly_tr.nc").touch()
+    (tmp_path / "output" / "restart").mkdir()
+
+    assert scan_output_files(tmp_path) == {"GPP_monthly_tr.nc"}
+    assert scan_output_files(tmp_path / "missing") == set()
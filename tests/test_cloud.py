@@ -0,0 +1,44 @@
+from batch_processing.utils.cloud import (
+    BYTES_PER_WORKER,
+    MAX_WORKER_MEMORY_GB,
+    MAX_WORKERS,
+    MIN_WORKER_MEMORY_GB,
+    ClusterPlan,
+    plan_cluster,
+)
+
+MB = 1024**2
+
+
+def test_plan_cluster_gives_every_worker_its_share_of_the_data():
+    plan = plan_cluster(10 * BYTES_PER_WORKER, task_count=1000, chunk_bytes=128 * MB)
+
+    assert plan == ClusterPlan(5, 10, MIN_WORKER_MEMORY_GB)
+
+
+def test_plan_cluster_has_no_more_workers_than_tasks():
+    plan = plan_cluster(50 * BYTES_PER_WORKER, task_count=3, chunk_bytes=128 * MB)
+
+    assert (plan.min_workers, plan.max_workers) == (1, 3)
+
+
+def test_plan_cluster_caps_the_workers():
+    plan = plan_cluster(1000 * BYTES_PER_WORKER, task_count=10_000, chunk_bytes=MB)
+
+    assert plan.max_workers == MAX_WORKERS
+    assert plan.min_workers == MAX_WORKERS // 2
+
+
+def test_plan_cluster_with_little_data_starts_a_single_worker():
+    plan = plan_cluster(MB, task_count=0, chunk_bytes=MB)
+
+    assert (plan.min_workers, plan.max_workers) == (1, 1)
+
+
+def test_plan_cluster_sizes_the_worker_memory_from_the_chunks():
+    # 4 cores holding 4 chunks of 1 GB each
+    assert plan_cluster(BYTES_PER_WORKER, 1, 1024 * MB).worker_memory_gb == 16
+    assert (
+        plan_cluster(BYTES_PER_WORKER, 1, 4096 * MB).worker_memory_gb
+        == MAX_WORKER_MEMORY_GB
+    )
@@ -0,0 +1,95 @@
+import pytest
+
+from batch_processing.utils import common
+from batch_processing.utils.common import (
+    Chunk,
+    _group_dir_ranges,
+    create_balanced_chunks,
+    delete_in_background,
+    make_dirs,
+)
+
+
+def batch_dir_paths(count):
+    return [
+        name
+        for index in range(count)
+        for name in (f"batch_{index}", f"batch_{index}/input")
+    ]
+
+
+def test_group_dir_ranges_keeps_children_with_their_parents():
+    # 5 batches on 4 workers used to give ranges of 3 paths, which split a
+    # batch from its input folder
+    ranges = _group_dir_ranges(batch_dir_paths(5), workers=4)
+
+    assert [path for paths in ranges for path in paths] == batch_dir_paths(5)
+    for paths in ranges:
+        for path in paths:
+            if "/" in path:
+                parent = path.split("/", 1)[0]
+                assert parent in paths
+                assert paths.index(parent) < paths.index(path)
+
+
+def test_group_dir_ranges_uses_at_most_the_given_workers():
+    assert len(_group_dir_ranges(batch_dir_paths(100), workers=48)) <= 48
+    assert _group_dir_ranges([], workers=4) == []
+
+
+def test_make_dirs_with_odd_range_size(tmp_path):
+    make_dirs(tmp_path, batch_dir_paths(5), workers=4)
+
+    assert sorted(path.name for path in tmp_path.iterdir()) == [
+        f"batch_{index}" for index in range(5)
+    ]
+    assert all((tmp_path / f"batch_{index}" / "input").is_dir() for index in range(5))
+
+
+def test_create_balanced_chunks_balances_the_weights():
+    # the active cells are all in the last rows
+    chunks = create_balanced_chunks([0, 0, 0, 0, 5, 5, 5, 5], 4)
+
+    assert chunks == [Chunk(0, 0, 5), Chunk(1, 5, 6), Chunk(2, 6, 7), Chunk(3, 7, 8)]
+
+
+def test_create_balanced_chunks_never_returns_empty_chunks():
+    chunks = create_balanced_chunks([10, 0, 0, 0], 3)
+
+    assert [chunk.end - chunk.start for chunk in chunks] == [1, 1, 2]
+    assert chunks[0].start == 0 and chunks[-1].end == 4
+
+
+def test_create_balanced_chunks_caps_the_chunk_count():
+    assert len(create_balanced_chunks([1, 1], 5)) == 2
+    assert create_balanced_chunks([], 3) == []
+
+
+def test_create_balanced_chunks_without_weights_splits_evenly():
+    chunks = create_balanced_chunks([0] * 6, 3)
+
+    assert chunks == [Chunk(0, 0, 2), Chunk(1, 2, 4), Chunk(2, 4, 6)]
+
+
+def test_create_balanced_chunks_rejects_non_positive_counts():
+    with pytest.raises(ValueError):
+        create_balanced_chunks([1, 2], 0)
+
+
+def test_delete_in_background_quotes_the_path_of_slurm_jobs(monkeypatch, tmp_path):
+    commands = []
+    monkeypatch.setattr(
+        common.subprocess, "run", lambda command, **kwargs: commands.append(command)
+    )
+
+    delete_in_background(tmp_path / "old batches; rm x", "slurm", "spot")
+
+    assert commands == [
+        [
+            "sbatch",
+            "--job-name=bp-cleanup",
+            "--output=/dev/null",
+            "--partition=spot",
+            f"--wrap=rm -rf '{tmp_path}/old batches; rm x'",
+        ]
+    ]
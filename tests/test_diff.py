@@ -0,0 +1,139 @@
+import numpy as np
+import pytest
+from netCDF4 import Dataset
+
+from batch_processing.cmd.diff import (
+    MANIFEST_FILE_NAME,
+    FilePairTask,
+    compare_arrays,
+    compare_file_pair,
+    compare_file_pair_with_manifest,
+    load_manifest,
+    save_manifest,
+)
+
+
+def test_save_manifest_replaces_the_manifest_without_leftovers(tmp_path):
+    save_manifest(tmp_path, {"a.nc": {"size": 1}})
+    save_manifest(tmp_path, {"b.nc": {"size": 2}})
+
+    assert load_manifest(tmp_path) == {"b.nc": {"size": 2}}
+    assert [path.name for path in tmp_path.iterdir()] == [MANIFEST_FILE_NAME]
+
+
+def write_dataset(
+    path, values, title="run", units="g", time_size=None, datatype="f4", fill=np.nan
+):
+    with Dataset(path, "w") as dataset:
+        dataset.title = title
+        dataset.createDimension("time", time_size)
+        dataset.createDimension("x", len(values))
+        variable = dataset.createVariable("GPP", datatype, ("x",), fill_value=fill)
+        variable.units = units
+        variable[:] = values
+
+
+def compare(tmp_path, manifest=False, atol=0.0, rtol=0.0):
+    task = FilePairTask(
+        "GPP.nc", tmp_path / "one.nc", tmp_path / "two.nc", atol=atol, rtol=rtol
+    )
+    if manifest:
+        return compare_file_pair_with_manifest(task)[0]
+    return compare_file_pair(task)
+
+
+@pytest.mark.parametrize("manifest", [False, True])
+def test_compare_file_pair_identical_values_and_metadata(tmp_path, manifest):
+    write_dataset(tmp_path / "one.nc", [1.0, np.nan])
+    write_dataset(tmp_path / "two.nc", [1.0, np.nan])
+
+    assert compare(tmp_path, manifest).is_identical
+
+
+@pytest.mark.parametrize("manifest", [False, True])
+def test_compare_file_pair_reports_global_attributes(tmp_path, manifest):
+    write_dataset(tmp_path / "one.nc", [1.0, 2.0], title="first")
+    write_dataset(tmp_path / "two.nc", [1.0, 2.0], title="second")
+
+    result = compare(tmp_path, manifest)
+    assert not result.is_identical
+    assert result.message == "global attributes differ: title"
+
+
+@pytest.mark.parametrize("manifest", [False, True])
+def test_compare_file_pair_reports_variable_attributes(tmp_path, manifest):
+    write_dataset(tmp_path / "one.nc", [1.0, 2.0], units="g")
+    write_dataset(tmp_path / "two.nc", [1.0, 2.0], units="kg")
+
+    result = compare(tmp_path, manifest)
+    assert [(v.name, v.message) for v in result.variables] == [
+        ("GPP", "attributes differ: units")
+    ]
+
+
+@pytest.mark.parametrize("manifest", [False, True])
+def test_compare_file_pair_reports_dimension_sizes(tmp_path, manifest):
+    write_dataset(tmp_path / "one.nc", [1.0, 2.0], time_size=3)
+    write_dataset(tmp_path / "two.nc", [1.0, 2.0], time_size=4)
+
+    result = compare(tmp_path, manifest)
+    assert result.message == "dimensions differ: time (3 vs 4)"
+
+
+@pytest.mark.parametrize("manifest", [False, True])
+def test_compare_file_pair_reports_data_types(tmp_path, manifest):
+    # same item size, so the types have to be compared, not their sizes
+    write_dataset(tmp_path / "one.nc", [1, 2], datatype="f4", fill=None)
+    write_dataset(tmp_path / "two.nc", [1, 2], datatype="i4", fill=None)
+
+    result = compare(tmp_path, manifest)
+    assert [(v.name, v.message) for v in result.variables] == [
+        ("GPP", "data type mismatch")
+    ]
+
+
+@pytest.mark.parametrize("manifest", [False, True])
+def test_compare_file_pair_reports_value_mismatches(tmp_path, manifest):
+    write_dataset(tmp_path / "one.nc", [1.0, 2.0, 3.0, 4.0])
+    write_dataset(tmp_path / "two.nc", [1.0, 2.5, 3.0, 3.0])
+
+    result = compare(tmp_path, manifest)
+    assert not result.message
+    [variable] = result.variables
+    assert (variable.name, variable.mismatch_count) == ("GPP", 2)
+    assert variable.max_abs_diff == 1.0
+
+
+@pytest.mark.parametrize("manifest", [False, True])
+def test_compare_file_pair_uses_the_tolerances(tmp_path, manifest):
+    write_dataset(tmp_path / "one.nc", [1.0, 100.0])
+    write_dataset(tmp_path / "two.nc", [1.05, 101.0])
+
+    assert compare(tmp_path, manifest, atol=0.1).variables[0].mismatch_count == 1
+    assert compare(tmp_path, manifest, rtol=0.02).variables[0].mismatch_count == 1
+    assert compare(tmp_path, manifest, atol=0.1, rtol=0.02).is_identical
+
+
+def test_compare_arrays_leaves_nan_mismatches_out_of_the_max_difference():
+    assert compare_arrays(
+        np.array([1.0, np.nan, 5.0]), np.array([1.0, 2.0, 3.0]), 0.0, 0.0
+    ) == (2, 2.0)
+    mismatch_count, max_abs_diff = compare_arrays(
+        np.array([np.nan]), np.array([2.0]), 0.0, 0.0
+    )
+    assert mismatch_count == 1 and np.isnan(max_abs_diff)
+    nan = np.array([np.nan])
+    assert compare_arrays(nan, nan, 0.0, 0.0) == (0, 0.0)
+
+
+def test_compare_file_pair_with_cached_manifest_entries(tmp_path):
+    write_dataset(tmp_path / "one.nc", [1.0, 2.0], title="first")
+    write_dataset(tmp_path / "two.nc", [1.0, 2.0], title="second")
+    task = FilePairTask(
+        "GPP.nc", tmp_path / "one.nc", tmp_path / "two.nc", atol=0.0, rtol=0.0
+    )
+    _, entry_one, entry_two = compare_file_pair_with_manifest(task)
+
+    task.manifest_one, task.manifest_two = entry_one, entry_two
+    result, _, _ = compare_file_pair_with_manifest(task)
+    assert result.message == "global attributes differ: title"
@@ -0,0 +1,41 @@
+import json
+
+from batch_processing.cmd import elapsed
+from batch_processing.cmd.elapsed import ElapsedCommand, JobTimes
+
+
+def write_jobs(path, jobs):
+    (path / "jobs.json").write_text(json.dumps({"jobs": jobs}))
+
+
+def test_read_jobs_follows_replaced_jobs(tmp_path):
+    args = type("Args", (), {"base_batch_dir": tmp_path})()
+    command = ElapsedCommand(args)
+    write_jobs(tmp_path, {"batch_0": "1", "batch_1": "2"})
+    jobs = command._read_jobs()
+    jobs["1"].state = "RUNNING"
+
+    # `bp batch rebalance` replaced batch_1 with two sub-batches
+    write_jobs(tmp_path, {"batch_0": "1", "batch_1/sub_0": "3", "batch_1/sub_1": "4"})
+    jobs = command._read_jobs(jobs)
+
+    assert sorted(jobs) == ["1", "3", "4"]
+    assert jobs["1"].state == "RUNNING"
+    assert jobs["3"].batch == "batch_1/sub_0"
+
+
+def test_query_sacct_gives_up_on_jobs_missing_from_sacct(monkeypatch):
+    record = {"JobID": "1", "State": "RUNNING", "Partition": "spot"}
+    record.update({"Submit": "", "Start": "", "End": ""})
+    records = [record]
+    monkeypatch.setattr(elapsed, "run_sacct", lambda job_ids, fields: records)
+    jobs = {job_id: JobTimes(job_id=job_id, batch="batch_0") for job_id in ("1", "2")}
+
+    for _ in range(elapsed.MAX_MISSING_POLLS - 1):
+        elapsed.query_sacct(jobs)
+    assert not jobs["2"].is_finished
+
+    elapsed.query_sacct(jobs)
+    assert jobs["2"].state == elapsed.MISSING_STATE
+    assert jobs["2"].is_finished
+    assert jobs["1"].state == "RUNNING" and jobs["1"].missing_polls == 0
@@ -0,0 +1,64 @@
+import numpy as np
+from netCDF4 import Dataset
+
+from batch_processing.cmd.extract_cell import extract_cells, read_coordinates
+
+X_SIZE, Y_SIZE, TIME_SIZE = 4, 3, 2
+
+
+def write_input(path):
+    with Dataset(path, "w") as dataset:
+        dataset.createDimension("time", None)
+        dataset.createDimension("Y", Y_SIZE)
+        dataset.createDimension("X", X_SIZE)
+        dataset.createVariable("time", "i4", ("time",))[:] = np.arange(TIME_SIZE)
+        tair = dataset.createVariable("tair", "f4", ("time", "Y", "X"))
+        tair[:] = np.arange(TIME_SIZE * Y_SIZE * X_SIZE).reshape(
+            TIME_SIZE, Y_SIZE, X_SIZE
+        )
+        # value 10 * x + y at (x, y)
+        drainage = dataset.createVariable("drainage", "i4", ("X", "Y"))
+        drainage[:] = 10 * np.arange(X_SIZE)[:, None] + np.arange(Y_SIZE)[None, :]
+        dataset.createVariable("lat", "f8", ("Y",))[:] = [60.0, 61.0, 62.0]
+
+
+def test_read_coordinates_swaps_the_failed_cell_coords(tmp_path):
+    path = tmp_path / "failed_cell_coords.txt"
+    # (row, column) tuples of the run status matrix, i.e. (Y, X)
+    path.write_text("(1, 3)\n(0, 2)\n(1, 3)\n")
+
+    assert read_coordinates(path) == [(3, 1), (2, 0)]
+
+
+def test_read_coordinates_of_csv_files(tmp_path):
+    with_header = tmp_path / "with_header.csv"
+    with_header.write_text("Y,X\n1,3\n0,2\n")
+    without_header = tmp_path / "without_header.csv"
+    without_header.write_text("3,1\n2,0\n\n3,1\n")
+
+    assert read_coordinates(with_header) == [(3, 1), (2, 0)]
+    assert read_coordinates(without_header) == [(3, 1), (2, 0)]
+
+
+def test_extract_cells_packs_the_cells_along_x(tmp_path):
+    src_path = tmp_path / "input.nc"
+    write_input(src_path)
+    cells = [(3, 1), (0, 2), (1, 1)]
+    packed_path, single_path = tmp_path / "packed.nc", tmp_path / "single.nc"
+
+    extract_cells(src_path, {packed_path: cells, single_path: [(2, 0)]})
+
+    with Dataset(src_path) as src, Dataset(packed_path) as packed:
+        assert packed.dimensions["X"].size == 3 and packed.dimensions["Y"].size == 1
+        for index, (x, y) in enumerate(cells):
+            np.testing.assert_array_equal(
+                packed["tair"][:, 0, index], src["tair"][:, y, x]
+            )
+            assert packed["drainage"][index, 0] == 10 * x + y
+        # lat has no X dimension, it's taken from the first cell
+        assert packed["lat"][:].tolist() == [61.0]
+        np.testing.assert_array_equal(packed["time"][:], src["time"][:])
+
+    with Dataset(single_path) as single:
+        assert single["drainage"][:].tolist() == [[20]]
+        assert single["tair"][:, 0, 0].tolist() == [2.0, 14.0]
@@ -0,0 +1,57 @@
+import pytest
+
+from batch_processing.utils.install_cache import (
+    PARTIAL_SUFFIX,
+    activate_install,
+    get_active_install,
+    get_cached_installs,
+    get_prebuilt_key,
+)
+
+BLOBS = [("bin/dvmdostem", 2048, "AAAAAA=="), ("config/config.js", 512, "BBBBBB==")]
+
+
+def test_get_prebuilt_key_ignores_the_listing_order():
+    key = get_prebuilt_key(BLOBS)
+
+    assert key.startswith("prebuilt-") and len(key) == len("prebuilt-") + 16
+    assert get_prebuilt_key(reversed(BLOBS)) == key
+
+
+def test_get_prebuilt_key_changes_with_the_files():
+    key = get_prebuilt_key(BLOBS)
+
+    assert get_prebuilt_key(BLOBS[:1]) != key
+    assert get_prebuilt_key([BLOBS[0], ("config/config.js", 512, "CCCCCC==")]) != key
+    assert get_prebuilt_key([BLOBS[0], ("config/config.js", 513, "BBBBBB==")]) != key
+
+
+def test_get_cached_installs_skips_partial_installs(tmp_path):
+    for name in ("commit-0123456789ab", "prebuilt-0123456789abcdef", "other"):
+        (tmp_path / name).mkdir()
+    (tmp_path / f"commit-ba9876543210{PARTIAL_SUFFIX}").mkdir()
+
+    assert get_cached_installs(tmp_path) == [
+        "commit-0123456789ab",
+        "prebuilt-0123456789abcdef",
+    ]
+    assert get_cached_installs(tmp_path / "missing") == []
+
+
+def test_activate_install_replaces_the_symlink(tmp_path):
+    link_path = tmp_path / "dvm-dos-tem"
+    for name in ("commit-1", "commit-2"):
+        (tmp_path / name).mkdir()
+
+    activate_install(tmp_path / "commit-1", link_path)
+    activate_install(tmp_path / "commit-2", link_path)
+
+    assert get_active_install(link_path) == "commit-2"
+
+
+def test_activate_install_keeps_existing_folders(tmp_path):
+    (tmp_path / "dvm-dos-tem").mkdir()
+
+    with pytest.raises(IsADirectoryError):
+        activate_install(tmp_path / "commit-1", tmp_path / "dvm-dos-tem")
+    assert get_active_install(tmp_path / "dvm-dos-tem") is None
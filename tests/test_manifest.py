@@ -0,0 +1,91 @@
+from batch_processing.utils.manifest import (
+    FAILED_STATUS,
+    MANIFEST_FILE_NAME,
+    REBALANCED_STATUS,
+    SPLIT_STATUS,
+    SUBMITTED_STATUS,
+    create_batch_entry,
+    get_batch_dirs,
+    read_manifest,
+    update_batch_jobs,
+    update_batch_statuses,
+    write_manifest,
+)
+
+
+def test_create_batch_entry():
+    entry = create_batch_entry(3, (3, 4), (0, 50), 12)
+
+    assert entry["name"] == "batch_3"
+    assert (entry["y_start"], entry["y_end"]) == (3, 4)
+    assert (entry["x_start"], entry["x_end"]) == (0, 50)
+    assert entry["active_cells"] == 12
+    assert entry["job_id"] is None
+    assert entry["status"] == SPLIT_STATUS
+
+
+def test_manifest_round_trip_sorts_the_batches(tmp_path):
+    batches = [create_batch_entry(i, (i, i + 1), (0, 5), i) for i in (10, 0, 2)]
+    write_manifest(tmp_path, {"X": 5, "Y": 11}, batches)
+
+    manifest = read_manifest(tmp_path)
+    assert manifest["dimensions"] == {"X": 5, "Y": 11}
+    assert [batch["index"] for batch in manifest["batches"]] == [0, 2, 10]
+
+
+def test_get_batch_dirs_reads_the_manifest_without_listing(tmp_path):
+    write_manifest(
+        tmp_path,
+        {"X": 5, "Y": 2},
+        [create_batch_entry(i, (i, i + 1), (0, 5), 1) for i in (0, 1)],
+    )
+    # not in the manifest, so it isn't a batch of this run
+    (tmp_path / "batch_7").mkdir()
+
+    assert get_batch_dirs(tmp_path) == [tmp_path / "batch_0", tmp_path / "batch_1"]
+
+
+def test_get_batch_dirs_falls_back_to_scanning(tmp_path):
+    for index in (10, 2, 0):
+        (tmp_path / f"batch_{index}").mkdir()
+    (tmp_path / "logs").mkdir()
+
+    assert not (tmp_path / MANIFEST_FILE_NAME).exists()
+    assert [path.name for path in get_batch_dirs(tmp_path)] == [
+        "batch_0",
+        "batch_2",
+        "batch_10",
+    ]
+
+
+def test_update_batch_jobs(tmp_path):
+    write_manifest(
+        tmp_path,
+        {"X": 5, "Y": 2},
+        [create_batch_entry(i, (i, i + 1), (0, 5), 1) for i in (0, 1)],
+    )
+    update_batch_jobs(tmp_path, {"batch_1": "42"}, REBALANCED_STATUS)
+
+    batches = read_manifest(tmp_path)["batches"]
+    assert (batches[0]["job_id"], batches[0]["status"]) == (None, SPLIT_STATUS)
+    assert (batches[1]["job_id"], batches[1]["status"]) == ("42", REBALANCED_STATUS)
+
+
+def test_update_batch_jobs_without_a_manifest(tmp_path):
+    update_batch_jobs(tmp_path, {"batch_1": "42"})
+
+    assert read_manifest(tmp_path) is None
+
+
+def test_update_batch_statuses_keeps_the_jobs(tmp_path):
+    write_manifest(
+        tmp_path,
+        {"X": 5, "Y": 2},
+        [create_batch_entry(i, (i, i + 1), (0, 5), 1) for i in (0, 1)],
+    )
+    update_batch_jobs(tmp_path, {"batch_0": "41", "batch_1": "42"})
+    update_batch_statuses(tmp_path, {"batch_1": FAILED_STATUS})
+
+    batches = read_manifest(tmp_path)["batches"]
+    assert [batch["status"] for batch in batches] == [SUBMITTED_STATUS, FAILED_STATUS]
+    assert [batch["job_id"] for batch in batches] == ["41", "42"]
@@ -0,0 +1,19 @@
+from batch_processing.cmd.monitor import format_job_ids
+
+
+def test_format_job_ids_plain_ids():
+    assert format_job_ids(["12", "15"]) == "12,15"
+
+
+def test_format_job_ids_array_ranges():
+    assert format_job_ids(["12_1", "12_2", "12_3", "12_7", "15"]) == "12_[1-3,7],15"
+
+
+def test_format_job_ids_single_and_unsorted_array_tasks():
+    assert format_job_ids(["12_4"]) == "12_4"
+    assert format_job_ids(["12_3", "12_1", "12_2", "12_2"]) == "12_[1-3]"
+
+
+def test_format_job_ids_plain_id_that_is_also_an_array_id():
+    assert format_job_ids(["12", "12_1"]) == "12,12_1"
+    assert format_job_ids(["12_1", "12", "12_2"]) == "12_[1-2],12"
@@ -0,0 +1,66 @@
+from batch_processing.cmd.batch.rebalance import REBALANCE_FILE_NAME
+from batch_processing.cmd.batch.retry import (
+    find_failed_batches,
+    record_batch_statuses,
+)
+from batch_processing.utils.manifest import (
+    DONE_STATUS,
+    FAILED_STATUS,
+    REBALANCED_STATUS,
+    SPLIT_STATUS,
+    create_batch_entry,
+    read_manifest,
+    write_manifest,
+)
+from batch_processing.utils.utils import write_json_file
+
+
+def make_batches(base_batch_dir, count):
+    for index in range(count):
+        (base_batch_dir / f"batch_{index}" / "output").mkdir(parents=True)
+
+
+def test_find_failed_batches_skips_batches_in_rebalance_json(tmp_path):
+    make_batches(tmp_path, 2)
+    layout = {
+        "batch_0": {"cancelled_job_id": "1", "sub_batches": [], "stitched": False}
+    }
+    write_json_file(tmp_path / REBALANCE_FILE_NAME, {"batches": layout})
+
+    assert find_failed_batches(tmp_path, {0: 0, 1: 0}) == {
+        "batch_1": "run_status.nc is missing"
+    }
+
+
+def test_find_failed_batches_skips_rebalanced_batches_of_the_manifest(tmp_path):
+    make_batches(tmp_path, 2)
+    batches = [create_batch_entry(i, (i, i + 1), (0, 5), 1) for i in range(2)]
+    batches[1]["status"] = REBALANCED_STATUS
+    write_manifest(tmp_path, {"X": 5, "Y": 2}, batches)
+
+    assert find_failed_batches(tmp_path, {0: 0, 1: 0}) == {
+        "batch_0": "run_status.nc is missing"
+    }
+
+
+def test_record_batch_statuses(tmp_path):
+    batches = [create_batch_entry(i, (i, i + 1), (0, 5), 1) for i in range(5)]
+    for index in (3, 4):
+        batches[index]["status"] = REBALANCED_STATUS
+    write_manifest(tmp_path, {"X": 5, "Y": 5}, batches)
+    layout = {
+        "batch_3": {"cancelled_job_id": "3", "sub_batches": [], "stitched": True},
+        "batch_4": {"cancelled_job_id": "4", "sub_batches": [], "stitched": False},
+    }
+    write_json_file(tmp_path / REBALANCE_FILE_NAME, {"batches": layout})
+
+    failed = {"batch_1": "2 cells failed", "batch_2": "run_status.nc is missing"}
+    record_batch_statuses(tmp_path, failed, skipped={"batch_2"})
+
+    assert [batch["status"] for batch in read_manifest(tmp_path)["batches"]] == [
+        DONE_STATUS,
+        FAILED_STATUS,
+        SPLIT_STATUS,
+        DONE_STATUS,
+        REBALANCED_STATUS,
+    ]
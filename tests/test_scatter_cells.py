@@ -0,0 +1,73 @@
+import numpy as np
+from netCDF4 import Dataset
+
+from batch_processing.cmd.extract_cell import extract_cells
+from batch_processing.cmd.scatter_cells import scatter_file
+
+X_SIZE, Y_SIZE, TIME_SIZE = 5, 4, 3
+
+
+def write_outputs(path, zeros=False):
+    """Writes a file with the grid layouts of the restart and run_status files."""
+    with Dataset(path, "w") as dataset:
+        dataset.createDimension("time", TIME_SIZE)
+        dataset.createDimension("Y", Y_SIZE)
+        dataset.createDimension("X", X_SIZE)
+        variables = {
+            "run_status": ("Y", "X"),
+            "dsnow": ("time", "Y", "X"),
+            "drainage": ("X", "Y"),
+        }
+        for offset, (name, dims) in enumerate(variables.items()):
+            shape = tuple(dataset.dimensions[dim].size for dim in dims)
+            values = np.arange(np.prod(shape)).reshape(shape) + 100 * offset
+            dataset.createVariable(name, "i4", dims)[:] = 0 if zeros else values
+
+
+def test_scatter_file_writes_packed_cells_back(tmp_path):
+    original_path = tmp_path / "original.nc"
+    packed_path = tmp_path / "packed.nc"
+    merged_path = tmp_path / "merged.nc"
+    write_outputs(original_path)
+    write_outputs(merged_path, zeros=True)
+    cells = [(4, 0), (1, 3), (2, 2)]
+
+    extract_cells(original_path, {packed_path: cells})
+    scatter_file(
+        packed_path,
+        merged_path,
+        [{"index": index, "X": x, "Y": y} for index, (x, y) in enumerate(cells)],
+    )
+
+    with Dataset(original_path) as original, Dataset(merged_path) as merged:
+        for name in ("run_status", "dsnow", "drainage"):
+            expected = np.zeros_like(original[name][:])
+            for x, y in cells:
+                index = [slice(None)] * expected.ndim
+                dims = original[name].dimensions
+                index[dims.index("X")], index[dims.index("Y")] = x, y
+                expected[tuple(index)] = original[name][:][tuple(index)]
+
+            np.testing.assert_array_equal(merged[name][:], expected)
+
+
+def test_scatter_file_with_lower_case_dimensions(tmp_path):
+    packed_path, merged_path = tmp_path / "packed.nc", tmp_path / "merged.nc"
+    for path, x_size, y_size in ((packed_path, 2, 1), (merged_path, 3, 2)):
+        with Dataset(path, "w") as dataset:
+            dataset.createDimension("time", 2)
+            dataset.createDimension("y", y_size)
+            dataset.createDimension("x", x_size)
+            gpp = dataset.createVariable("GPP", "f4", ("time", "y", "x"))
+            gpp[:] = np.zeros((2, y_size, x_size))
+            if path == packed_path:
+                gpp[:] = [[[1.0, 2.0]], [[3.0, 4.0]]]
+
+    cells = [{"index": 0, "X": 2, "Y": 1}, {"index": 1, "X": 0, "Y": 0}]
+    scatter_file(packed_path, merged_path, cells)
+
+    with Dataset(merged_path) as merged:
+        assert merged["GPP"][:].tolist() == [
+            [[2.0, 0.0, 0.0], [0.0, 0.0, 1.0]],
+            [[4.0, 0.0, 0.0], [0.0, 0.0, 3.0]],
+        ]
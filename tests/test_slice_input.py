@@ -0,0 +1,25 @@
+import numpy as np
+import pytest
+
+from batch_processing.cmd.slice_input import SliceTask, create_tiles, slice_file
+
+
+def test_create_tiles_covers_the_grid_with_balanced_tiles():
+    run_mask = np.zeros((4, 6), dtype=int)
+    run_mask[:, :3] = 1
+
+    tiles = create_tiles(run_mask, y_slices=2, x_slices=2)
+
+    assert [tile.id for tile in tiles] == [0, 1, 2, 3]
+    assert [tile.active_cells for tile in tiles] == [4, 2, 4, 2]
+    assert sum(tile.active_cells for tile in tiles) == run_mask.sum()
+    assert [(tile.y.start, tile.y.end) for tile in tiles] == [(0, 2)] * 2 + [(2, 4)] * 2
+    assert [(tile.x.start, tile.x.end) for tile in tiles[:2]] == [(0, 2), (2, 6)]
+    assert tiles[0].name == "0_2_0_2"
+
+
+def test_slice_file_raises_when_the_source_cant_be_read(tmp_path):
+    task = SliceTask(tmp_path / "missing.nc", [], [], 1024**2)
+
+    with pytest.raises(OSError):
+        slice_file(task)
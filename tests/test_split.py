@@ -0,0 +1,55 @@
+import numpy as np
+import xarray as xr
+
+from batch_processing.cmd.batch.split import get_band_size, get_previous_run_paths
+
+
+def make_dataset(rows=10, columns=4, chunk_rows=None):
+    ds = xr.Dataset(
+        {"tair": (("Y", "X"), np.zeros((rows, columns), dtype="float64"))},
+        coords={"Y": np.arange(rows), "X": np.arange(columns)},
+    )
+    if chunk_rows is not None:
+        ds.tair.encoding["chunks"] = (chunk_rows, columns)
+    return ds
+
+
+def test_get_band_size_follows_the_zarr_chunks():
+    assert get_band_size(make_dataset(chunk_rows=3)) == 3
+
+
+def test_get_band_size_without_chunks_reads_every_row():
+    assert get_band_size(make_dataset()) == 10
+
+
+def test_get_band_size_is_capped_by_the_memory():
+    # a row of 4 float64 values takes 32 bytes
+    assert get_band_size(make_dataset(chunk_rows=8), memory=32 * 5) == 5
+    assert get_band_size(make_dataset(chunk_rows=8), memory=1) == 1
+
+
+def test_get_band_size_without_y_variables():
+    ds = make_dataset().drop_vars("tair")
+    ds["lat"] = ("X", np.zeros(4))
+
+    assert get_band_size(ds) == 10
+
+
+def test_get_previous_run_paths_includes_the_manifest_and_run_state(tmp_path):
+    for name in ("batch_0", "batch_12", "batch_x", "logs"):
+        (tmp_path / name).mkdir()
+    state_files = ["jobs.json", "rebalance.json", "retry.json", "placement.json"]
+    for name in [*state_files, "manifest.json"]:
+        (tmp_path / name).write_text("{}")
+    (tmp_path / "job_times.csv").touch()
+
+    assert sorted(path.name for path in get_previous_run_paths(tmp_path)) == [
+        "batch_0",
+        "batch_12",
+        "jobs.json",
+        "manifest.json",
+        "placement.json",
+        "rebalance.json",
+        "retry.json",
+    ]
+    assert get_previous_run_paths(tmp_path / "missing") == []